@@ -4,43 +4,83 @@
 # imports
 # <<<1
 
+# the modules that are not needed to start the program (numpy, Pillow...) are
+# only imported when they are used, see ``lazy_import``
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """return a module that is only imported (executed) the first time one of
+    its attributes is used"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
 # misc functions
 import copy
 import getopt
-import sys
 import os
 import os.path
 from itertools import product
 import re
+import io
 import json
+import time
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
+hashlib = lazy_import("hashlib")
+platform = lazy_import("platform")
+tempfile = lazy_import("tempfile")
+glob = lazy_import("glob")
+traceback = lazy_import("traceback")
+tracemalloc = lazy_import("tracemalloc")
+http_server = lazy_import("http.server")
+urllib_parse = lazy_import("urllib.parse")
 
 # math
 from cmath import exp
-from math import sqrt, pi, sin, cos, asin, atan2, ceil
-from random import randrange, uniform, shuffle, seed
+from math import sqrt, pi, sin, cos, asin, atan2, ceil, floor, isqrt
+from math import log2, log10
+from random import uniform, shuffle, seed
 
 # multiprocessing
-from multiprocessing import Process, Queue
+multiprocessing = lazy_import("multiprocessing")
 import queue
+import threading
 
-# Tkinter for GUI
+# Tkinter for GUI (the GUI classes inherit from tkinter classes, but the other
+# tkinter modules are only imported when the GUI is started)
 from tkinter import Tk, Canvas, Label, Frame, LabelFrame, Entry, Text, Menu
 from tkinter import Button, Checkbutton, Radiobutton, Listbox, Scrollbar, Toplevel
 from tkinter import StringVar, BooleanVar
 import tkinter as tk
-from tkinter.ttk import Combobox, Notebook, Style
-import tkinter.font
-from tkinter import filedialog, messagebox
+ttk = lazy_import("tkinter.ttk")
+lazy_import("tkinter.font")
+filedialog = lazy_import("tkinter.filedialog")
+messagebox = lazy_import("tkinter.messagebox")
 
 # vectorized arrays
-import numpy as np
-import numexpr as ne
+np = lazy_import("numpy")
+ne = lazy_import("numexpr")
 
 # image manipulation (Pillow)
 import PIL
-from PIL import ImageDraw
-import PIL.ImageTk
-from PIL.ImageColor import getrgb
+lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+lazy_import("PIL.ImageFont")
+lazy_import("PIL.ImageTk")
+ImageColor = lazy_import("PIL.ImageColor")
 
 # >>>1
 
@@ -75,7 +115,7 @@ DEFAULT_BACKGROUND = "#000066"
 # color of random pixels ("stars") for sphere patterns
 STAR_COLOR = "#FFC"
 NB_STARS = 500
-FADE_COEFF = 200
+FADE_COEFF = 100
 
 # misc GUI options
 COLOR_SIZE = 180            # size of colorwheel image in GUI
@@ -83,9 +123,134 @@ PREVIEW_SIZE = 400          # size of preview image in GUI
 STRETCH_DISPLAY_RADIUS = 5  # how much of the "stretched" colorwheel to display
 UNDO_SIZE = 100             # size of undo stack
 
+# previews requested while a key is held down (see ``PreviewScheduler``):
+# target time for a preview (in seconds), delay without request after which
+# the input is finished, minimal resolution of the previews, and number of
+# previews in the statistics
+PREVIEW_FRAME_TIME = 0.1
+PREVIEW_IDLE_TIME = 0.3
+PREVIEW_MIN_SCALE = 0.25
+PREVIEW_HISTORY = 50
+
 # process images using blocks of that many pixels (0 => process everything at
-# once)
-BLOCK_SIZE = 2000
+# once, "auto" => choose the blocks from available memory / cache sizes, see
+# ``plan_blocks``)
+BLOCK_SIZE = "auto"
+
+# engine used for wallpaper patterns (see ``make_wallpaper_image``): "direct"
+# (one exponential per coefficient and pixel), "fft" (values on a grid of the
+# unit cell computed with an inverse FFT, and interpolated), "nufft" (non
+# uniform FFT, more precise) or "auto" (the fastest one)
+WALLPAPER_ENGINE = "direct"
+
+# FFT engines: maximal error of the values, maximal size of the grid for the
+# "fft" engine, and costs used by the "auto" engine, relative to the cost of
+# a coefficient for a pixel with the direct engine: cost of the interpolation
+# for a pixel, of a point of the spreading kernel for a pixel ("nufft"
+# engine), and of the FFT for a point of the grid (times log2 of its size)
+FFT_TOLERANCE = 1e-3
+FFT_MAX_GRID = 2048
+FFT_PIXEL_COST = 2
+NUFFT_PIXEL_COST = 0.4
+FFT_GRID_COST = 0.15
+
+# engine used for hyperbolic patterns (see ``make_hyperbolic_image``):
+# "direct" (the averaging steps are computed at each point) or "reduce" (the
+# points are first moved into the fundamental domain of the modular group),
+# and maximal number of steps for the reduction
+HYPER_ENGINE = "direct"
+HYPER_MAX_REDUCTIONS = 200
+
+# compute the complex values of images with a rotational symmetry around the
+# origin (wallpaper_N, rosettes) only for one sector, and interpolate them for
+# the others (see ``sector_field``), and cost of the rotation / interpolation
+# for a pixel, relative to the cost of a coefficient for a pixel (the sectors
+# are only used when they are faster)
+ROTATION_SECTORS = False
+SECTOR_PIXEL_COST = 5
+
+# cost of the coordinates / accumulators for a pixel, relative to the cost of
+# a coefficient for a pixel with the direct engines
+EVALUATION_PIXEL_COST = 2
+
+# engine for frieze patterns: "direct" or "period" (compute a single period
+# and replicate it, see ``frieze_field``), and number of samples per pixel in
+# the period when it isn't a whole number of pixels
+FRIEZE_ENGINE = "direct"
+FRIEZE_OVERSAMPLING = 2
+
+# number of pixels computed at once by ``sector_field`` / ``frieze_field``
+FIELD_CHUNK = 2**18
+
+# width of the equirectangular texture used for sphere display (0: compute
+# the pattern for each pixel, see ``sphere_texture``), and memory used by the
+# textures kept between images
+SPHERE_TEXTURE = 0
+SPHERE_TEXTURE_CACHE_SIZE = 2**28
+SPHERE_TEXTURES = None
+
+# limits for automatic block sizes: fraction of the available memory that
+# can be used by the blocks, size of the arrays of a block relative to the L2
+# cache (numexpr goes through the arrays in small chunks, so that blocks
+# a few times bigger than the L2 cache are the fastest), and minimal number of
+# pixels in a block (each block costs about 1ms)
+BLOCK_MEMORY_FRACTION = 0.5
+BLOCK_CACHE_FACTOR = 4
+BLOCK_MIN_PIXELS = 2**14
+
+# benchmarks: random seed for the matrices, number of runs for each
+# configuration (the best time is kept) and relative slowdown considered as a
+# regression when comparing with a baseline
+BENCHMARK_SEED = 1234
+BENCHMARK_REPEAT = 3
+BENCHMARK_THRESHOLD = 0.2
+
+# on disk cache for computed images (see ``RenderCache``): directory, maximal
+# size (in bytes) and version of the engines (to increase when the results of
+# the computations change, so that old cache entries are ignored)
+CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "create_symmetry"
+)
+CACHE_SIZE = 2**30
+CACHE_VERSION = 1
+
+# cache used for previews / output jobs (None: no cache), see ``--cache``
+RENDER_CACHE = None
+
+# maximal size (in bytes) of the in memory cache of a ``Renderer``
+RENDERER_CACHE_SIZE = 2**28
+
+# render server (see ``RenderService``): default address, maximal size (in
+# bytes) of the in memory cache shared by the requests and maximal number of
+# pixels of a requested image
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8642
+SERVER_CACHE_SIZE = 2**30
+SERVER_MAX_PIXELS = 2**24
+
+# maximal number of pixels for cached arrays of coordinates (identical
+# geometries are common in previews and batch jobs)
+COORDINATES_CACHE_PIXELS = 2**20
+
+# random search: number of candidates, size of thumbnails (largest side),
+# number of results to keep and density of edges preferred by the score (see
+# ``image_statistics``)
+SEARCH_CANDIDATES = 200
+SEARCH_SIZE = 128
+SEARCH_TOP = 16
+SEARCH_EDGE_DENSITY = 0.15
+
+# gallery: size of the images and random seed for the matrix
+GALLERY_SIZE = 256
+GALLERY_SEED = 1
+
+# minimal delay (in seconds) between two progress reports sent by a job
+PROGRESS_INTERVAL = 0.1
+
+# profiling of the computation of images: None (no profiling) or a Profiler
+# object, see ``profile``
+PROFILER = None
 
 # keep a random seed to display random pixels in sphere images. The pixels
 # should always be at the same place during a run of the program to prevent
@@ -773,42 +938,54 @@ NAMES = [       # <<<2
 # add names for frieze patterns
 NAMES = NAMES + [p.replace("N", "∞") for p in NAMES if "N" in p]
 
-# full names, with alternative names, for wallpaper groups
-W_NAMES = ["{} ({})".format(p, PATTERN[p]["alt_name"])
-           for p in NAMES
-           if PATTERN[p]["type"] == "plane group"]
-_t = None
-for i in range(len(W_NAMES)):
-    p = W_NAMES[i].split()[0]
-    t = PATTERN[p]["description"].split()[0]
-    if _t != t:
-        W_NAMES[i] += "         -- {}".format(t)
-    _t = t
-del p
-
-# full names, with alternative names, for sphere groups
-S_NAMES = ["{} ({})".format(p, PATTERN[p]["alt_name"])
-           for p in NAMES
-           if PATTERN[p]["type"] == "sphere group"]
-_t = None
-for i in range(len(S_NAMES)):
-    p = S_NAMES[i].split()[0]
-    t = PATTERN[p]["description"].split()[0]
-    if _t != t:
-        S_NAMES[i] += "     -- {}".format(t)
-    _t = t
-del p
-del _t
-
-# full names, with alternative names, for frieze groups
-F_NAMES = ["{} ({})".format(p, PATTERN[p]["alt_name"])
-           for p in NAMES
-           if PATTERN[p]["type"] == "frieze"]
-
-
-# full names, with alternative names, for color reversing groups, as a function
-# of the symmetry groups
-def C_NAMES(s):
+
+def group_names(kind, padding=None):       # <<<2
+    """full names, with alternative names, for the groups of a given type
+    ("plane group", "sphere group" or "frieze"), in the order of the menus
+    if ``padding`` is given, the first group of each lattice / symmetry gets
+    the first word of its description after ``padding`` spaces"""
+    names = []
+    _t = None
+    for p in NAMES:
+        if PATTERN[p]["type"] != kind:
+            continue
+        name = "{} ({})".format(p, PATTERN[p]["alt_name"])
+        t = PATTERN[p]["description"].split()[0] if padding else None
+        if _t != t:
+            name += "{}-- {}".format(" " * padding, t)
+        _t = t
+        names.append(name)
+    return tuple(names)
+# >>>2
+
+
+# the following tables are only computed when needed (menus of the GUI,
+# pattern names on the command line)
+@lru_cache(maxsize=None)
+def W_NAMES():      # <<<2
+    """full names, with alternative names, for wallpaper groups"""
+    return group_names("plane group", 9)
+# >>>2
+
+
+@lru_cache(maxsize=None)
+def S_NAMES():      # <<<2
+    """full names, with alternative names, for sphere groups"""
+    return group_names("sphere group", 5)
+# >>>2
+
+
+@lru_cache(maxsize=None)
+def F_NAMES():      # <<<2
+    """full names, with alternative names, for frieze groups"""
+    return group_names("frieze")
+# >>>2
+
+
+@lru_cache(maxsize=32)
+def C_NAMES(s):     # <<<2
+    """full names, with alternative names, for color reversing groups, as a
+    function of the symmetry group"""
     r = []
     # we need to deal with the two groups for **/**
     names = copy.deepcopy(NAMES)
@@ -823,7 +1000,7 @@ def C_NAMES(s):
             else:
                 q = ""
             r.append("{}{} ({}{})".format(p, q, PATTERN[p]["alt_name"], q))
-    return r
+    return tuple(r)
 # >>>2
 # >>>1
 
@@ -849,6 +1026,362 @@ def message(*args, **kwargs):       # <<<2
 # >>>2
 
 
+class Profiler(object):     # <<<2
+    """accumulate wall time, number of pixels and allocated bytes for the
+    different stages of the computation of an image"""
+
+    def __init__(self):     # <<<3
+        self.start = time.perf_counter()
+        self.stages = {}
+    # >>>3
+
+    def add(self, name, duration=0, pixels=0, nbytes=0, calls=1):     # <<<3
+        stage = self.stages.setdefault(
+            name,
+            {"calls": 0, "time": 0, "pixels": 0, "bytes": 0}
+        )
+        stage["calls"] += calls
+        stage["time"] += duration
+        stage["pixels"] += pixels
+        stage["bytes"] += nbytes
+    # >>>3
+
+    @contextmanager
+    def stage(self, name, pixels=0):        # <<<3
+        """context manager timing a stage"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start, pixels)
+    # >>>3
+
+    def report(self):       # <<<3
+        """return a dictionary with the statistics for each stage (and the
+        total time since the profiler was created)"""
+        res = {"total_time": time.perf_counter() - self.start}
+        for name, stage in self.stages.items():
+            stage = dict(stage)
+            if stage["pixels"] and stage["time"]:
+                stage["pixels_per_second"] = stage["pixels"] / stage["time"]
+            res[name] = stage
+        return res
+    # >>>3
+
+    def summary(self):      # <<<3
+        """return a table with the statistics for each stage"""
+        report = self.report()
+        total = report.pop("total_time")
+        lines = ["{:12} {:>6} {:>10} {:>6} {:>12} {:>10}"
+                 .format("stage", "calls", "time", "%", "Mpix/s", "MB")]
+        for name, stage in sorted(report.items(), key=lambda s: -s[1]["time"]):
+            lines.append("{:12} {:6} {:9.3f}s {:5.1f}% {:>12} {:10.1f}".format(
+                name,
+                stage["calls"],
+                stage["time"],
+                100 * stage["time"] / total if total else 0,
+                "{:.2f}".format(stage["pixels_per_second"]/1e6)
+                if "pixels_per_second" in stage else "--",
+                stage["bytes"] / 2**20
+            ))
+        lines.append("{:12} {:>6} {:9.3f}s".format("total", "", total))
+        return "\n".join(lines)
+    # >>>3
+# >>>2
+
+
+class Progress(object):     # <<<2
+    """progress reports for the computation of an image
+
+    The progress is counted in pixels of the image: the engines call
+    ``steps`` at the beginning of each evaluation and ``step`` for each
+    coefficient, which advances the progress by a fraction of the pixels of
+    the evaluation. Stages that compute the values of a different set of
+    pixels (sector or period of the image, sphere texture, etc.) call
+    ``evaluate`` once with their number of pixels, so that they cover the rest
+    of the job. The progress never goes back.
+    A report is only sent (with ``send``) every ``interval`` seconds, and at
+    the end of the job. Reports are dictionaries with keys
+      - "job": the job identifier
+      - "stage": "computing", "background" or "done"
+      - "progress": fraction of the job done (between 0 and 1)
+      - "blocks": number of blocks done and total number of blocks
+      - "elapsed", "eta": time since the beginning / estimated remaining
+        time, in seconds (eta is None at the beginning)
+      - "pixels_per_second"
+
+    ``send`` is typically the ``put`` method of a queue
+    """
+
+    def __init__(self,      # <<<3
+                 send,
+                 job=None,
+                 nb_blocks=1,
+                 pixels=0,
+                 interval=PROGRESS_INTERVAL):
+        self.send = send
+        self.job = job
+        self.nb_blocks = nb_blocks
+        self.pixels = pixels
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.next_report = self.start
+        self.stage = "computing"
+        self.nb_block = 0
+        self.done = 0           # pixels done
+        self.end = 0            # pixels done at the end of the evaluation
+        self.scale = 1          # pixels of the image for a computed value
+        self.step_size = 0
+    # >>>3
+
+    def block(self, nb_block):      # <<<3
+        """start computing a new block"""
+        self.nb_block = nb_block
+    # >>>3
+
+    def evaluate(self, pixels):     # <<<3
+        """the rest of the job consists in computing ``pixels`` values"""
+        self.done = max(self.done, self.end)
+        self.scale = (self.pixels - self.done) / max(pixels, 1)
+    # >>>3
+
+    def skip(self, pixels):     # <<<3
+        """``pixels`` values don't need to be computed"""
+        self.done = self.end = min(max(self.done, self.end) +
+                                   pixels*self.scale, self.pixels)
+    # >>>3
+
+    def steps(self, nb_steps, pixels):       # <<<3
+        """start the computation of ``pixels`` values in ``nb_steps`` steps"""
+        self.done = max(self.done, self.end)
+        self.end = min(self.done + pixels*self.scale, self.pixels)
+        self.step_size = (self.end - self.done) / max(nb_steps, 1)
+    # >>>3
+
+    def step(self):     # <<<3
+        """a step of the current evaluation is done"""
+        self.done = min(self.done + self.step_size, self.end)
+        if time.perf_counter() >= self.next_report:
+            self.report()
+    # >>>3
+
+    def progress(self):     # <<<3
+        if self.stage != "computing":
+            return 1
+        return self.done / max(self.pixels, 1)
+    # >>>3
+
+    def event(self):        # <<<3
+        """return the current progress report"""
+        elapsed = time.perf_counter() - self.start
+        progress = self.progress()
+        if progress > 0 and elapsed > 0:
+            eta = elapsed * (1-progress) / progress
+            pixels_per_second = progress * self.pixels / elapsed
+        else:
+            eta = None
+            pixels_per_second = 0
+        return {
+            "job": self.job,
+            "stage": self.stage,
+            "progress": progress,
+            "blocks": (self.nb_block if self.stage == "computing"
+                       else self.nb_blocks, self.nb_blocks),
+            "elapsed": elapsed,
+            "eta": eta,
+            "pixels_per_second": pixels_per_second,
+        }
+    # >>>3
+
+    def report(self, stage=None):        # <<<3
+        """send a report, and change the stage of the job if necessary"""
+        if stage is not None:
+            self.stage = stage
+        self.send(self.event())
+        self.next_report = time.perf_counter() + self.interval
+    # >>>3
+# >>>2
+
+
+class PreviewScheduler(object):     # <<<2
+    """decide the resolution of previews and gather statistics about them
+
+    A request arriving less than ``idle`` seconds after the previous one is
+    part of a burst (key repeat). During a burst, previews are computed with
+    fewer pixels, so that they take about ``frame_time`` seconds (from the
+    time per pixel of the previous previews), but with at least
+    ``min_scale`` times the resolution in each direction. The resolution is
+    1/k (every k-th pixel of the preview) and is the same for a whole burst,
+    so that translations by multiples of k pixels can reuse the previous
+    preview (see ``pan_image``). The GUI
+      - snaps translations to multiples of ``pixel_step`` pixels,
+      - calls ``request`` for each change of the parameters,
+      - calls ``start`` / ``done`` when a preview is started / displayed,
+      - computes a full resolution preview when the burst is over (``idle``)
+    """
+
+    def __init__(self,      # <<<3
+                 frame_time=PREVIEW_FRAME_TIME,
+                 idle=PREVIEW_IDLE_TIME,
+                 min_scale=PREVIEW_MIN_SCALE,
+                 history=PREVIEW_HISTORY):
+        self.frame_time = frame_time
+        self.idle_time = idle
+        self.min_scale = min_scale
+        self.history = history
+        self.burst = False
+        self.burst_scale = None
+        self.last_request = None
+        self.seconds_per_pixel = None
+        self.started = None
+        self.pixels = 0
+        self.scale = 1
+        self.frame_times = []
+        self.nb_requests = 0
+        self.nb_frames = 0
+    # >>>3
+
+    def request(self, now=None):        # <<<3
+        """record a request for a new preview, and return True when it is
+        part of a burst"""
+        now = time.perf_counter() if now is None else now
+        self.burst = (self.last_request is not None and
+                      now - self.last_request < self.idle_time)
+        if not self.burst:
+            self.burst_scale = None
+        self.last_request = now
+        self.nb_requests += 1
+        return self.burst
+    # >>>3
+
+    def idle(self, now=None):       # <<<3
+        """is the last burst of requests over?"""
+        now = time.perf_counter() if now is None else now
+        return (self.last_request is None or
+                now - self.last_request >= self.idle_time)
+    # >>>3
+
+    def _burst_scale(self, pixels):     # <<<3
+        """choose the resolution 1/k of the current burst, if necessary"""
+        if self.burst_scale is None:
+            if self.seconds_per_pixel is None:
+                return 1
+            scale = sqrt(self.frame_time / (self.seconds_per_pixel * pixels))
+            k = min(ceil(1/scale - 1e-9), floor(1/self.min_scale))
+            self.burst_scale = 1 / max(k, 1)
+        return self.burst_scale
+    # >>>3
+
+    def preview_scale(self, pixels, now=None):      # <<<3
+        """resolution (1/k, between min_scale and 1) to use for a preview with
+        ``pixels`` pixels at full resolution"""
+        if not self.burst or self.idle(now):
+            return 1
+        return self._burst_scale(pixels)
+    # >>>3
+
+    def pixel_step(self, pixels, now=None):      # <<<3
+        """number k of pixels between the pixels of a preview requested now
+        (1 unless it is part of a burst)"""
+        if self.idle(now):
+            return 1
+        return round(1 / self._burst_scale(pixels))
+    # >>>3
+
+    def start(self, pixels, scale=1, now=None):        # <<<3
+        """a preview with ``pixels`` pixels is started"""
+        self.started = time.perf_counter() if now is None else now
+        self.pixels = pixels
+        self.scale = scale
+    # >>>3
+
+    def done(self, now=None):       # <<<3
+        """the last preview started is done"""
+        if self.started is None:
+            return
+        now = time.perf_counter() if now is None else now
+        elapsed = now - self.started
+        self.started = None
+        self.nb_frames += 1
+        self.frame_times = (self.frame_times + [elapsed])[-self.history:]
+        seconds_per_pixel = elapsed / max(self.pixels, 1)
+        if self.seconds_per_pixel is None:
+            self.seconds_per_pixel = seconds_per_pixel
+        else:
+            # moving average
+            self.seconds_per_pixel = (self.seconds_per_pixel +
+                                      seconds_per_pixel) / 2
+    # >>>3
+
+    def summary(self):      # <<<3
+        """short description of the statistics about the previews"""
+        if not self.frame_times:
+            return ""
+        times = sorted(self.frame_times)
+        return ("Preview: {:.2f}s (median {:.2f}s, max {:.2f}s), {:.0f}%, "
+                "{}/{} frames".format(
+                    self.frame_times[-1],
+                    times[len(times)//2],
+                    times[-1],
+                    100*self.scale,
+                    self.nb_frames,
+                    self.nb_requests))
+    # >>>3
+# >>>2
+
+
+def progress_message(event, name=None):       # <<<2
+    """short description of a progress report"""
+    if event["stage"] == "done":
+        msg = "done in {:.1f}s".format(event["elapsed"])
+    else:
+        msg = "{}%".format(int(100*event["progress"]))
+        if event["stage"] != "computing":
+            msg += " ({})".format(event["stage"])
+        elif event["blocks"][1] > 1:
+            msg += " ({}/{} blocks)".format(*event["blocks"])
+        if event["eta"] is not None:
+            msg += ", {:.1f}s left".format(event["eta"])
+        if event["pixels_per_second"]:
+            msg += ", {:.2f} Mpix/s".format(event["pixels_per_second"]/1e6)
+    if name is not None:
+        msg = "{}: {}".format(name, msg)
+    return msg
+# >>>2
+
+
+def progress_bar(event, width=30, file=sys.stderr):      # <<<2
+    """display a progress report on the terminal"""
+    n = round(width*event["progress"])
+    file.write("\r[{}{}] {}".format("#" * n, " " * (width-n),
+                                    progress_message(event))
+               .ljust(width + 50))
+    if event["stage"] == "done":
+        file.write("\n")
+    file.flush()
+# >>>2
+
+
+_NO_PROFILING = nullcontext()
+
+
+def profile(name, pixels=0):        # <<<2
+    """context manager timing a stage of the computation when profiling is
+    active (does nothing otherwise)"""
+    if PROFILER is None:
+        return _NO_PROFILING
+    return PROFILER.stage(name, pixels)
+# >>>2
+
+
+def profile_bytes(name, *arrays):        # <<<2
+    """record the memory used by arrays allocated during a stage of the
+    computation when profiling is active"""
+    if PROFILER is not None:
+        PROFILER.add(name, nbytes=sum(a.nbytes for a in arrays), calls=0)
+# >>>2
+
+
 def sequence(*fs):      # <<<2
     """return a function calling all the argument functions in sequence
     useful for running several functions in a callback
@@ -1025,7 +1558,7 @@ def parse_matrix(s):        # <<<2
 def is_rgb(s):  # <<<2
     """check if a string is a color"""
     try:
-        getrgb(s)
+        ImageColor.getrgb(s)
         return True
     except:
         return False
@@ -1047,19 +1580,21 @@ def random_matrix(nb_coeffs, min_degre=-3, max_degre=3, modulus=1):    # <<<2
 # >>>2
 
 
+@lru_cache(maxsize=2**16)
 def eqn_indices(eq, n, m):        # <<<2
-    """return a list of (s, (j, k))
+    """return a tuple of (s, (j, k))
         - eq is a string representing a list of equations involving "n" and "m"
         - n and m are integers
     for eq = "n,m = -n,m = -{n+m}(m,n)" and n = 7 and m = 4, the result will be
-    [ (1, (7, 4)), (1, (-7, 4)), (-1, (4, 7)) ]
+    ( (1, (7, 4)), (1, (-7, 4)), (-1, (4, 7)) )
+    (results are cached as they are used for all the entries of all matrices)
     """
     eq = eq.strip()
     assert isinstance(n, int)
     assert isinstance(m, int)
 
     if eq == "":
-        return [(1, (n, m))]
+        return ((1, (n, m)),)
 
     try:
         res = []
@@ -1094,10 +1629,11 @@ def eqn_indices(eq, n, m):        # <<<2
                     .format(eq, e))
 
     # print("for {}, {}, {} got {}".format(eq, n, m, res))
-    return res
+    return tuple(res)
 # >>>2
 
 
+@lru_cache(maxsize=2**14)
 def recipe_all_indices(recipe, n, m):   # <<<2
     """BFS like algorithm to compute all the related indices to n and m
         - recipe is a string containing a list of equations, like
@@ -1125,7 +1661,7 @@ def recipe_all_indices(recipe, n, m):   # <<<2
     for n, m in R:
         if (n, m) not in bad:
             L.append((R[(n, m)], (n, m)))
-    return L
+    return tuple(L)
 # >>>2
 
 
@@ -1261,6 +1797,101 @@ def normalize_path(path):       # <<<2
 # >>>2
 
 
+def default_config():      # <<<2
+    """return the default configuration, used for the command line and batch
+    jobs"""
+    return {
+        "colorwheel": {
+            # "filename": None,
+            "default_color": DEFAULT_COLOR,
+            "geometry": COLOR_GEOMETRY,
+            "modulus": 1,
+            "angle": 0,
+            "stretch": False,
+        },
+        "output": {
+            "size": OUTPUT_SIZE,
+            "geometry": OUTPUT_GEOMETRY,
+            "modulus": 1,
+            "angle": 0,
+            "filename_template": FILENAME_TEMPLATE,
+            "save_directory": "./",
+            "draw_tile": False,
+            "draw_orbifold": False,
+            "draw_color_tile": False,
+            "draw_mirrors": False,
+            "fade": False,
+            "fade_coeff": FADE_COEFF,
+            "display_mode": "plain",
+            "sphere_rotations": SPHERE_ROTATIONS,
+            "sphere_texture": SPHERE_TEXTURE,
+            "inversion_center": INVERSION_CENTER,
+            "sphere_background": DEFAULT_BACKGROUND,
+            "sphere_background_fading": 100,
+            "sphere_stars": NB_STARS,
+            "morph": False,
+            "morph_start": 0,
+            "morph_end": 180,
+            "morph_stable_coeff": 20,
+            "block_size": BLOCK_SIZE,
+            "svg_overlay": False,
+        },
+        "function": {
+            "matrix": None,
+            "pattern_type": "wallpaper",
+            "wallpaper_pattern": "o",
+            "wallpaper_color_pattern": "",
+            "lattice_parameters": [],
+            "sphere_pattern": "332",
+            "random_nb_coeffs": 3,
+            "random_min_degre": -3,
+            "random_max_degre": 3,
+            "random_modulus": 1,
+            "random_noise": 25,
+            "wallpaper_N": 1,
+            "sphere_N": 5,
+            "sphere_mode": "sphere",
+            "wallpaper_engine": WALLPAPER_ENGINE,
+            "fft_tolerance": FFT_TOLERANCE,
+            "hyper_nb_steps": 25,
+            "hyper_engine": HYPER_ENGINE,
+            "rotation_sectors": ROTATION_SECTORS,
+            "frieze_engine": FRIEZE_ENGINE,
+            "hyper_s": 3,
+        },
+        "preview": False,
+        "working_directory": "./"}
+# >>>2
+
+
+def merge_config(config, cfg):      # <<<2
+    """update a configuration with the (partial) configuration ``cfg``"""
+    for d in ["colorwheel", "output", "function"]:
+        for k in cfg.get(d, {}):
+            config[d][k] = copy.deepcopy(cfg[d][k])
+    return config
+# >>>2
+
+
+def normalize_config(config):       # <<<2
+    """convert the values of a configuration read from a JSON file (matrix,
+    complex numbers) so that it can be used directly with ``make_image``
+    (the GUI does that when setting its configuration)"""
+    function = config["function"]
+    output = config["output"]
+    if isinstance(function.get("matrix"), list):
+        function["matrix"] = list_to_matrix(function["matrix"])
+    if isinstance(function.get("hyper_s"), str):
+        function["hyper_s"] = str_to_complex(function["hyper_s"])
+    if isinstance(output.get("inversion_center"), str):
+        output["inversion_center"] = str_to_complex(output["inversion_center"])
+    for k in ["size", "geometry", "sphere_rotations"]:
+        if k in output:
+            output[k] = tuple(output[k])
+    return config
+# >>>2
+
+
 def fourrier_identity(degre):       # <<<2
     """Fourrier approximation of the identity function,
     with period (1,0) / (0,1)"""
@@ -1284,14 +1915,21 @@ def make_coordinates_array(         # <<<2
     geometry=OUTPUT_GEOMETRY,
     modulus=1,
     angle=0,
+    cache=True,
 ):
-    """compute the array of floating point numbers associated to each pixel"""
+    """compute the array of floating point numbers associated to each pixel
+    arrays with at most COORDINATES_CACHE_PIXELS pixels are cached (the
+    result is a copy that can be modified)"""
+    if cache and size[0]*size[1] <= COORDINATES_CACHE_PIXELS:
+        return _cached_coordinates_array(tuple(size), tuple(geometry),
+                                         modulus, angle).copy()
+
     rho = modulus * complex(cos(angle*pi/180), sin(angle*pi/180))
 
     x_min, x_max, y_min, y_max = geometry
     width, height = size
-    delta_x = (x_max-x_min) / (width-1)
-    delta_y = (y_max-y_min) / (height-1)
+    delta_x = (x_max-x_min) / max(width-1, 1)
+    delta_y = (y_max-y_min) / max(height-1, 1)
 
     xs = np.arange(width, dtype='float')
     ne.evaluate("delta_x*xs + x_min", out=xs)
@@ -1306,11 +1944,28 @@ def make_coordinates_array(         # <<<2
 # >>>2
 
 
+@lru_cache(maxsize=4)
+def _cached_coordinates_array(size, geometry, modulus, angle):      # <<<2
+    zs = make_coordinates_array(size, geometry, modulus, angle, cache=False)
+    zs.flags.writeable = False
+    return zs
+# >>>2
+
+
 def plane_coordinates_to_sphere(zs, rotations=(0, 0, 0)):       # <<<2
     """transform an array of pixel values into an array of pixel values on the
     sphere
     the original array is taken as the stereographic projection of a sphere of
     radius 1 centered at the origin"""
+    _x, _y, _z = sphere_points(zs, rotations)
+    zs = _x/(1-_z) + 1j*_y/(1-_z)
+    return zs
+# >>>2
+
+
+def sphere_points(zs, rotations=(0, 0, 0)):     # <<<2
+    """compute the points (x, y, z) of the unit sphere seen at the pixels of a
+    sphere image, after the rotations"""
     x = zs.real
     y = zs.imag
     with np.errstate(invalid='ignore'):
@@ -1325,9 +1980,94 @@ def plane_coordinates_to_sphere(zs, rotations=(0, 0, 0)):       # <<<2
     _x = R[0][0]*x + R[0][1]*y + R[0][2]*z
     _y = R[1][0]*x + R[1][1]*y + R[1][2]*z
     _z = R[2][0]*x + R[2][1]*y + R[2][2]*z
+    return _x, _y, _z
+# >>>2
 
-    zs = _x/(1-_z) + 1j*_y/(1-_z)
-    return zs
+
+def sphere_texture_key(function, width):        # <<<2
+    """key of the texture of width ``width`` for a function configuration,
+    in SPHERE_TEXTURES and in render caches"""
+    return render_key("texture", {"sphere_texture": width}, function)
+# >>>2
+
+
+def keep_sphere_texture(key, texture):      # <<<2
+    """keep a texture in memory (SPHERE_TEXTURES) for the next images"""
+    global SPHERE_TEXTURES
+    if SPHERE_TEXTURES is None:
+        SPHERE_TEXTURES = MemoryCache(SPHERE_TEXTURE_CACHE_SIZE)
+    SPHERE_TEXTURES.put(key, texture)
+# >>>2
+
+
+def sphere_texture(function, width, cache=None, progress=None):     # <<<2
+    """compute the complex values of a pattern on the whole sphere, as a
+    (width, width/2) equirectangular texture: the columns are the longitudes
+    (from -pi to pi) and the rows the latitudes (from pi/2 to -pi/2), sampled
+    at the center of the texels
+
+    textures are kept in memory (SPHERE_TEXTURE_CACHE_SIZE bytes) and in
+    ``cache`` when given"""
+    key = sphere_texture_key(function, width)
+    texture = (SPHERE_TEXTURES.get(key) if SPHERE_TEXTURES is not None
+               else None)
+    if texture is None and cache is not None:
+        texture = cache.get(key)
+        if texture is not None:
+            keep_sphere_texture(key, texture)
+    if texture is not None:
+        return texture
+
+    height = max(width // 2, 1)
+    texture = np.empty((width, height), dtype="complex128")
+    with profile("coordinates", width*height):
+        lon = (np.arange(width) + 0.5) * (2*pi / width) - pi
+        lat = pi/2 - (np.arange(height) + 0.5) * (pi / height)
+    if progress is not None:
+        progress.evaluate(width*height)
+    chunk_width = max(1, FIELD_CHUNK // height)
+    for x in range(0, width, chunk_width):
+        with profile("projection", chunk_width*height):
+            lx = lon[x:x+chunk_width, None]
+            ly = lat[None, :]
+            # stereographic projection, as in plane_coordinates_to_sphere
+            zs = ne.evaluate("cos(ly) * (cos(lx) + 1j*sin(lx)) / (1 - sin(ly))")
+        texture[x:x+chunk_width] = make_field(zs, function, progress)
+
+    keep_sphere_texture(key, texture)
+    if cache is not None:
+        cache.put(key, texture)
+    return texture
+# >>>2
+
+
+def sample_sphere_texture(texture, zs, rotations=(0, 0, 0)):     # <<<2
+    """compute the complex values for the pixels of a sphere image by
+    interpolating (bilinearly) an equirectangular texture computed by
+    ``sphere_texture``"""
+    width, height = texture.shape
+    x, y, z = sphere_points(zs, rotations)
+    with profile("interpolation", zs.size):
+        with np.errstate(invalid='ignore'):
+            u = (np.arctan2(y, x) + pi) * (width / (2*pi)) - 0.5
+            v = (pi/2 - np.arcsin(np.clip(z, -1, 1))) * (height / pi) - 0.5
+        # pixels outside the sphere are hidden by the background
+        u = np.nan_to_num(u)
+        v = np.clip(np.nan_to_num(v), 0, height-1)
+        i = np.floor(u)
+        j = np.floor(v)
+        u -= i
+        v -= j
+        i = i.astype(np.int64) % width
+        j = j.astype(np.int64)
+        i1 = (i + 1) % width
+        j1 = np.minimum(j + 1, height-1)
+        f00 = texture[i, j]
+        f10 = texture[i1, j]
+        f01 = texture[i, j1]
+        f11 = texture[i1, j1]
+        return ne.evaluate(
+            "(f00*(1-v) + f01*v)*(1-u) + (f10*(1-v) + f11*v)*u")
 # >>>2
 
 
@@ -1349,7 +2089,7 @@ def apply_color(                    # <<<2
     the resulting image is returned"""
 
     if isinstance(color, str):
-        color = getrgb(color)
+        color = ImageColor.getrgb(color)
 
     if stretch:
         ne.evaluate("res / (sqrt(1 + res.real**2 * res.imag**2))", out=res)
@@ -1357,8 +2097,8 @@ def apply_color(                    # <<<2
     rho = modulus * complex(cos(angle*pi/180), sin(angle*pi/180))
     x_min, x_max, y_min, y_max = geometry
 
-    tmp = PIL.Image.open(os.path.expanduser(filename))
-    color_width, color_height = tmp.size
+    color_im = colorwheel_array(filename, color)
+    color_width, color_height = color_im.shape[1]-1, color_im.shape[0]-1
     delta_x = (x_max-x_min) / (color_width-1)
     delta_y = (y_max-y_min) / (color_height-1)
 
@@ -1382,14 +2122,6 @@ def apply_color(                    # <<<2
         ne.evaluate("exp((a1 + morph * (a2 - a1))*1j*pi/hundred_eighty)", out=morph)
         np.multiply(morph[:, None], res, out=res)
 
-    # we add a one pixel border to the top / right of the color image, using
-    # the default color
-    color_im = PIL.Image.new("RGB",
-                             (color_width+1,
-                              color_height+1),
-                             color=color)
-    color_im.paste(tmp, box=(1, 1))
-
     # TODO when hyperbolic pattern, ComplexWarning: Casting complex values to
     # real discards the imaginary part ???
     ne.evaluate("res/rho", out=res)
@@ -1411,17 +2143,40 @@ def apply_color(                    # <<<2
 
     res = np.dstack([xs, ys])
 
-    # get array of pixels colors, and reshape the array to be 3 dimensional
-    color = np.asarray(color_im).reshape(color_height+1, color_width+1, 3)
-
     # apply color to the pixel coordinates and convert to appropriate type
     # transpose the first two dimensions because images have [y][x] and arrays
     # have [x][y] coordinates
-    res = color.transpose(1, 0, 2)[xs, ys].transpose(1, 0, 2)
+    res = color_im.transpose(1, 0, 2)[xs, ys].transpose(1, 0, 2)
     return PIL.Image.fromarray(np.array(res, dtype=np.uint8), "RGB")
 # >>>2
 
 
+@lru_cache(maxsize=8)
+def _colorwheel_array(filename, color, mtime):       # <<<2
+    # we add a one pixel border to the top / right of the color image, using
+    # the default color
+    tmp = PIL.Image.open(filename)
+    color_im = PIL.Image.new("RGB",
+                             (tmp.size[0]+1, tmp.size[1]+1),
+                             color=color)
+    color_im.paste(tmp, box=(1, 1))
+    array = np.asarray(color_im)
+    array.flags.writeable = False
+    return array
+# >>>2
+
+
+def colorwheel_array(filename, color):      # <<<2
+    """return the array of pixels of a colorwheel image, with a one pixel
+    border of the default color on the top / left
+    the array is cached on the filename, default color and modification time
+    of the file"""
+    filename = os.path.expanduser(filename)
+    return _colorwheel_array(filename, tuple(color),
+                             os.path.getmtime(filename))
+# >>>2
+
+
 def make_wallpaper_image(   # <<<2
         zs,                 # input coordinates
         matrix,             # transformation matrix
@@ -1429,9 +2184,10 @@ def make_wallpaper_image(   # <<<2
         basis,              # additional parameters for basis
         N=1,                # additional forced symmetry
         color_pattern="",   # color reversing symmetry pattern
-        message_queue=None,
-        nb_blocks=1,
-        nb_block=0):
+        progress=None,      # Progress object
+        engine=None,        # "direct", "fft", "nufft" or "auto"
+        tolerance=FFT_TOLERANCE,    # maximal error for the FFT engines
+        grid=None):         # (engine, grid) from ``wallpaper_field_grid``
     """use the given matrix to make an image for the given pattern
     the ``N`` parameter is used to enforce rotational symmetry around the
     origin but will usually destroy periodicity
@@ -1441,47 +2197,291 @@ def make_wallpaper_image(   # <<<2
     ``color_pattern`` is used to create color reversing wallpaper (the
     colorwheel file should then be symmetric)
 
-    ``message_queue`` is used to keep track of progress
+    ``progress`` is used to keep track of progress
+
+    with the "fft" engine, the values are interpolated from a grid of the
+    unit cell (see ``wallpaper_grid``), and with the "nufft" engine, they are
+    computed with a non uniform FFT (see ``nufft_grid``). The computation
+    of the grids doesn't depend much on the number of coefficients.
+    (The default engine is WALLPAPER_ENGINE.)
+    When ``grid`` is given, its engine and grid are used, so that the blocks
+    of an image share a single grid.
     """
 
-    matrix = add_symmetries(matrix,
-                            PATTERN[pattern]["recipe"],
-                            parity=PATTERN[pattern]["parity"])
+    with profile("symmetries"):
+        matrix = add_symmetries(matrix,
+                                PATTERN[pattern]["recipe"],
+                                parity=PATTERN[pattern]["parity"])
 
     B = invert22(basis)
 
+    if grid is None:
+        with profile("evaluation", zs.size):
+            grid = wallpaper_field_grid(matrix, zs.size, N, engine, tolerance)
+    engine, grid = grid
+    if engine == "fft":
+        return sample_wallpaper_grid(grid, zs, B, N, progress)
+    if engine == "nufft":
+        return sample_nufft_grid(*grid, zs, B, N, progress)
+
     res = np.zeros(zs.shape, complex)
 
-    w1, w2 = 1, len(matrix)*N
-    for (n, m) in matrix:
+    if progress is not None:
+        progress.steps(len(matrix)*N, zs.size)
+    with profile("evaluation", zs.size):
         ZS = np.zeros(zs.shape, dtype="complex128")
+        profile_bytes("evaluation", res, ZS)
+        for (n, m) in matrix:
+            ZS[...] = 0
+
+            for k in range(0, N):
+                rho = complex(cos(2*pi*k/N),
+                              sin(2*pi*k/N))
+                a, b = B[0][0], B[1][0]
+                c, d = B[0][1], B[1][1]
+                ne.evaluate("exp((n*(a*(rho*zs).real + b*(rho*zs).imag) +"
+                            "     m*(c*(rho*zs).real + d*(rho*zs).imag))"
+                            "    * 2j*pi) +"
+                            "ZS", out=ZS)
+                if progress is not None:
+                    progress.step()
+            coeff = matrix[n, m]
+            ne.evaluate("res + (ZS/N) * coeff", out=res)
+    return res
+# >>>2
+
+
+def wallpaper_grid_size(matrix, tolerance=FFT_TOLERANCE):      # <<<2
+    """choose the size K of the grid used by ``wallpaper_grid`` so that the
+    bilinear interpolation of the values (see ``sample_wallpaper_grid``) has
+    an error smaller than ``tolerance``
+    return None when K would be bigger than FFT_MAX_GRID"""
+    if not matrix:
+        return 16
+    # the error of the bilinear interpolation of exp(2i pi (nX + mY)) is at
+    # most pi^2 (n^2 + m^2) / 2K^2
+    bound = sum(abs(z) * (n*n + m*m) for (n, m), z in matrix.items())
+    degre = max(max(abs(n), abs(m)) for n, m in matrix)
+    K = fft_size(max(2*degre + 1, ceil(pi * sqrt(bound / (2*tolerance))),
+                     16))
+    if K > FFT_MAX_GRID:
+        return None
+    return K
+# >>>2
+
+
+def wallpaper_grid(matrix, K):       # <<<2
+    """compute the values of the Fourier series given by ``matrix`` on a
+    regular K x K grid of the unit cell (in lattice coordinates), with a
+    single inverse FFT
+    the result is a (K+1, K+1) array (the first row / column are repeated at
+    the end) for ``sample_wallpaper_grid``"""
+    coeffs = np.zeros((K, K), dtype="complex128")
+    for (n, m), z in matrix.items():
+        coeffs[n % K, m % K] += z
+    grid = np.fft.ifft2(coeffs)
+    grid *= K*K
+    return np.pad(grid, ((0, 1), (0, 1)), mode="wrap")
+# >>>2
+
+
+def sample_wallpaper_grid(grid, zs, B, N=1, progress=None):      # <<<2
+    """interpolate the values of a grid computed by ``wallpaper_grid`` for
+    the coordinates ``zs``, with lattice coordinates given by the matrix B
+    (as in ``make_wallpaper_image``), and averaged over N rotations around
+    the origin"""
+    K = grid.shape[0] - 1
+    values = grid.ravel()
+
+    res = np.zeros(zs.shape, dtype="complex128")
+    if progress is not None:
+        progress.steps(N, zs.size)
+    with profile("evaluation", zs.size):
+        for k in range(0, N):
+            rho = complex(cos(2*pi*k/N), sin(2*pi*k/N))
+            i, u, j, v = grid_positions(zs, B, rho, K)
+            idx = i*(K+1) + j
+            v00 = values.take(idx)
+            v01 = values.take(idx + 1)
+            v10 = values.take(idx + K+1)
+            v11 = values.take(idx + K+2)
+            ne.evaluate("res + ((v00*(1-v) + v01*v)*(1-u) +"
+                        "       (v10*(1-v) + v11*v)*u) / N", out=res)
+            if progress is not None:
+                progress.step()
+        profile_bytes("evaluation", res, i, u, j, v, idx,
+                      v00, v01, v10, v11)
+    return res
+# >>>2
+
+
+def grid_positions(zs, B, rho, K):      # <<<2
+    """compute the positions of the points rho*zs in a K x K grid of the unit
+    cell, for the lattice coordinates given by the matrix B (as in
+    ``make_wallpaper_image``)
+    the result is (i, u, j, v): the row i (for the first lattice coordinate)
+    and column j (second coordinate) of the grid point just before each point
+    (between 0 and K-1) and the fractional parts u and v of the positions"""
+    a, b = B[0][0], B[1][0]
+    c, d = B[0][1], B[1][1]
+    xs = ne.evaluate("(rho*zs).real")
+    ys = ne.evaluate("(rho*zs).imag")
+    u = ne.evaluate("(a*xs + b*ys) * K")
+    v = ne.evaluate("(c*xs + d*ys) * K", out=xs)
+    i = np.floor(u, out=ys)
+    ne.evaluate("u - i", out=u)
+    i = i.astype(np.int64) % K
+    j = np.floor(v)
+    ne.evaluate("v - j", out=v)
+    j = j.astype(np.int64) % K
+    return i, u, j, v
+# >>>2
+
+
+def fft_size(n):        # <<<2
+    """smallest size of the form 2^k or 3 * 2^k bigger than n (fast FFTs)"""
+    n = max(n, 1)
+    return min(2**ceil(log2(n)), 3 * 2**max(ceil(log2(n/3)), 0))
+# >>>2
+
 
+def nufft_parameters(tolerance=FFT_TOLERANCE, norm=1):     # <<<2
+    """return the number of grid points on each side of a point used by the
+    spreading kernel of the non uniform FFT, and the variance of the kernel
+    (in grid units), for an oversampling factor of 2 and coefficients whose
+    moduli sum to ``norm``
+    (cf Greengard and Lee, "Accelerating the nonuniform fast Fourier
+    transform", SIAM Review 46 (2004): the error is about norm * 10^-width)"""
+    width = ceil(-log10(tolerance / max(norm, tolerance)))
+    width = min(max(2, width), 12)
+    return width, width / (1.5*pi)
+# >>>2
+
+
+def nufft_grid(matrix, tolerance=FFT_TOLERANCE):       # <<<2
+    """compute the grid used to evaluate the Fourier series given by
+    ``matrix`` at arbitrary points with a non uniform FFT (type 2)
+
+    The coefficients are divided by the Fourier coefficients of a gaussian
+    and an inverse FFT on an oversampled M x M grid gives the values of the
+    corresponding series. The value of the original series at a point is
+    then the convolution of those values with the gaussian, which only
+    needs the grid points close to it (see ``sample_nufft_grid``).
+
+    The result is (grid, width, variance), where the grid is padded (by
+    wrapping around) so that the neighbours of any point are inside."""
+    width, variance = nufft_parameters(
+        tolerance, sum(abs(z) for z in matrix.values()))
+    degre = max([max(abs(n), abs(m)) for n, m in matrix] + [0])
+    M = fft_size(2 * (2*degre + 1))
+    # variance of the gaussian in lattice coordinates, and its Fourier
+    # coefficients (for a period of 1)
+    s2 = variance / (M*M)
+    coeffs = np.zeros((M, M), dtype="complex128")
+    for (n, m), z in matrix.items():
+        coeffs[n % M, m % M] += z / (2*pi*s2 * exp(-2*pi*pi*s2*(n*n + m*m)))
+    grid = np.fft.ifft2(coeffs)
+    grid = np.pad(grid, ((width-1, width), (width-1, width)), mode="wrap")
+    return grid, width, variance
+# >>>2
+
+
+def sample_nufft_grid(grid, width, variance,     # <<<2
+                      zs, B, N=1, progress=None):
+    """evaluate a Fourier series at the coordinates ``zs`` from its grid
+    computed by ``nufft_grid``, with lattice coordinates given by the
+    matrix B (as in ``make_wallpaper_image``), averaged over N rotations
+    around the origin
+    the gaussian kernel is separable: each row of 2*width points around a
+    point is summed, and the sums are then combined"""
+    M = grid.shape[0] - 2*width + 1
+    stride = grid.shape[1]
+    values = grid.ravel()
+    c = 1 / (2*variance)
+
+    res = np.zeros(zs.shape, dtype="complex128")
+    if progress is not None:
+        progress.steps(N, zs.size)
+    with profile("evaluation", zs.size):
         for k in range(0, N):
-            rho = complex(cos(2*pi*k/N),
-                          sin(2*pi*k/N))
-            a, b = B[0][0], B[1][0]
-            c, d = B[0][1], B[1][1]
-            ne.evaluate("exp((n*(a*(rho*zs).real + b*(rho*zs).imag) +"
-                        "     m*(c*(rho*zs).real + d*(rho*zs).imag))"
-                        "    * 2j*pi) +"
-                        "ZS", out=ZS)
-            if message_queue is not None:
-                message_queue.put(nb_block/nb_blocks+w1/(w2*nb_blocks))
-            w1 += 1
-        coeff = matrix[n, m]
-        ne.evaluate("res + (ZS/N) * coeff", out=res)
+            rho = complex(cos(2*pi*k/N), sin(2*pi*k/N))
+            i, u, j, v = grid_positions(zs, B, rho, M)
+            # index of the first point of the kernel in the padded grid
+            idx = i*stride + j
+            wys = []
+            for l in range(-width+1, width+1):
+                wys.append(ne.evaluate("exp(-(v-l)**2 * c)"))
+            row = np.empty(zs.shape, dtype="complex128")
+            for l in range(-width+1, width+1):
+                row[...] = 0
+                for wy in wys:
+                    ne.evaluate("row + wy*g", out=row,
+                                local_dict={"row": row, "wy": wy,
+                                            "g": values.take(idx)})
+                    idx += 1
+                idx += stride - 2*width
+                ne.evaluate("res + exp(-(u-l)**2 * c) * row / N", out=res)
+            if progress is not None:
+                progress.step()
+        profile_bytes("evaluation", res, i, u, j, v, idx, row, *wys)
     return res
 # >>>2
 
 
+def wallpaper_engine(matrix, pixels, N=1, tolerance=FFT_TOLERANCE):     # <<<2
+    """choose the fastest engine ("direct", "fft" or "nufft") for a
+    symmetrized matrix, from the estimated costs of the computations"""
+    costs = {"direct": len(matrix)*N*pixels}
+    K = wallpaper_grid_size(matrix, tolerance)
+    if K is not None:
+        costs["fft"] = FFT_PIXEL_COST*N*pixels + FFT_GRID_COST*K*K*log2(K)
+    width, _ = nufft_parameters(tolerance,
+                                sum(abs(z) for z in matrix.values()))
+    degre = max([max(abs(n), abs(m)) for n, m in matrix] + [0])
+    M = fft_size(2 * (2*degre + 1))
+    costs["nufft"] = (NUFFT_PIXEL_COST*(2*width)**2*N*pixels +
+                      FFT_GRID_COST*M*M*log2(M))
+    return min(costs, key=costs.get)
+# >>>2
+
+
+def wallpaper_field_grid(matrix, pixels, N=1, engine=None,       # <<<2
+                         tolerance=FFT_TOLERANCE):
+    """choose the engine used to compute ``pixels`` values for a symmetrized
+    matrix and compute its grid: the result is a pair (engine, grid) where
+    grid is the result of ``wallpaper_grid`` or ``nufft_grid`` for the "fft"
+    and "nufft" engines, and None for the "direct" engine"""
+    if engine is None:
+        engine = WALLPAPER_ENGINE
+    if engine == "auto":
+        engine = wallpaper_engine(matrix, pixels, N, tolerance)
+    if engine == "fft":
+        K = wallpaper_grid_size(matrix, tolerance)
+        if K is not None:
+            return "fft", wallpaper_grid(matrix, K)
+        # the grid would be too big to reach the tolerance
+        engine = "nufft"
+    if engine == "nufft":
+        return "nufft", nufft_grid(matrix, tolerance)
+    return "direct", None
+# >>>2
+
+
 def make_hyperbolic_image(      # <<<2
         zs,                     # input coordinates
         matrix=None,            # transformation matrix
         nb_steps=200,           # number of approximations steps to perform
-        message_queue=None,
+        progress=None,          # Progress object
         s=5,                    # exponent for imaginary part (should have real part > 1)
-        nb_blocks=1,
-        nb_block=0):
+        engine=None):           # "direct" or "reduce" (see HYPER_ENGINE)
+    """average the function z -> Im(z)^s exp(2i pi (n Re(z) + m Im(z))) (with
+    coefficients from the matrix) over ``nb_steps`` elements of the modular
+    group PSL2(Z) (modulo translations)
+    the limit is invariant under the modular group, so that with the
+    "reduce" engine, the points are first moved into the standard
+    fundamental domain (see ``reduce_modular``), where the averaging
+    converges much faster: points close to the real line (or to the border
+    of the disk) are then as good as the others"""
 
     # ks = list(matrix.keys())
     # for n, m in ks:
@@ -1516,58 +2516,132 @@ def make_hyperbolic_image(      # <<<2
                 yield a, -b, c, d
                 yield a, b, -c, d
 
+    if engine is None:
+        engine = HYPER_ENGINE
+    if engine == "reduce":
+        with profile("reduction", zs.size):
+            zs = reduce_modular(zs)
+
+    # the coefficients, grouped by their first index
+    rows = {}
+    for (n, m), coeff in matrix.items():
+        rows.setdefault(n, []).append((m, coeff))
+    ms = set(m for n, m in matrix)
+
     done = set([])
     res = np.zeros(zs.shape, dtype="complex128")
     c, d = 0, 0
-    w1, w2 = 0, nb_steps*len(matrix)
+    if progress is not None:
+        progress.steps(nb_steps*len(matrix), zs.size)
 
-    # A = np.zeros(res.shape, dtype="complex128")
-    # B = np.zeros(res.shape, dtype="complex128")
     ZS = np.zeros(res.shape, dtype="complex128")
-    for a, b, c, d in PSL2():
-        if len(done) >= nb_steps:
-            break
-        if (c, d) in done or (-c, -d) in done:
-            continue
-        assert a*d - b*c == 1
-        done.add((c, d))
-
-        ne.evaluate("(a*zs + b) / (c*zs + d)", out=ZS)
-
-        for n, m in matrix:
-            coeff = matrix[n, m]
-            ne.evaluate("res +"
-                        "ZS.imag**s * coeff *"
-                        "exp(2j*pi*(n*ZS.real + m*ZS.imag))",
-                        out=res)
-            w1 += 1
-            if message_queue is not None:
-                message_queue.put(nb_block/nb_blocks+w1/(w2*nb_blocks))
+    YS = np.zeros(res.shape, dtype="complex128")
+    T = np.zeros(res.shape, dtype="complex128")
+    profile_bytes("evaluation", res, ZS, YS, T)
+    with profile("evaluation", zs.size):
+        for a, b, c, d in PSL2():
+            if len(done) >= nb_steps:
+                break
+            if (c, d) in done or (-c, -d) in done:
+                continue
+            assert a*d - b*c == 1
+            done.add((c, d))
+
+            ne.evaluate("(a*zs + b) / (c*zs + d)", out=ZS)
+
+            # the power and exponentials are only computed once for each
+            # element of the group: the terms
+            #   Im(ZS)^s exp(2i pi (n Re(ZS) + m Im(ZS)))
+            # are products of powers of exp(2i pi Re(ZS)) and
+            # exp(2i pi Im(ZS))
+            ne.evaluate("ZS.imag**s", out=YS)
+            ER = integer_powers(ne.evaluate("exp(2j*pi*ZS.real)"), rows)
+            EI = integer_powers(ne.evaluate("exp(2j*pi*ZS.imag)"), ms)
+
+            for n in rows:
+                T[...] = 0
+                for m, coeff in rows[n]:
+                    ne.evaluate("T + coeff*E", out=T,
+                                local_dict={"T": T, "coeff": coeff,
+                                            "E": EI[m]})
+                    if progress is not None:
+                        progress.step()
+                ne.evaluate("res + YS*E*T", out=res,
+                            local_dict={"res": res, "YS": YS, "E": ER[n],
+                                        "T": T})
     return res
 # >>>2
 
 
+def integer_powers(base, exponents):        # <<<2
+    """compute the powers of an array of complex numbers of modulus 1 for the
+    given (positive or negative) integer exponents, with multiplications only
+    the result is a dictionnary (the power 0 is the number 1)"""
+    powers = {}
+    exponents = set(exponents)
+    if 0 in exponents:
+        powers[0] = 1
+    top = max([abs(e) for e in exponents] + [0])
+    if top == 0:
+        return powers
+    p = base.copy()
+    for k in range(1, top+1):
+        if k > 1:
+            ne.evaluate("p * base", out=p)
+        if k in exponents:
+            powers[k] = p if k == top else p.copy()
+        if -k in exponents:
+            # 1/z is the conjugate of z
+            powers[-k] = np.conj(p)
+    return powers
+# >>>2
+
+
+def reduce_modular(zs, max_steps=HYPER_MAX_REDUCTIONS):     # <<<2
+    """move the points of the upper half plane into the standard fundamental
+    domain of the modular group
+        |Re(z)| <= 1/2 and |z| >= 1
+    by alternating translations z -> z+k and inversions z -> -1/z
+    the points that are not in the upper half plane are left unchanged
+    (``zs`` may be modified)"""
+    shape = zs.shape
+    zs = zs.ravel()
+    idx = np.flatnonzero(zs.imag > 0)
+    ws = zs[idx]
+    for _ in range(max_steps):
+        ws.real -= np.round(ws.real)
+        inside = (ws.real**2 + ws.imag**2) < 1 - 1e-12
+        zs[idx[~inside]] = ws[~inside]
+        idx = idx[inside]
+        if idx.size == 0:
+            break
+        ws = -1 / ws[inside]
+    else:
+        zs[idx] = ws
+    return zs.reshape(shape)
+# >>>2
+
+
 def make_sphere_image(      # <<<2
         zs,                 # input coordinates
         matrix,             # transformation matrix
         pattern,            # name of group
         N=5,                # parameter for cyclic groups
         unwind=False,       # should the result be in stereographic projection?
-        message_queue=None,
-        nb_blocks=1,
-        nb_block=0):
+        progress=None):     # Progress object
     """use the given matrix to make an image for the given spherical pattern
 
     the ``N`` parameter is used for cyclic groups
 
     ``unwind`` is used to transform cyclic groups into frieze patterns
 
-    ``message_queue`` is used to keep track of progress
+    ``progress`` is used to keep track of progress
     """
 
     recipe = PATTERN[pattern]["recipe"]
     parity = PATTERN[pattern]["parity"].replace("N", str(N))
-    matrix = add_symmetries(matrix, recipe, parity)
+    with profile("symmetries"):
+        matrix = add_symmetries(matrix, recipe, parity)
 
     if unwind:
         ne.evaluate("exp(zs*1j)", out=zs)
@@ -1586,91 +2660,161 @@ def make_sphere_image(      # <<<2
         average = [([[1, 0], [0, 1]], 1), ([[1, 0], [0, 1]], 1)]
 
     res = np.zeros(zs.shape, complex)
+    profile_bytes("evaluation", res, zs)
     [a, b], [c, d] = average[0][0]
     [e, f], [g, h] = average[1][0]
-    w1, w2 = 0, average[0][1]*average[1][1]*len(matrix)
-    for i in range(average[1][1]):
-        for j in range(average[0][1]):
-            zsc = np.conj(zs)
-            for (n, m) in matrix:
-                coeff = matrix[n, m]
-                ne.evaluate("res + coeff * zs**n * zsc**m", out=res)
-                if message_queue is not None:
-                    message_queue.put(nb_block/nb_blocks+w1/(w2*nb_blocks))
-                w1 += 1
-            ne.evaluate("(a*zs + b) / (c*zs + d)", out=zs)
-        ne.evaluate("(e*zs + f) / (g*zs + h)", out=zs)
-
-    a = average[0][1] * average[1][1]
-    ne.evaluate("res/a", out=res)
+    if progress is not None:
+        progress.steps(average[0][1]*average[1][1]*len(matrix),
+                       zs.size)
+    with profile("evaluation", zs.size):
+        for i in range(average[1][1]):
+            for j in range(average[0][1]):
+                zsc = np.conj(zs)
+                for (n, m) in matrix:
+                    coeff = matrix[n, m]
+                    ne.evaluate("res + coeff * zs**n * zsc**m", out=res)
+                    if progress is not None:
+                        progress.step()
+                ne.evaluate("(a*zs + b) / (c*zs + d)", out=zs)
+            ne.evaluate("(e*zs + f) / (g*zs + h)", out=zs)
+
+        a = average[0][1] * average[1][1]
+        ne.evaluate("res/a", out=res)
     return res
 # >>>2
 
 
+def sphere_mask(size, geometry, modulus=1):      # <<<2
+    """compute the boolean array (with shape height x width, like images)
+    telling which pixels of an image are outside the unit disk
+    the angle of the output doesn't matter, and the mask is computed from the
+    pixel coordinates only, without a full array of coordinates"""
+    width, height = size
+    x_min, x_max, y_min, y_max = geometry
+    delta_x = (x_max-x_min) / max(width-1, 1)
+    delta_y = (y_max-y_min) / max(height-1, 1)
+    xs = delta_x * np.arange(width, dtype="float") + x_min
+    ys = delta_y * np.arange(height, dtype="float") - y_max
+    return (xs**2)[None, :] + (ys**2)[:, None] > modulus**2
+# >>>2
+
+
+def star_field(size, stars, random_seed=None):     # <<<2
+    """return the coordinates (xs, ys) of random "stars" for an image
+    if ``stars`` isn't an integer, the fractional part is the probability of
+    getting an additional star
+    the stars only depend on the size of the image and ``random_seed``
+    (default: RANDOM_SEED), so that they don't move during translations /
+    rotations"""
+    if random_seed is None:
+        random_seed = RANDOM_SEED
+    width, height = size
+    rng = np.random.default_rng(int(random_seed * 2**32))
+    nb = int(stars)
+    if rng.uniform(0, 1) < stars - nb:
+        nb += 1
+    xs = rng.integers(0, width, size=nb)
+    ys = rng.integers(0, height, size=nb)
+    return xs, ys
+# >>>2
+
+
+@lru_cache(maxsize=8)
+def _background_array(filename, size, mtime):        # <<<2
+    """load and resize a background image, cached on the filename, size and
+    modification time of the file"""
+    img = PIL.Image.open(filename).convert("RGB").resize(size)
+    array = np.asarray(img)
+    array.flags.writeable = False
+    return array
+# >>>2
+
+
+def background_array(filename, size):       # <<<2
+    """return the array of a background image resized to size, or None if the
+    file cannot be read"""
+    try:
+        filename = os.path.expanduser(filename)
+        return _background_array(filename, tuple(size),
+                                 os.path.getmtime(filename))
+    except Exception:
+        return None
+# >>>2
+
+
 def make_sphere_background(     # <<<2
         geometry,
         modulus,
         angle,
-        img,                    # the sphere image
+        img,                    # the sphere image, as a (height, width, 3) array
         background="back.jpg",  # background: either a colorname or a filename
         fade=128,               # fade the background
-        stars=0):               # how many random "stars" (pixels) to add
-    """compute the background for a sphere
+        stars=0,                # how many random "stars" (pixels) to add
+        random_seed=None):      # seed for the stars (default: RANDOM_SEED)
+    """add the background around a sphere, directly in the array img
         - background can either be a color, or a filename containing an image
           to display
         - fade is used to fade the background (0: no fading, 255: black
           background)
         - stars is the number of random "stars" (pixels) to add to the
           background
-      """
-    zs = make_coordinates_array(img.size, geometry, modulus, angle)
-    try:
-        background_img = PIL.Image.open(background)
-        background_img = background_img.resize(img.size)
-    except:
-        try:
-            color = getrgb(background)
-            background_img = PIL.Image.new(
-                mode="RGB",
-                size=img.size,
-                color=color
-            )
-            width, height = img.size
-            for i in range(int(stars)):
-                background_img.putpixel(
-                    (randrange(0, width),
-                     randrange(0, height)),
-                    getrgb(STAR_COLOR)
-                )
-            rest = stars - int(stars)
-            if uniform(0, 1) < rest:
-                background_img.putpixel(
-                    (randrange(0, width),
-                     randrange(0, height)),
-                    getrgb(STAR_COLOR)
-                )
+    the array is returned
+    """
+    height, width = img.shape[:2]
+    mask = sphere_mask((width, height), geometry, modulus)
+    fade = min(max(int(fade), 0), 255)
 
-        except ValueError:
-            background_img = PIL.Image.new(
-                mode="RGB",
-                size=(width, height),
-                color=DEFAULT_BACKGROUND
-            )
+    def faded(pixels):
+        pixels = np.asarray(pixels, dtype=np.uint16)
+        return ((pixels * (255-fade) + 127) // 255).astype(np.uint8)
 
-    mask = (zs.real**2 + zs.imag**2 > 1).astype(int).transpose(1, 0)
+    background_img = background_array(background, (width, height))
+    if background_img is not None:
+        img[mask] = faded(background_img[mask])
+        return img
 
-    mask_background = PIL.Image.fromarray(
-        np.array(mask*fade, dtype=np.uint8),
-        "L"
-    )
-    background_img.paste(0, mask=mask_background)
+    try:
+        color = ImageColor.getrgb(background)
+    except ValueError:
+        color = ImageColor.getrgb(DEFAULT_BACKGROUND)
+        stars = 0
+    img[mask] = faded(color)
+
+    xs, ys = star_field((width, height), stars, random_seed)
+    visible = mask[ys, xs]
+    img[ys[visible], xs[visible]] = faded(ImageColor.getrgb(STAR_COLOR))
+    return img
+# >>>2
 
-    mask_sphere = PIL.Image.fromarray(
-        np.array(mask*255, dtype=np.uint8),
-        "L"
+
+def draw_overlay(array, output, function):      # <<<2
+    """draw the tile and / or orbifold (as chosen in ``output``) on top of an
+    image, given as a (height, width, 3) uint8 array that is modified in place
+    return the arguments given to ``make_tile``, or None when nothing was
+    drawn"""
+    pattern = function_pattern(function)
+    height, width = array.shape[:2]
+    if not ((output["draw_tile"] or output["draw_orbifold"]) and
+            pattern in PATTERN and
+            PATTERN[pattern]["type"] in ["plane group",
+                                         "color reversing plane group"] and
+            output["display_mode"] == "plain" and
+            not output["morph"]):
+        return None
+    tile_args = dict(
+        geometry=output["geometry"],
+        transformation=(output["modulus"], output["angle"]),
+        pattern=pattern,
+        basis=basis(pattern, *function["lattice_parameters"]),
+        size=(width, height),
+        draw_tile=output["draw_tile"],
+        draw_orbifold=output["draw_orbifold"],
+        color_tile=output["draw_color_tile"],
+        draw_mirrors=output["draw_mirrors"]
     )
-    img.paste(background_img, mask=mask_sphere)
-    return img
+    with profile("overlay", width*height):
+        blend_overlay(array, make_tile(**tile_args))
+    return tile_args
 # >>>2
 
 
@@ -1681,43 +2825,24 @@ def save_image(         # <<<2
 ):
     """save an image to a file, and construct a shell script to invoke the
     program with the exact same parameters
+    ``image`` can be an image or a (height, width, 3) uint8 array, which is
+    then modified in place when adding the tile / orbifold
     ``config`` should contain the whole configuration of the program
     """
+    if isinstance(image, np.ndarray):
+        array = image
+    else:
+        array = np.array(image.convert("RGB"))
+    height, width = array.shape[:2]
+
     save_directory = config["output"]["save_directory"]
     filename_template = config["output"]["filename_template"]
 
     output = config["output"]
     function = config["function"]
 
-    if function["pattern_type"] == "wallpaper":
-        if function["wallpaper_color_pattern"]:
-            pattern = (function["wallpaper_color_pattern"],
-                       function["wallpaper_pattern"])
-        else:
-            pattern = function["wallpaper_pattern"]
-    elif function["pattern_type"] == "sphere":
-        pattern = function["sphere_pattern"]
-    elif function["pattern_type"] == "hyperbolic":
-        pattern = "hyperbolic"
-
     # put the tile and / or orbifold into the image
-    if ((output["draw_tile"] or output["draw_orbifold"]) and
-            PATTERN[pattern]["type"] in ["plane group",
-                                         "color reversing plane group"] and
-            output["display_mode"] == "plain" and
-            not output["morph"]):
-        tile = make_tile(
-            output["geometry"],
-            (output["modulus"], output["angle"]),
-            pattern,
-            basis(pattern, *function["lattice_parameters"]),
-            image.size,
-            draw_tile=output["draw_tile"],
-            draw_orbifold=output["draw_orbifold"],
-            color_tile=output["draw_color_tile"],
-            draw_mirrors=output["draw_mirrors"]
-        )
-        image.paste(tile, mask=tile)
+    tile_args = draw_overlay(array, output, function)
 
     # build the filename
     function = config["function"]
@@ -1758,17 +2883,29 @@ def save_image(         # <<<2
             break
         _filename = filename
         info["nb"] += 1
-    image.convert("RGB").save(filename + ".jpg")
+    with profile("encode", width*height):
+        PIL.Image.fromarray(array, "RGB").save(filename + ".jpg")
     if message_queue is not None:
         message_queue.put("saved file {}".format(filename+".jpg"))
 
+    if tile_args is not None and output.get("svg_overlay", False):
+        with open(filename + ".svg", mode="w") as svg_file:
+            svg_file.write(tile_to_svg(**tile_args))
+
+    save_config(filename + ".ct", config)
+    return filename + ".jpg"
+# >>>2
+
+
+def save_config(filename, config, preview=True):     # <<<2
+    """save a configuration to a file, in the format used by ``--config`` and
+    the GUI"""
     cfg = {
-        "colorwheel": config["colorwheel"],
-        "output": config["output"],
-        "function": config["function"],
-        "preview": True
+        "colorwheel": copy.deepcopy(config["colorwheel"]),
+        "output": copy.deepcopy(config["output"]),
+        "function": copy.deepcopy(config["function"]),
+        "preview": preview
     }
-    config_file = open(filename + ".ct", mode="w")
     if "matrix" in cfg["function"]:
         cfg["function"]["matrix"] = matrix_to_list(cfg["function"]["matrix"])
     if "hyper_s" in cfg["function"]:
@@ -1777,15 +2914,18 @@ def save_image(         # <<<2
         cfg["output"]["inversion_center"] = complex_to_str(
             cfg["output"]["inversion_center"]
         )
+    if PROFILER is not None:
+        cfg["profile"] = PROFILER.report()
 
-    json.dump(cfg, config_file, indent=2)
-    config_file.close()
+    with open(filename, mode="w") as config_file:
+        json.dump(cfg, config_file, indent=2)
 # >>>2
 
 
 def background_output(     # <<<2
         message_queue=None,
         output_message_queue=None,
+        job=None,
         **config):
     """compute an image from the configuration in config, and save it to a file
     used by the GUI for output jobs"""
@@ -1800,11 +2940,14 @@ def background_output(     # <<<2
         color=colorwheel,
         output=output,
         function=function,
-        message_queue=output_message_queue
+        message_queue=output_message_queue,
+        as_array=True,
+        job=job,
+        cache=RENDER_CACHE
     )
 
     if output["fade"]:
-        image = fade_image(image)
+        fade_array(image, fade_coefficient(output), out=image)
 
     save_image(
         message_queue=message_queue,
@@ -1814,90 +2957,750 @@ def background_output(     # <<<2
 # >>>2
 
 
+def available_memory():     # <<<2
+    """return the number of bytes of memory available for computations
+    this takes the cgroup limits (containers) into account when possible"""
+    candidates = []
+
+    # cgroup v2, then v1
+    for limit_file, usage_file in [
+            ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+            ("/sys/fs/cgroup/memory/memory.limit_in_bytes",
+             "/sys/fs/cgroup/memory/memory.usage_in_bytes")]:
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+            with open(usage_file) as f:
+                usage = int(f.read().strip())
+            if limit != "max" and int(limit) < 2**60:
+                candidates.append(int(limit) - usage)
+                break
+        except (OSError, ValueError):
+            pass
+
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    candidates.append(int(line.split()[1]) * 1024)
+                    break
+    except (OSError, ValueError):
+        pass
+
+    if not candidates:
+        try:
+            candidates.append(os.sysconf("SC_AVPHYS_PAGES") *
+                              os.sysconf("SC_PAGE_SIZE"))
+        except (ValueError, OSError, AttributeError):
+            candidates.append(2**30)
+
+    return max(min(candidates), 0)
+# >>>2
+
+
+def cache_size():       # <<<2
+    """return the sizes (in bytes) of the L2 and L3 caches, as a pair
+    0 is used when the size cannot be found"""
+    sizes = {2: 0, 3: 0}
+    cache_dir = "/sys/devices/system/cpu/cpu0/cache"
+    try:
+        for index in os.listdir(cache_dir):
+            if not index.startswith("index"):
+                continue
+            try:
+                with open(os.path.join(cache_dir, index, "level")) as f:
+                    level = int(f.read())
+                with open(os.path.join(cache_dir, index, "size")) as f:
+                    size = f.read().strip()
+            except (OSError, ValueError):
+                continue
+            unit = {"K": 2**10, "M": 2**20, "G": 2**30}.get(size[-1:], 1)
+            size = int(size.rstrip("KMG")) * unit
+            if level in sizes:
+                sizes[level] = max(sizes[level], size)
+    except OSError:
+        pass
+    return sizes[2], sizes[3]
+# >>>2
+
+
+def live_arrays(output, function):      # <<<2
+    """estimate the number of full size ``complex128`` arrays that are alive at
+    the same time when computing a block for the given configuration
+    (coordinates, result, intermediate arrays and colorization)"""
+    # zs, res and ZS for wallpaper / hyperbolic patterns, zs, res and the
+    # conjugate of zs for sphere patterns
+    n = 3
+
+    if output["display_mode"] == "sphere":
+        # x, y, z and their rotated versions are float arrays
+        n += 3
+
+    if function["pattern_type"] == "hyperbolic" and function["matrix"]:
+        # Im(ZS)^s, the sums for each row of the matrix, and the powers of
+        # the exponentials
+        n += 2 + len(set(i for i, j in function["matrix"]))
+        n += len(set(j for i, j in function["matrix"]))
+
+    engine = function.get("wallpaper_engine", WALLPAPER_ENGINE)
+    if function["pattern_type"] == "wallpaper" and engine != "direct":
+        # coordinates in the grid, indices and the 4 interpolated values, or
+        # the weights of the kernel for the non uniform FFT
+        width, _ = nufft_parameters(
+            function.get("fft_tolerance", FFT_TOLERANCE))
+        n += 5 if engine == "fft" else 4 + width
+
+    # apply_color needs the result, integer coordinates and their temporary
+    # copies, and the RGB arrays
+    return max(n, 5)
+# >>>2
+
+
+def plan_blocks(        # <<<2
+        size,                   # size of the image
+        nb_arrays=5,            # number of full size arrays needed per pixel
+        nb_workers=1,           # number of processes computing simultaneously
+        itemsize=16,            # size of the elements of arrays (complex128)
+        memory=None,            # available memory (None: find it)
+        caches=None):           # sizes of L2 / L3 caches (None: find them)
+    """choose the size (width, height) of the blocks used to compute an image
+    The number of pixels in a block is chosen so that
+        - all the blocks computed simultaneously fit in a fraction of the
+          available memory,
+        - the arrays for a block are about BLOCK_CACHE_FACTOR times the L2
+          cache, but not more than the L2 cache and the part of the L3 cache
+          of a worker, unless this gives tiny blocks (BLOCK_MIN_PIXELS).
+    Blocks are roughly square."""
+    width, height = size
+    if memory is None:
+        memory = available_memory()
+    if caches is None:
+        caches = cache_size()
+    L2, L3 = caches
+    nb_workers = max(1, nb_workers)
+    pixel_bytes = nb_arrays * itemsize
+
+    memory_pixels = BLOCK_MEMORY_FRACTION * memory / (nb_workers*pixel_bytes)
+    cache_pixels = min(BLOCK_CACHE_FACTOR*L2, L2 + L3/nb_workers) / pixel_bytes
+
+    max_pixels = max(BLOCK_MIN_PIXELS, cache_pixels)
+    max_pixels = int(max(1, min(max_pixels, memory_pixels)))
+
+    if width * height <= max_pixels:
+        return width, height
+
+    # roughly square blocks, then balanced so that the last row / column of
+    # blocks isn't much smaller than the others
+    block_width = min(width, max(1, isqrt(max_pixels)))
+    block_height = min(height, max(1, max_pixels // block_width))
+    nb_x = ceil(width / block_width)
+    nb_y = ceil(height / block_height)
+    return ceil(width / nb_x), ceil(height / nb_y)
+# >>>2
+
+
 def make_image(     # <<<2
         color=None,             # configuration of colorwheel
         output=None,             # configuration of output
         function=None,          # configuration for function
-        message_queue=None,
-        block_size=BLOCK_SIZE):
+        message_queue=None,     # queue receiving progress reports
+        block_size=None,        # None: use the configuration / BLOCK_SIZE
+        nb_workers=1,           # number of simultaneous jobs (for "auto")
+        as_array=False,         # return the (height, width, 3) uint8 array
+        progress=None,          # function receiving progress reports
+        job=None,               # job identifier for progress reports
+        cache=None,             # RenderCache object
+        random_seed=None,       # seed for the stars (default: RANDOM_SEED)
+        previous=None):         # (color, output, function, array) of an image
     """compute an image for a pattern, cutting the output image into subimages
-    if necessary"""
+    if necessary
+    ``block_size`` can be 0 (single block), a number of pixels for square
+    blocks, a pair (width, height) or "auto" (see ``plan_blocks``)
+    progress reports (see ``Progress``) are sent to ``message_queue`` and / or
+    the ``progress`` function
+    when ``cache`` is given, the image (and the complex values if
+    ``cache.fields`` is true) are looked up / stored in the cache
+    when the image is a translation of the ``previous`` one, only the new
+    parts are computed (see ``pan_image``)"""
 
-    seed(RANDOM_SEED)
+    width, height = output["size"]
 
-    if block_size <= 0:
-        return make_image_single_block(
-            color=color,
-            output=output,
-            function=function,
-            message_queue=message_queue,
-            nb_blocks=1,
-            nb_block=0)
+    if block_size is None:
+        block_size = output.get("block_size", BLOCK_SIZE)
+    if block_size == "auto":
+        block_width, block_height = plan_blocks(
+            (width, height),
+            nb_arrays=live_arrays(output, function),
+            nb_workers=nb_workers)
+    elif isinstance(block_size, (tuple, list)):
+        block_width, block_height = block_size
+    elif int(block_size) <= 0:
+        block_width, block_height = width, height
+    else:
+        block_width = block_height = int(block_size)
 
-    x_min, x_max, y_min, y_max = output["geometry"]
-    delta_x = x_max - x_min
-    delta_y = y_max - y_min
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    profile_bytes("assembly", img)
 
-    width, height = output["size"]
+    if block_width >= width and block_height >= height:
+        block_width, block_height = width, height
 
-    # print("{}x{} from ({},{}) to ({},{}), block size={}"
-    #       .format(width, height,
-    #               x_min, y_min, x_max, y_max,
-    #               block_size))
-    images = {}
-    nb_blocks = ceil(height/block_size) * ceil(width/block_size)
+    nb_blocks = ceil(height/block_height) * ceil(width/block_width)
     nb = 0
-    for y in range(0, height, block_size):
-        for x in range(0, width, block_size):
-            i = x//block_size
-            j = y//block_size
 
-            local_width = min(block_size, width-i*block_size)
-            local_height = min(block_size, height-j*block_size)
+    reporter = None
+    if message_queue is not None and progress is not None:
+        def send(event):
+            message_queue.put(event)
+            progress(event)
+        reporter = Progress(send, job, nb_blocks, width*height)
+    elif message_queue is not None:
+        reporter = Progress(message_queue.put, job, nb_blocks, width*height)
+    elif progress is not None:
+        reporter = Progress(progress, job, nb_blocks, width*height)
+
+    # the cached images don't contain the background, which is always added
+    # at the end
+    image_key = field_key = field = None
+    compute = True
+    new_field = False
+    if cache is not None:
+        image_key = cache.key("image", output, function, color)
+        cached = cache.get(image_key)
+        if cached is not None and cached.shape == img.shape:
+            img[...] = cached
+            compute = False
+        elif cache.fields:
+            field_key = cache.key("field", output, function)
+            field = cache.get(field_key)
+            if field is None or field.shape != (width, height):
+                field = np.empty((width, height), dtype="complex128")
+                new_field = True
+
+    panned = False
+    if compute and previous is not None:
+        panned = pan_image(previous, img, color, output, function, reporter)
+        if panned:
+            compute = new_field = False
+
+    # with a rotational symmetry / a frieze, the complex values are computed
+    # for the whole image before the blocks are colored
+    compute_field = new_field
+    if compute and (field is None or new_field):
+        if reporter is not None:
+            reporter.block(0)
+        full_field = symmetric_field(output, function, reporter, out=field)
+        if full_field is not None:
+            field = full_field
+            compute_field = False
+
+    # sphere images can be interpolated from a texture of the whole sphere,
+    # computed once for all the rotations
+    texture = None
+    if (compute and (field is None or compute_field) and
+            output["display_mode"] == "sphere" and
+            output.get("sphere_texture", SPHERE_TEXTURE)):
+        texture = sphere_texture(function, output["sphere_texture"], cache,
+                                 reporter)
+
+    # the grid of wallpaper patterns is computed once for all the blocks
+    grid = None
+    if compute and (field is None or compute_field) and texture is None:
+        grid = field_grid(function, width*height)
+
+    for y in range(0, height if compute else 0, block_height):
+        for x in range(0, width, block_width):
+            local_width = min(block_width, width-x)
+            local_height = min(block_height, height-y)
+
+            local_output = region_output(output, x, y,
+                                         local_width, local_height)
+            local_color = copy.deepcopy(color)
+            local_function = copy.deepcopy(function)
 
-            local_x_min = x_min + i * delta_x * block_size / width
-            local_y_max = y_max - j * delta_y * block_size / height
+            if reporter is not None:
+                reporter.block(nb)
+            if field is None:
+                block = make_image_single_block(
+                    color=local_color,
+                    output=local_output,
+                    function=local_function,
+                    progress=reporter,
+                    texture=texture,
+                    grid=grid)
+            else:
+                local_field = field[x:x+local_width, y:y+local_height]
+                if compute_field:
+                    local_field[...] = make_field_single_block(
+                        output=local_output,
+                        function=local_function,
+                        progress=reporter,
+                        texture=texture,
+                        grid=grid)
+                block = color_field(local_field.copy(), local_color,
+                                    local_output)
+            with profile("assembly", local_width*local_height):
+                img[y:y+local_height, x:x+local_width] = np.asarray(block)
+            nb += 1
 
-            local_x_max = min(
-                x_min + (i+1) * delta_x * block_size / width,
-                x_max
-            )
-            local_y_min = max(
-                y_max - (j+1) * delta_y * block_size / height,
-                y_min
+    if (compute or panned) and cache is not None:
+        cache.put(image_key, img)
+        if new_field:
+            cache.put(field_key, field)
+
+    # the background is added once for the whole image so that random stars
+    # don't depend on the blocks
+    if output["display_mode"] in ["sphere", "inversion"]:
+        if reporter is not None:
+            reporter.report("background")
+        with profile("background", width*height):
+            make_sphere_background(
+                output["geometry"],
+                output["modulus"],
+                output["angle"],
+                img,
+                background=output["sphere_background"],
+                fade=output["sphere_background_fading"],
+                stars=output["sphere_stars"],
+                random_seed=random_seed
             )
 
-            # print("bloc {}/{}: {},{}: {}x{} from ({},{}) to ({},{})"
-            #       .format(nb, nb_blocks,
-            #               i, j,
-            #               local_width, local_height,
-            #               local_x_min, local_y_min,
-            #               local_x_max, local_y_max))
+    if reporter is not None:
+        reporter.report("done")
 
-            local_output = copy.deepcopy(output)
-            local_color = copy.deepcopy(color)
-            local_function = copy.deepcopy(function)
-            local_output["geometry"] = (local_x_min, local_x_max,
-                                        local_y_min, local_y_max)
-            local_output["size"] = (local_width, local_height)
-            local_output["sphere_stars"] /= nb_blocks
-
-            images[i, j] = make_image_single_block(
-                color=local_color,
-                output=local_output,
-                function=local_function,
-                message_queue=message_queue,
-                nb_blocks=nb_blocks,
-                nb_block=nb)
-            nb += 1
-    # print()
+    if as_array:
+        return img
+    return PIL.Image.fromarray(img, "RGB")
+# >>>2
 
-    img = PIL.Image.new("RGBA", (width, height), (255, 0, 0, 0))
-    for i, j in images:
-        img.paste(images[i, j], (i*block_size, j*block_size))
 
-    seed()
-    return img
+def region_output(output, x, y, width, height):      # <<<2
+    """return the output configuration for the subimage of size (width,
+    height) at pixel (x, y) of the image for ``output``
+    the spacing between pixels is the same as in make_coordinates_array, so
+    that the subimage is exactly the corresponding part of the whole image"""
+    x_min, x_max, y_min, y_max = output["geometry"]
+    delta_x = (x_max - x_min) / max(output["size"][0]-1, 1)
+    delta_y = (y_max - y_min) / max(output["size"][1]-1, 1)
+
+    local_output = copy.deepcopy(output)
+    local_output["geometry"] = (x_min + x*delta_x,
+                                x_min + (x+width-1)*delta_x,
+                                y_max - (y+height-1)*delta_y,
+                                y_max - y*delta_y)
+    local_output["size"] = (width, height)
+    return local_output
+# >>>2
+
+
+def subsampled_output(output, k):      # <<<2
+    """return the output configuration for every k-th pixel (in each
+    direction) of the image for ``output``, starting with the top left one
+    the last row / column can be a little outside of the image, so that the
+    spacing between pixels is exactly k times the spacing of the image"""
+    if k <= 1:
+        return copy.deepcopy(output)
+    width, height = output["size"]
+    x_min, x_max, y_min, y_max = output["geometry"]
+    delta_x = k * (x_max - x_min) / max(width-1, 1)
+    delta_y = k * (y_max - y_min) / max(height-1, 1)
+    width = ceil((width-1) / k) + 1
+    height = ceil((height-1) / k) + 1
+
+    local_output = copy.deepcopy(output)
+    local_output["geometry"] = (x_min,
+                                x_min + (width-1)*delta_x,
+                                y_max - (height-1)*delta_y,
+                                y_max)
+    local_output["size"] = (width, height)
+    return local_output
+# >>>2
+
+
+def pan_image(previous, img, color, output, function, progress=None):     # <<<2
+    """when ``output`` is a translation by a whole number of pixels of the
+    output of ``previous`` (a tuple (color, output, function, array) for an
+    image computed by make_image), copy the common part of the images into
+    ``img``, compute the rest and return True
+    otherwise, return False (``img`` isn't modified)"""
+    old_color, old_output, old_function, old_img = previous
+    width, height = output["size"]
+    if (output["display_mode"] != "plain" or output.get("morph") or
+            tuple(old_output["size"]) != (width, height) or
+            old_img.shape != img.shape):
+        return False
+    # everything else must be the same
+    if (render_key("image", dict(output, geometry=None), function, color) !=
+            render_key("image", dict(old_output, geometry=None),
+                       old_function, old_color)):
+        return False
+
+    x_min, x_max, y_min, y_max = output["geometry"]
+    old_x_min, old_x_max, old_y_min, old_y_max = old_output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+    delta_y = (y_max - y_min) / max(height-1, 1)
+    # the new pixel (x, y) is the old pixel (x+dx, y-dy)
+    sx = (x_min - old_x_min) / delta_x
+    sy = (y_max - old_y_max) / delta_y
+    dx = round(sx)
+    dy = round(sy)
+    if (abs(sx - dx) > 1e-6 or abs(sy - dy) > 1e-6 or
+            abs((x_max - old_x_max) / delta_x - sx) > 1e-6 or
+            abs((y_min - old_y_min) / delta_y - sy) > 1e-6 or
+            abs(dx) >= width or abs(dy) >= height):
+        return False
+
+    x0, x1 = max(0, -dx), min(width, width-dx)
+    y0, y1 = max(0, dy), min(height, height+dy)
+    with profile("assembly", (x1-x0) * (y1-y0)):
+        img[y0:y1, x0:x1] = old_img[y0-dy:y1-dy, x0+dx:x1+dx]
+    pixels = width*height - (x1-x0)*(y1-y0)
+    grid = field_grid(function, pixels)
+    if progress is not None:
+        progress.evaluate(pixels)
+    for x, y, w, h in [(0, 0, x0, height), (x1, 0, width-x1, height),
+                       (x0, 0, x1-x0, y0), (x0, y1, x1-x0, height-y1)]:
+        if w > 0 and h > 0:
+            block = make_image_single_block(
+                color=copy.deepcopy(color),
+                output=region_output(output, x, y, w, h),
+                function=copy.deepcopy(function),
+                progress=progress,
+                grid=grid)
+            img[y:y+h, x:x+w] = np.asarray(block)
+    return True
+# >>>2
+
+
+def zoom_placeholder(previous, color, output, function):       # <<<2
+    """return an approximation of the image for ``output``, obtained by
+    resampling the (color, output, function, array) ``previous`` image when
+    the images only differ by their geometry (zoom, translation)
+    the result is a PIL image, or None when the images are not related"""
+    old_color, old_output, old_function, old_img = previous
+    if (render_key("image", dict(output, geometry=None, size=None),
+                   function, color) !=
+            render_key("image", dict(old_output, geometry=None, size=None),
+                       old_function, old_color)):
+        return None
+    width, height = output["size"]
+    old_width, old_height = old_output["size"]
+    x_min, x_max, y_min, y_max = output["geometry"]
+    old_x_min, old_x_max, old_y_min, old_y_max = old_output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+    delta_y = (y_max - y_min) / max(height-1, 1)
+    old_delta_x = (old_x_max - old_x_min) / max(old_width-1, 1)
+    old_delta_y = (old_y_max - old_y_min) / max(old_height-1, 1)
+
+    # position of the borders of the new image, in the old one (PIL uses the
+    # borders of the pixels, and make_coordinates_array their centers)
+    box = ((x_min - delta_x/2 - old_x_min) / old_delta_x + 0.5,
+           (old_y_max - y_max - delta_y/2) / old_delta_y + 0.5,
+           (x_max + delta_x/2 - old_x_min) / old_delta_x + 0.5,
+           (old_y_max - y_min + delta_y/2) / old_delta_y + 0.5)
+    return PIL.Image.fromarray(np.asarray(old_img), "RGB").transform(
+        (width, height),
+        PIL.Image.Transform.EXTENT,
+        box,
+        PIL.Image.Resampling.BILINEAR
+    )
+# >>>2
+
+
+def rotation_order(output, function):       # <<<2
+    """return the order of the rotational symmetry around the origin that can
+    be used by ``sector_field`` (1 when sectors are not used)"""
+    if (output["display_mode"] != "plain" or
+            not function.get("rotation_sectors", ROTATION_SECTORS)):
+        return 1
+    pattern = function_pattern(function)
+    if pattern == "hyperbolic":
+        return 1
+    elif PATTERN[pattern]["type"] in ["plane group",
+                                      "color reversing plane group"]:
+        return function["wallpaper_N"]
+    elif (PATTERN[pattern]["type"] in ["frieze", "rosette"] and
+            function["sphere_mode"] != "frieze"):
+        return function["sphere_N"]
+    return 1
+# >>>2
+
+
+def sector_box(output, N):      # <<<2
+    """return the direction ``phi`` of the sector of angle 2pi/N used by
+    ``sector_field``, and the box (i, j, width, height) of pixels (in the
+    pixel coordinates of the image, but not necessarily inside the image)
+    containing the part of that sector needed for the image"""
+    width, height = output["size"]
+    x_min, x_max, y_min, y_max = output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+    delta_y = (y_max - y_min) / max(height-1, 1)
+    # the rotations around the origin are the same before and after the
+    # transformation (modulus / angle) of the output, so that everything is
+    # done with the coordinates of the pixels
+    radius = max(abs(complex(x, y))
+                 for x in [x_min, x_max] for y in [y_min, y_max])
+    a = pi / N
+    best = None
+    # sectors around an axis, or starting on an axis
+    for phi in [q*pi/2 + b for q in range(4) for b in [0, a]]:
+        points = [0, radius*exp(1j*(phi-a)), radius*exp(1j*(phi+a))]
+        for t in [0, pi/2, pi, -pi/2]:
+            if abs((t - phi + pi) % (2*pi) - pi) <= a:
+                points.append(radius*exp(1j*t))
+        # one more pixel on each side for the interpolation
+        i0 = floor((min(p.real for p in points) - x_min) / delta_x) - 1
+        i1 = ceil((max(p.real for p in points) - x_min) / delta_x) + 1
+        j0 = floor((min(p.imag for p in points) + y_max) / delta_y) - 1
+        j1 = ceil((max(p.imag for p in points) + y_max) / delta_y) + 1
+        box = (i0, j0, i1-i0+1, j1-j0+1)
+        if best is None or box[2]*box[3] < best[1][2]*best[1][3]:
+            best = phi, box
+    return best
+# >>>2
+
+
+def evaluation_cost(function):        # <<<2
+    """estimated cost of the computation of the complex value of a pixel
+    (including its coordinates, see EVALUATION_PIXEL_COST), relative to the
+    cost of a coefficient for a pixel with the direct engines"""
+    pattern = function_pattern(function)
+    if pattern == "hyperbolic":
+        return (len(function["matrix"]) * function["hyper_nb_steps"] +
+                EVALUATION_PIXEL_COST)
+    recipe = PATTERN[pattern]["recipe"]
+    if PATTERN[pattern]["type"] in ["plane group",
+                                    "color reversing plane group"]:
+        engine = function.get("wallpaper_engine", WALLPAPER_ENGINE)
+        if engine != "direct":
+            return (FFT_PIXEL_COST * function["wallpaper_N"] +
+                    EVALUATION_PIXEL_COST)
+        matrix = add_symmetries(function["matrix"], recipe,
+                                PATTERN[pattern]["parity"])
+        return len(matrix) * function["wallpaper_N"] + EVALUATION_PIXEL_COST
+    parity = PATTERN[pattern]["parity"].replace("N",
+                                                str(function["sphere_N"]))
+    return (len(add_symmetries(function["matrix"], recipe, parity)) +
+            EVALUATION_PIXEL_COST)
+# >>>2
+
+
+def sector_field(output, function, N, progress=None, out=None):     # <<<2
+    """compute the complex values of an image whose pattern is invariant
+    under rotations of angle 2pi/N around the origin
+
+    The values are only computed for the pixels of a sector of angle 2pi/N
+    (inside the box given by ``sector_box``). Every pixel of the image is
+    then rotated into the sector, and its value is interpolated (bilinearly)
+    from the box. The sector of the pixels is found from the rows where the
+    borders of the sectors cross each column, so that the rotations are
+    linear functions of the pixel coordinates.
+    Return None when this would be slower than computing all the pixels
+    (see SECTOR_PIXEL_COST).
+    The result is a (width, height) array, like the ones of
+    ``make_field_single_block``, stored in ``out`` when given."""
+    width, height = output["size"]
+    x_min, x_max, y_min, y_max = output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+    delta_y = (y_max - y_min) / max(height-1, 1)
+    phi, (box_i, box_j, box_width, box_height) = sector_box(output, N)
+
+    # the pixels of the box are computed if they are at most ``margin`` away
+    # from the sector
+    a = pi / N
+    margin = 2 * sqrt(delta_x**2 + delta_y**2)
+    radius = max(abs(complex(x, y))
+                 for x in [x_min, x_max] for y in [y_min, y_max]) + margin
+    sector_pixels = min(box_width*box_height,
+                        (a*radius**2 + 4*radius*margin) / (delta_x*delta_y))
+    cost = evaluation_cost(function)
+    if (sector_pixels*cost + width*height*SECTOR_PIXEL_COST >=
+            width*height*cost):
+        return None
+
+    variables = {"phi": phi, "ca": cos(a), "sa": sin(a), "m": margin,
+                 "r2": radius**2}
+    box = np.zeros((box_width, box_height), dtype="complex128")
+    grid = field_grid(function, sector_pixels)
+    if progress is not None:
+        progress.evaluate(sector_pixels)
+    chunk_width = max(1, FIELD_CHUNK // box_height)
+    for x in range(0, box_width, chunk_width):
+        local_output = region_output(output, box_i + x, box_j,
+                                     min(chunk_width, box_width-x),
+                                     box_height)
+        zs = make_coordinates_array(local_output["size"],
+                                    local_output["geometry"],
+                                    output["modulus"], output["angle"],
+                                    cache=False)
+        with profile("coordinates", zs.size):
+            # coordinates of the pixels in the direction of the sector
+            xs = np.arange(box_i + x, box_i + x + zs.shape[0])
+            ys = np.arange(box_j, box_j + box_height)
+            variables["X"] = (delta_x*xs + x_min)[:, None]
+            variables["Y"] = (delta_y*ys - y_max)[None, :]
+            variables["ps"] = ne.evaluate(
+                "(X + 1j*Y) * (cos(phi) - 1j*sin(phi))",
+                local_dict=variables)
+            inside = ne.evaluate(
+                "(ps.imag*ca - ps.real*sa <= m) & "
+                "(-ps.imag*ca - ps.real*sa <= m) & "
+                "(ps.real**2 + ps.imag**2 <= r2)", local_dict=variables)
+        box[x:x+chunk_width][inside] = make_field(zs[inside], function,
+                                                  progress, grid)
+    values = box.reshape(-1)
+
+    # rotation of angle -2pi k/N for the pixels of sector k
+    C = np.cos(2*pi*np.arange(N) / N)
+    S = np.sin(2*pi*np.arange(N) / N)
+    # rays between the sectors k and k+1, and direction in which the sector
+    # changes when going down a column (as y increases)
+    borders = phi + (2*np.arange(N) + 1) * a
+    slopes = np.tan(borders)
+
+    field = out if out is not None else np.empty((width, height),
+                                                 dtype="complex128")
+    chunk_width = max(1, FIELD_CHUNK // height)
+    ys = delta_y * np.arange(height, dtype="float") - y_max
+    with profile("interpolation", width*height):
+        for x in range(0, width, chunk_width):
+            local_width = min(chunk_width, width-x)
+            xs = delta_x * np.arange(x, x+local_width, dtype="float") + x_min
+            # sector of the first pixel of each column, and rows where each
+            # column crosses the borders: the sector increases (x >= 0) or
+            # decreases (x < 0) by one after each crossing
+            k0 = np.floor((np.arctan2(ys[0], xs) - phi) * N / (2*pi) + 0.5)
+            steps = np.zeros((local_width, height+1), dtype=np.int64)
+            right = xs >= 0
+            crossing = np.where(right[:, None] == (np.cos(borders) > 0),
+                                np.floor((xs[:, None]*slopes + y_max)
+                                         / delta_y) + 1,
+                                height)
+            crossing = np.clip(crossing, 0, height).astype(np.int64)
+            crossing[crossing == 0] = height
+            cols = np.broadcast_to(np.arange(local_width)[:, None],
+                                   crossing.shape)
+            np.add.at(steps, (cols, crossing),
+                      np.where(right, 1, -1)[:, None])
+            k = np.cumsum(steps[:, :height], axis=1)
+            k += k0.astype(np.int64)[:, None]
+            k %= N
+
+            variables = {"X": xs[:, None], "Y": ys[None, :],
+                         "c": C[k], "s": S[k],
+                         "x0": x_min + box_i*delta_x,
+                         "y0": box_j*delta_y - y_max,
+                         "dx": delta_x, "dy": delta_y,
+                         "wmax": box_width-2, "hmax": box_height-2,
+                         "bh": box_height}
+            # position of the rotated pixels in the box
+            u = ne.evaluate("(X*c + Y*s - x0) / dx", local_dict=variables)
+            v = ne.evaluate("(Y*c - X*s - y0) / dy", local_dict=variables)
+            variables.update(u=u, v=v)
+            i = ne.evaluate("where(u < 0, 0, where(u > wmax, wmax,"
+                            " floor(u)))", local_dict=variables)
+            j = ne.evaluate("where(v < 0, 0, where(v > hmax, hmax,"
+                            " floor(v)))", local_dict=variables)
+            variables.update(i=i, j=j)
+            idx = ne.evaluate("i*bh + j",
+                              local_dict=variables).astype(np.int64)
+            ne.evaluate("u - i", local_dict=variables, out=u)
+            ne.evaluate("v - j", local_dict=variables, out=v)
+            f00 = values[idx]
+            f01 = values[idx+1]
+            idx += box_height
+            f10 = values[idx]
+            f11 = values[idx+1]
+            field[x:x+local_width] = ne.evaluate(
+                "(f00*(1-v) + f01*v)*(1-u) + (f10*(1-v) + f11*v)*u")
+    return field
+# >>>2
+
+
+def frieze_period(output, function):      # <<<2
+    """return the horizontal period (in pixels, not necessarily a whole
+    number) of a frieze image that can be used by ``frieze_field``, or None"""
+    if (output["display_mode"] != "plain" or
+            output["angle"] % 180 != 0 or
+            function.get("frieze_engine", FRIEZE_ENGINE) != "period"):
+        return None
+    pattern = function_pattern(function)
+    if (pattern == "hyperbolic" or
+            PATTERN[pattern]["type"] not in ["frieze", "rosette"] or
+            function["sphere_mode"] != "frieze"):
+        return None
+    width, _ = output["size"]
+    x_min, x_max, _, _ = output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+    # the engine uses exp(zs*1j): the period is 2pi, or 2pi/N because of the
+    # rotation of order N
+    return 2*pi / function["sphere_N"] * output["modulus"] / delta_x
+# >>>2
+
+
+def frieze_field(output, function, period, progress=None, out=None):    # <<<2
+    """compute the complex values of a frieze image with the given horizontal
+    period (in pixels) by computing a single period and replicating it
+
+    When the period is a whole number of pixels, the columns are copied.
+    Otherwise, the period is computed with FRIEZE_OVERSAMPLING samples per
+    pixel, and the columns are interpolated (linearly) from them.
+    The result is a (width, height) array, like the ones of
+    ``make_field_single_block``, stored in ``out`` when given."""
+    width, height = output["size"]
+    x_min, x_max, y_min, y_max = output["geometry"]
+    delta_x = (x_max - x_min) / max(width-1, 1)
+
+    exact = abs(period - round(period)) < 1e-6
+    if exact:
+        nb_samples = int(round(period))
+    else:
+        nb_samples = ceil(period * FRIEZE_OVERSAMPLING)
+    # the strip contains an additional sample for the interpolation
+    step = period * delta_x / nb_samples
+    strip = np.empty((nb_samples+1, height), dtype="complex128")
+    if progress is not None:
+        progress.evaluate((nb_samples+1)*height)
+    chunk_width = max(1, FIELD_CHUNK // height)
+    for x in range(0, nb_samples+1, chunk_width):
+        local_width = min(chunk_width, nb_samples+1-x)
+        zs = make_coordinates_array(
+            (local_width, height),
+            (x_min + x*step, x_min + (x+local_width-1)*step, y_min, y_max),
+            output["modulus"], output["angle"], cache=False)
+        strip[x:x+local_width] = make_field(zs, function, progress)
+
+    field = out if out is not None else np.empty((width, height),
+                                                 dtype="complex128")
+    with profile("interpolation", width*height):
+        # position of each column in the strip
+        ts = np.arange(width) * (nb_samples / period) % nb_samples
+        if exact:
+            field[...] = strip[np.rint(ts).astype(np.int64) % nb_samples]
+        else:
+            i = np.floor(ts).astype(np.int64)
+            u = (ts - i)[:, None]
+            for x in range(0, width, chunk_width):
+                s0 = strip[i[x:x+chunk_width]]
+                s1 = strip[i[x:x+chunk_width]+1]
+                v = u[x:x+chunk_width]
+                field[x:x+chunk_width] = ne.evaluate("s0 + (s1-s0)*v")
+    return field
+# >>>2
+
+
+def symmetric_field(output, function, progress=None, out=None):      # <<<2
+    """compute the complex values of the whole image with ``sector_field`` or
+    ``frieze_field`` when the image has an appropriate symmetry, or return
+    None"""
+    order = rotation_order(output, function)
+    if order > 1:
+        return sector_field(output, function, order, progress, out=out)
+    period = frieze_period(output, function)
+    width = output["size"][0]
+    if period is not None and period*FRIEZE_OVERSAMPLING + 2 < width:
+        return frieze_field(output, function, period, progress, out=out)
+    return None
 # >>>2
 
 
@@ -1905,40 +3708,116 @@ def make_image_single_block(                 # <<<2
         color=None,             # configuration of colorwheel
         output=None,             # configuration of output
         function=None,          # configuration for function
-        message_queue=None,
-        nb_blocks=1,
-        nb_block=0):
-    """compute a subimage for a pattern"""
+        progress=None,          # Progress object
+        texture=None,           # texture for sphere images
+        grid=None):             # grid for wallpaper images
+    """compute a subimage for a pattern
+    (the background of sphere / inversion images is added by make_image)"""
+    res = make_field_single_block(output, function, progress, texture, grid)
+    return color_field(res, color, output)
+# >>>2
+
+
+def make_field_single_block(        # <<<2
+        output=None,             # configuration of output
+        function=None,          # configuration for function
+        progress=None,          # Progress object
+        texture=None,           # texture for sphere images
+        grid=None):             # grid for wallpaper images
+    """compute the array of complex values for a subimage
+    (values for pixels hidden by the background of sphere / inversion images
+    are 0)
+    when ``texture`` (see ``sphere_texture``) is given for a sphere image, the
+    values are interpolated from the texture
+    ``grid`` (see ``field_grid``) can be shared by the blocks of an image"""
+    if texture is not None and output["display_mode"] == "sphere":
+        zs, inside = block_coordinates(output, projection=False)
+        res = sample_sphere_texture(texture, zs, output["sphere_rotations"])
+    else:
+        zs, inside = block_coordinates(output)
+        if progress is not None and inside is not None:
+            # the hidden pixels are done
+            progress.skip(inside.size - zs.size)
+        res = make_field(zs, function, progress, grid)
+
+    if inside is not None:
+        tmp = np.zeros(inside.shape, dtype="complex128")
+        tmp[inside] = res
+        res = tmp
+    return res
+# >>>2
+
 
+def function_pattern(function):     # <<<2
+    """name of the pattern for a function configuration (a pair for color
+    reversing wallpaper patterns)"""
     if function["pattern_type"] == "wallpaper":
         if function["wallpaper_color_pattern"]:
-            pattern = (function["wallpaper_color_pattern"],
-                       function["wallpaper_pattern"])
+            return (function["wallpaper_color_pattern"],
+                    function["wallpaper_pattern"])
         else:
-            pattern = function["wallpaper_pattern"]
+            return function["wallpaper_pattern"]
     elif function["pattern_type"] == "sphere":
-        pattern = function["sphere_pattern"]
+        return function["sphere_pattern"]
     elif function["pattern_type"] == "hyperbolic":
-        pattern = "hyperbolic"
+        return "hyperbolic"
+# >>>2
 
-    zs = make_coordinates_array(
-        output["size"],
-        output["geometry"],
-        output["modulus"],
-        output["angle"]
-    )
 
-    if output["display_mode"] == "sphere":
-        zs = plane_coordinates_to_sphere(zs, output["sphere_rotations"])
-    elif output["display_mode"] == "inversion":
-        x = output["inversion_center"].real
-        y = -output["inversion_center"].imag
+def block_coordinates(output, projection=True):      # <<<2
+    """compute the coordinates used by the engines for the pixels of a
+    subimage, after projection on the sphere / inversion (unless
+    ``projection`` is false)
+    the result is a pair (zs, inside): when only the pixels in the unit disk
+    are needed (sphere / inversion), ``inside`` is the corresponding mask and
+    ``zs`` only contains those pixels, otherwise, ``inside`` is None"""
+    width, height = output["size"]
+    with profile("coordinates", width*height):
+        zs = make_coordinates_array(
+            output["size"],
+            output["geometry"],
+            output["modulus"],
+            output["angle"]
+        )
+
+        # pixels outside the unit disk will be covered by the background: we
+        # only compute the pattern for pixels inside the disk, and put the
+        # results back in a full array before applying the colors
+        inside = None
+        if output["display_mode"] in ["sphere", "inversion"]:
+            inside = ~sphere_mask(
+                output["size"],
+                output["geometry"],
+                output["modulus"]
+            ).transpose(1, 0)
+            if inside.all():
+                inside = None
+            else:
+                zs = zs[inside]
+    profile_bytes("coordinates", zs)
+
+    if projection and output["display_mode"] == "sphere":
+        with profile("projection", zs.size):
+            zs = plane_coordinates_to_sphere(zs, output["sphere_rotations"])
+    elif projection and output["display_mode"] == "inversion":
+        with profile("projection", zs.size):
+            x = output["inversion_center"].real
+            y = -output["inversion_center"].imag
+
+            # cf p 317 and 125 in Needlam (pdf 337 and 145)
+            # zs = np.conj(zs)
+            # zs = 2 / (zs + 1j) + 1j
+            two = complex(2,0)
+            ne.evaluate("(1j + two/(zs+1j) - x) * y", out=zs)
+    return zs, inside
+# >>>2
 
-        # cf p 317 and 125 in Needlam (pdf 337 and 145)
-        # zs = np.conj(zs)
-        # zs = 2 / (zs + 1j) + 1j
-        two = complex(2,0)
-        ne.evaluate("(1j + two/(zs+1j) - x) * y", out=zs)
+
+def make_field(zs, function, progress=None, grid=None):        # <<<2
+    """use the appropriate engine to compute the complex values for the
+    coordinates zs (which may be modified)
+    ``grid`` is the grid of wallpaper patterns, from ``field_grid``"""
+    pattern = function_pattern(function)
 
     if pattern == "hyperbolic":
         res = make_hyperbolic_image(
@@ -1946,9 +3825,8 @@ def make_image_single_block(                 # <<<2
             function["matrix"],
             nb_steps=function["hyper_nb_steps"],
             s=function["hyper_s"],
-            message_queue=message_queue,
-            nb_blocks=nb_blocks,
-            nb_block=nb_block
+            progress=progress,
+            engine=function.get("hyper_engine", HYPER_ENGINE)
         )
     elif PATTERN[pattern]["type"] in ["plane group",
                                       "color reversing plane group"]:
@@ -1958,9 +3836,10 @@ def make_image_single_block(                 # <<<2
             pattern,
             basis(pattern, *function["lattice_parameters"]),
             N=function["wallpaper_N"],
-            message_queue=message_queue,
-            nb_blocks=nb_blocks,
-            nb_block=nb_block
+            progress=progress,
+            engine=function.get("wallpaper_engine", WALLPAPER_ENGINE),
+            tolerance=function.get("fft_tolerance", FFT_TOLERANCE),
+            grid=grid
         )
     elif PATTERN[pattern]["type"] in ["sphere group", "frieze", "rosette"]:
         res = make_sphere_image(
@@ -1969,59 +3848,80 @@ def make_image_single_block(                 # <<<2
             pattern,
             N=function["sphere_N"],
             unwind=function["sphere_mode"] == "frieze",
-            message_queue=message_queue,
-            nb_blocks=nb_blocks,
-            nb_block=nb_block
+            progress=progress
         )
     else:
         # print(PATTERN[pattern]["type"])
         assert False
+    return res
+# >>>2
 
-    img = apply_color(
-        res, color["filename"],
-        geometry=color["geometry"],
-        modulus=color["modulus"],
-        angle=color["angle"],
-        stretch=color["stretch"],
-        color=color["default_color"],
-        morph_angle=output["morph"],
-        morph_start_angle=output["morph_start"],
-        morph_end_angle=output["morph_end"],
-        morph_stable=output["morph_stable_coeff"],
-    )
 
-    if (output["display_mode"] in ["sphere", "inversion"]):
-        return make_sphere_background(
-            output["geometry"],
-            output["modulus"],
-            output["angle"],
-            img,
-            background=output["sphere_background"],
-            fade=output["sphere_background_fading"],
-            stars=output["sphere_stars"]
-        )
-    else:
-        return img
+def field_grid(function, pixels):       # <<<2
+    """for wallpaper patterns, choose the engine used for the ``pixels``
+    values of an image and compute its grid once (see
+    ``wallpaper_field_grid``), so that it can be given to ``make_field`` for
+    all the blocks of the image
+    return None for other patterns"""
+    pattern = function_pattern(function)
+    if (pattern == "hyperbolic" or
+            PATTERN[pattern]["type"] not in ["plane group",
+                                             "color reversing plane group"]):
+        return None
+    with profile("symmetries"):
+        matrix = add_symmetries(function["matrix"],
+                                PATTERN[pattern]["recipe"],
+                                parity=PATTERN[pattern]["parity"])
+    with profile("evaluation"):
+        return wallpaper_field_grid(
+            matrix, pixels,
+            N=function["wallpaper_N"],
+            engine=function.get("wallpaper_engine", WALLPAPER_ENGINE),
+            tolerance=function.get("fft_tolerance", FFT_TOLERANCE))
 # >>>2
 
 
-# TODO: name all arguments???
-def make_tile(geometry,         # <<<2
-              transformation,
-              pattern,
-              basis,
-              size,
-              draw_tile=True,
-              draw_orbifold=True,
-              color_tile=False,
-              draw_mirrors=False):
-    """compute a transparent image with a tile and orbifold information
-    this image can be added on top of a wallpaper image"""
+def color_field(res, color, output):        # <<<2
+    """apply the colorwheel to an array of complex values (``res`` is
+    modified)"""
+    width, height = res.shape
+    with profile("color", width*height):
+        img = apply_color(
+            res, color["filename"],
+            geometry=color["geometry"],
+            modulus=color["modulus"],
+            angle=color["angle"],
+            stretch=color["stretch"],
+            color=color["default_color"],
+            morph_angle=output["morph"],
+            morph_start_angle=output["morph_start"],
+            morph_end_angle=output["morph_end"],
+            morph_stable=output["morph_stable_coeff"],
+        )
+    profile_bytes("color", res)
+
+    return img
+# >>>2
+
+
+def tile_shapes(        # <<<2
+        geometry,               # geometry of the output
+        transformation,         # (modulus, angle) of the output
+        pattern,                # name of pattern (or pair for color patterns)
+        basis,                  # basis of the lattice
+        size,                   # size of the output
+        draw_tile=True,
+        draw_orbifold=True,
+        color_tile=False,
+        draw_mirrors=False):
+    """compute the list of shapes to draw for a tile and orbifold information
+    each shape is either
+        - ("line", (x1, y1, x2, y2), color, width)
+        - ("disk", (x, y, r), color)
+    in pixel coordinates of the output"""
 
     draw_width = 1     # width (pixels) for strokes
-    aa_coeff = 4       # draw bigger tile and resize with antialiasing
-    width = size[0]*aa_coeff
-    height = size[1]*aa_coeff
+    width, height = size
 
     # translation of tile, necessary for some color-reversing tiles that are
     # not on the origin
@@ -2100,8 +4000,7 @@ def make_tile(geometry,         # <<<2
         else:
             pattern = pattern[1]
 
-    img = PIL.Image.new("RGBA", (width, height), (255, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
+    shapes = []
 
     modulus, angle = transformation
     angle = angle * pi / 180
@@ -2112,8 +4011,8 @@ def make_tile(geometry,         # <<<2
         z = modulus * complex(cos(angle), sin(angle)) * complex(x, y)
         x = z.real
         y = z.imag
-        delta_x = (x_max - x_min) / (width-1)
-        delta_y = (y_max - y_min) / (height-1)
+        delta_x = (x_max - x_min) / max(width-1, 1)
+        delta_y = (y_max - y_min) / max(height-1, 1)
         px = (x-x_min) / delta_x
         py = (y_max-y) / delta_y
         return px, py
@@ -2125,26 +4024,21 @@ def make_tile(geometry,         # <<<2
         return xy_to_pixel(x, y)
 
     def disks(*coord, color="white"):
-        R = 5*aa_coeff
-        R *= draw_width
+        R = 5*draw_width
         for i in range(0, len(coord), 2):
             x, y = XY_to_pixel(coord[i], coord[i+1])
-            draw.ellipse((x-R, y-R, x+R, y+R), fill=color)
+            shapes.append(("disk", (x, y, R), color))
 
     def line(*coord, color="white", width=1, caps=False):
         width *= draw_width
-        R = 5*aa_coeff*draw_width
+        R = 5*draw_width
         for i in range(2, len(coord), 2):
             x1, y1 = XY_to_pixel(coord[i-2], coord[i-1])
             x2, y2 = XY_to_pixel(coord[i], coord[i+1])
-            draw.line((x1, y1, x2, y2), fill=color, width=width*aa_coeff)
-            if caps:
-                draw.ellipse([x1-R, y1-R, x1+R, y1+R], fill=color)
-                draw.ellipse([x2-R, y2-R, x2+R, y2+R], fill=color)
-            else:
-                r = (width*aa_coeff)//2
-                draw.ellipse([x1-r, y1-r, x1+r, y1+r], fill=color)
-                draw.ellipse([x2-r, y2-r, x2+r, y2+r], fill=color)
+            shapes.append(("line", (x1, y1, x2, y2), color, width))
+            r = R if caps else width/2
+            shapes.append(("disk", (x1, y1, r), color))
+            shapes.append(("disk", (x2, y2, r), color))
 
     def mirror(X0, Y0, X1, Y1, order, pixels=50, width=1):
         width *= draw_width
@@ -2159,13 +4053,14 @@ def make_tile(geometry,         # <<<2
         x0, y0 = XY_to_pixel(X0, Y0)
         x1, y1 = XY_to_pixel(X1, Y1)
         p = complex(x1-x0, y1-y0)
-        p = p / abs(p) / 2 * aa_coeff
+        p = p / abs(p) / 2
 
         for i in range(order):
             q = p * exp(i*pi*1j/order) * pixels
             x2, y2 = q.real, q.imag
             x3, y3 = -x2, -y2
-            draw.line((x2+x0, y2+y0, x3+x0, y3+y0), width=3*width*aa_coeff, fill="red")
+            shapes.append(("line", (x2+x0, y2+y0, x3+x0, y3+y0), "red",
+                           3*width))
 
     # tile
     if draw_tile:
@@ -2229,19 +4124,1580 @@ def make_tile(geometry,         # <<<2
             line(1/4, 0, 3/4, 0, color="darkgreen", width=3, caps=True)
             line(1/4, 1/2, 3/4, 1/2, color="darkgreen", width=3, caps=True)
 
-    img = img.resize(size, PIL.Image.Resampling.LANCZOS)
+    return shapes
+# >>>2
+
+
+@lru_cache(maxsize=16)
+def _make_tile(geometry, transformation, pattern, basis, size,      # <<<2
+               draw_tile, draw_orbifold, color_tile, draw_mirrors):
+    """cached version of make_tile, all arguments must be hashable"""
+    aa_coeff = 4       # draw bigger tile and resize with antialiasing
+    width, height = size
+
+    img = PIL.Image.new("RGBA", size, (255, 0, 0, 0))
+
+    shapes = tile_shapes(geometry, transformation, pattern, basis, size,
+                         draw_tile=draw_tile,
+                         draw_orbifold=draw_orbifold,
+                         color_tile=color_tile,
+                         draw_mirrors=draw_mirrors)
+    if not shapes:
+        return img
+
+    # only draw (with antialiasing) the part of the image containing the
+    # shapes
+    xs, ys = [], []
+    for shape in shapes:
+        if shape[0] == "line":
+            x1, y1, x2, y2 = shape[1]
+            r = shape[3] / 2
+            xs.extend([x1-r, x1+r, x2-r, x2+r])
+            ys.extend([y1-r, y1+r, y2-r, y2+r])
+        else:
+            x, y, r = shape[1]
+            xs.extend([x-r, x+r])
+            ys.extend([y-r, y+r])
+    margin = 4      # for the resampling filter
+    x0 = max(0, int(min(xs)) - margin)
+    y0 = max(0, int(min(ys)) - margin)
+    x1 = min(width, ceil(max(xs)) + margin)
+    y1 = min(height, ceil(max(ys)) + margin)
+    if x1 <= x0 or y1 <= y0:
+        return img
+
+    big = PIL.Image.new("RGBA",
+                        ((x1-x0)*aa_coeff, (y1-y0)*aa_coeff),
+                        (255, 0, 0, 0))
+    draw = ImageDraw.Draw(big)
+
+    def to_big(x, y):
+        return (x-x0)*aa_coeff, (y-y0)*aa_coeff
+
+    for shape in shapes:
+        if shape[0] == "line":
+            _, (xa, ya, xb, yb), color, w = shape
+            draw.line((*to_big(xa, ya), *to_big(xb, yb)),
+                      fill=color, width=round(w*aa_coeff))
+        else:
+            _, (x, y, r), color = shape
+            x, y = to_big(x, y)
+            r = r*aa_coeff
+            draw.ellipse((x-r, y-r, x+r, y+r), fill=color)
+
+    small = big.resize((x1-x0, y1-y0), PIL.Image.Resampling.LANCZOS)
+    img.paste(small, (x0, y0))
+    return img
+# >>>2
+
+
+def make_tile(geometry,         # <<<2
+              transformation,
+              pattern,
+              basis,
+              size,
+              draw_tile=True,
+              draw_orbifold=True,
+              color_tile=False,
+              draw_mirrors=False):
+    """compute a transparent image with a tile and orbifold information
+    this image can be added on top of a wallpaper image
+    the images are cached: they shouldn't be modified"""
+    return _make_tile(
+        tuple(geometry),
+        tuple(transformation),
+        pattern if isinstance(pattern, str) else tuple(pattern),
+        tuple(map(tuple, basis)),
+        tuple(size),
+        bool(draw_tile), bool(draw_orbifold),
+        bool(color_tile), bool(draw_mirrors)
+    )
+# >>>2
+
+
+def tile_to_svg(        # <<<2
+        geometry,
+        transformation,
+        pattern,
+        basis,
+        size,
+        draw_tile=True,
+        draw_orbifold=True,
+        color_tile=False,
+        draw_mirrors=False):
+    """return an SVG document with the tile and orbifold information, with
+    the same coordinates as the output image"""
+    width, height = size
+    shapes = tile_shapes(geometry, transformation, pattern, basis, size,
+                         draw_tile=draw_tile,
+                         draw_orbifold=draw_orbifold,
+                         color_tile=color_tile,
+                         draw_mirrors=draw_mirrors)
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+             'width="{0}" height="{1}" viewBox="0 0 {0} {1}">'
+             .format(width, height)]
+    for shape in shapes:
+        if shape[0] == "line":
+            _, (x1, y1, x2, y2), color, w = shape
+            lines.append('  <line x1="{:.2f}" y1="{:.2f}" x2="{:.2f}" '
+                         'y2="{:.2f}" stroke="{}" stroke-width="{}"/>'
+                         .format(x1, y1, x2, y2, color, w))
+        else:
+            _, (x, y, r), color = shape
+            lines.append('  <circle cx="{:.2f}" cy="{:.2f}" r="{:.2f}" '
+                         'fill="{}"/>'
+                         .format(x, y, r, color))
+    lines.append("</svg>")
+    return "\n".join(lines) + "\n"
+# >>>2
+
+
+def fade_array(array, coeff=100, out=None, chunk=2**16):     # <<<2
+    """fade an RGB uint8 array toward white: each value v becomes
+        (coeff*v + (255-coeff)*255) / 255
+    The multiply-add is precomputed for the 256 possible values and applied
+    with a lookup table, by chunks of rows to avoid big temporary arrays.
+    The result is put in ``out`` (which can be ``array`` itself, or None to get
+    a new array)."""
+    coeff = min(max(int(coeff), 0), 255)
+    lut = np.arange(256, dtype=np.uint16) * coeff + 255 * (255-coeff) + 127
+    lut = (lut // 255).astype(np.uint8)
+    if out is None:
+        out = np.empty_like(array)
+    rows = max(1, chunk // max(1, array.shape[1]))
+    for y in range(0, array.shape[0], rows):
+        np.take(lut, array[y:y+rows], out=out[y:y+rows])
+    return out
+# >>>2
+
+
+def blend_overlay(array, overlay):      # <<<2
+    """alpha blend an RGBA overlay (image or array) on top of an RGB uint8
+    array, in place
+    only the part of the array covered by the overlay is modified"""
+    overlay = np.asarray(overlay)
+    alpha = overlay[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if len(rows) == 0:
+        return array
+    cols = np.flatnonzero(alpha.any(axis=0))
+    y0, y1 = rows[0], rows[-1] + 1
+    x0, x1 = cols[0], cols[-1] + 1
+
+    a = alpha[y0:y1, x0:x1, None].astype(np.uint16)
+    region = array[y0:y1, x0:x1]
+    region[...] = (region * (255-a) +
+                   overlay[y0:y1, x0:x1, :3] * a +
+                   127) // 255
+    return array
+# >>>2
+
+
+def fade_image(image, coeff=100):       # <<<2
+    """return a faded version of the image"""
+    # TODO allow fading to black and use in make_sphere_background
+    array = fade_array(np.asarray(image.convert("RGB")), coeff)
+    return PIL.Image.fromarray(array, "RGB")
+# >>>2
+
+
+def fade_coefficient(output):       # <<<2
+    """coefficient given to fade_array / fade_image for an output
+    configuration (the "fade_coeff" field is the amount of fading)"""
+    return 255 - output.get("fade_coeff", FADE_COEFF)
+# >>>2
+# >>>1
+
+
+###
+# on disk cache
+# <<<1
+
+# configuration keys that don't change the result of ``make_image``
+CACHE_IGNORED_KEYS = [      # <<<2
+    "filename_template", "save_directory", "block_size", "svg_overlay",
+    "draw_tile", "draw_orbifold", "draw_color_tile", "draw_mirrors",
+    "fade", "fade_coeff",
+    "sphere_background", "sphere_background_fading", "sphere_stars",
+    "random_nb_coeffs", "random_min_degre", "random_max_degre",
+    "random_modulus", "random_noise",
+]
+# configuration keys that only change the colors of the image
+CACHE_COLOR_KEYS = [
+    "morph", "morph_start", "morph_end", "morph_stable_coeff",
+]
+# >>>2
+
+
+@lru_cache(maxsize=32)
+def _file_digest(filename, mtime, size):     # <<<2
+    with open(filename, mode="rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+# >>>2
+
+
+def file_digest(filename):      # <<<2
+    """digest of the content of a file (cached as long as the file is not
+    modified)"""
+    filename = os.path.expanduser(filename)
+    stat = os.stat(filename)
+    return _file_digest(filename, stat.st_mtime, stat.st_size)
+# >>>2
+
+
+def render_key(kind, output, function, color=None):      # <<<2
+    """compute the key for an image / array of complex values
+    ``kind`` is "image" (``color`` is then required) or "field" """
+    def normalize(d, ignored):
+        d = dict((k, v) for k, v in d.items() if k not in ignored)
+        if d.get("matrix") is not None:
+            d["matrix"] = sorted(matrix_to_list(d["matrix"]))
+        return d
+
+    cfg = {
+        "version": CACHE_VERSION,
+        "kind": kind,
+        "output": normalize(
+            output,
+            CACHE_IGNORED_KEYS +
+            (CACHE_COLOR_KEYS if kind == "field" else [])
+        ),
+        "function": normalize(function, CACHE_IGNORED_KEYS),
+    }
+    if kind == "image":
+        cfg["colorwheel"] = normalize(color, ["filename"])
+        cfg["colorwheel"]["digest"] = file_digest(color["filename"])
+    s = json.dumps(cfg, sort_keys=True, default=str)
+    return kind + "-" + hashlib.sha256(s.encode("UTF-8")).hexdigest()
+# >>>2
+
+
+class RenderCache(object):      # <<<2
+    """content addressed cache for images and arrays of complex values
+
+    entries are ``.npy`` files (``.npz`` for complex values) in
+    ``directory``, named after a hash of the configuration. When the total
+    size of the files is bigger than ``max_size``, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self,      # <<<3
+                 directory=CACHE_DIRECTORY,
+                 max_size=CACHE_SIZE,
+                 fields=False):     # also cache the complex values
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.fields = fields
+        os.makedirs(self.directory, exist_ok=True)
+    # >>>3
+
+    def key(self, kind, output, function, color=None):      # <<<3
+        """compute the key for an image / array of complex values, see
+        ``render_key``"""
+        return render_key(kind, output, function, color)
+    # >>>3
+
+    def filename(self, key):        # <<<3
+        ext = ".npz" if key.startswith("field-") else ".npy"
+        return os.path.join(self.directory, key + ext)
+    # >>>3
+
+    def get(self, key):     # <<<3
+        """return the array for a key, or None"""
+        filename = self.filename(key)
+        try:
+            if filename.endswith(".npz"):
+                with np.load(filename) as data:
+                    array = data["field"]
+            else:
+                array = np.load(filename)
+            # the modification time is used for LRU eviction
+            os.utime(filename)
+            return array
+        except (OSError, ValueError, KeyError):
+            return None
+    # >>>3
+
+    def put(self, key, array):      # <<<3
+        """store an array (the file is written atomically so that several
+        processes can share the cache)"""
+        filename = self.filename(key)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, mode="wb") as f:
+                if filename.endswith(".npz"):
+                    np.savez_compressed(f, field=array)
+                else:
+                    np.save(f, array)
+            os.replace(tmp, filename)
+        except OSError as e:
+            error("cannot write cache entry {}: {}".format(filename, e))
+            return
+        self.evict()
+    # >>>3
+
+    def evict(self):        # <<<3
+        """remove least recently used entries until the cache is smaller than
+        ``max_size``"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith((".npy", ".npz")):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    # >>>3
+# >>>2
+# >>>1
+
+
+###
+# rendering without the GUI
+# <<<1
+
+class MemoryCache(object):      # <<<2
+    """in memory cache for images and arrays of complex values, with the same
+    interface as RenderCache (and used in the same way by ``make_image``)
+
+    The least recently used entries are removed when the arrays take more
+    than ``max_size`` bytes. Entries that are not found are looked up in
+    ``parent`` (a RenderCache or another MemoryCache) when given, and new
+    entries are also stored there. The cache can be shared by several
+    threads.
+    """
+
+    def __init__(self,      # <<<3
+                 max_size=RENDERER_CACHE_SIZE,
+                 parent=None):
+        self.max_size = max_size
+        self.parent = parent
+        self.fields = True
+        self.size = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+    # >>>3
+
+    def key(self, kind, output, function, color=None):      # <<<3
+        """compute the key for an image / array of complex values, see
+        ``render_key``"""
+        return render_key(kind, output, function, color)
+    # >>>3
+
+    def get(self, key):     # <<<3
+        """return the array for a key, or None
+        the array is shared with the cache and shouldn't be modified"""
+        with self._lock:
+            array = self._entries.pop(key, None)
+            if array is not None:
+                # most recently used entries are at the end
+                self._entries[key] = array
+        if array is None and self.parent is not None:
+            array = self.parent.get(key)
+            if array is not None:
+                self._store(key, array)
+        return array
+    # >>>3
+
+    def put(self, key, array):      # <<<3
+        """store a copy of an array"""
+        if array.nbytes <= self.max_size:
+            self._store(key, array.copy())
+        if self.parent is not None and (self.parent.fields or
+                                        not key.startswith("field-")):
+            self.parent.put(key, array)
+    # >>>3
+
+    def _store(self, key, array):       # <<<3
+        if array.nbytes > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key).nbytes
+            self._entries[key] = array
+            self.size += array.nbytes
+            while self.size > self.max_size:
+                oldest = next(iter(self._entries))
+                self.size -= self._entries.pop(oldest).nbytes
+    # >>>3
+
+    def clear(self):        # <<<3
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    # >>>3
+# >>>2
+
+
+class Renderer(object):     # <<<2
+    """compute images for a configuration, without the GUI
+
+    The renderer is configured once with a (partial) configuration, in the
+    format of ``.ct`` files (missing values are taken from
+    ``default_config``), and can then compute many images:
+
+        renderer = Renderer(colorwheel={"filename": "wheel.jpg"},
+                            function={"wallpaper_pattern": "442"})
+        img = renderer.render(size=(400, 400))
+        renderer.update(colorwheel={"angle": 90})
+        img = renderer.render(size=(400, 400))
+
+    Images and arrays of complex values are kept in memory between calls
+    (``cache_size`` bytes), so that changing only the colorwheel or the
+    morphing doesn't recompute the pattern. When ``cache`` (a RenderCache)
+    is given, it is used for the entries that aren't in memory.
+
+    When the configuration has no matrix, a random matrix is chosen (from
+    ``random_seed`` when given) and kept. ``random_seed`` is also used for the
+    "stars" of sphere images (default: RANDOM_SEED).
+    """
+
+    def __init__(self,      # <<<3
+                 config=None,           # (partial) configuration
+                 colorwheel=None,       # (partial) colorwheel configuration
+                 output=None,           # (partial) output configuration
+                 function=None,         # (partial) function configuration
+                 block_size=None,       # None: use the configuration
+                 nb_workers=1,          # number of renderers used in parallel
+                 random_seed=None,      # seed for the matrix and stars
+                 cache=None,            # RenderCache object
+                 cache_size=RENDERER_CACHE_SIZE):
+        self.config = default_config()
+        self.nb_workers = nb_workers
+        self.random_seed = random_seed
+        self.cache = MemoryCache(cache_size, parent=cache)
+        self.update(config, colorwheel=colorwheel, output=output,
+                    function=function)
+        if block_size is not None:
+            self.config["output"]["block_size"] = block_size
+    # >>>3
+
+    def update(self,        # <<<3
+               config=None,
+               colorwheel=None,
+               output=None,
+               function=None):
+        """change (part of) the configuration"""
+        cfg = copy.deepcopy(config or {})
+        for d, c in [("colorwheel", colorwheel),
+                     ("output", output),
+                     ("function", function)]:
+            if c is not None:
+                cfg.setdefault(d, {}).update(copy.deepcopy(c))
+        merge_config(self.config, cfg)
+        normalize_config(self.config)
+
+        function = self.config["function"]
+        if function["matrix"] is None:
+            if self.random_seed is not None:
+                seed(self.random_seed)
+            function["matrix"] = random_matrix(
+                function["random_nb_coeffs"],
+                function["random_min_degre"],
+                function["random_max_degre"],
+                function["random_modulus"],
+            )
+            if self.random_seed is not None:
+                seed()
+        if "filename" not in self.config["colorwheel"]:
+            raise Error("no colorwheel file")
+    # >>>3
+
+    def _output(self, size, geometry):      # <<<3
+        output = copy.deepcopy(self.config["output"])
+        if size is not None:
+            output["size"] = tuple(size)
+        if geometry is not None:
+            output["geometry"] = tuple(geometry)
+        return output
+    # >>>3
+
+    def _render(self, output, overlay, progress):       # <<<3
+        img = make_image(
+            color=self.config["colorwheel"],
+            output=output,
+            function=self.config["function"],
+            nb_workers=self.nb_workers,
+            as_array=True,
+            progress=progress,
+            cache=self.cache,
+            random_seed=self.random_seed
+        )
+        if output["fade"]:
+            with profile("fade", img.shape[0]*img.shape[1]):
+                fade_array(img, fade_coefficient(output), out=img)
+        if overlay:
+            draw_overlay(img, output, self.config["function"])
+        return img
+    # >>>3
+
+    def render(self,        # <<<3
+               size=None,           # size of the image (default: configuration)
+               geometry=None,       # geometry (default: configuration)
+               as_array=False,      # return a (height, width, 3) uint8 array
+               overlay=True,        # draw the tile / orbifold, if configured
+               progress=None):      # function receiving progress reports
+        """compute the image for the configuration"""
+        img = self._render(self._output(size, geometry), overlay, progress)
+        if as_array:
+            return img
+        return PIL.Image.fromarray(img, "RGB")
+    # >>>3
+
+    def render_tile(self,       # <<<3
+                    x, y,               # position (in pixels) of the subimage
+                    width, height,      # size of the subimage
+                    size=None,          # size of the whole image
+                    geometry=None,      # geometry of the whole image
+                    as_array=False,
+                    overlay=True,
+                    progress=None):
+        """compute the subimage of size (width, height) at pixel (x, y) of the
+        image, so that the subimages can be assembled into the whole image
+        (the random "stars" of sphere images are chosen for each subimage)"""
+        output = region_output(self._output(size, geometry),
+                               x, y, width, height)
+        img = self._render(output, overlay, progress)
+        if as_array:
+            return img
+        return PIL.Image.fromarray(img, "RGB")
+    # >>>3
+
+    def render_field(self,      # <<<3
+                     size=None,
+                     geometry=None,
+                     progress=None):
+        """compute the complex values of the pattern for each pixel, as a
+        (height, width) complex array
+        (the values for pixels hidden by the background of sphere / inversion
+        images are 0)"""
+        output = self._output(size, geometry)
+        function = self.config["function"]
+        key = render_key("field", output, function)
+        field = self.cache.get(key)
+        if field is None:
+            reporter = None
+            if progress is not None:
+                reporter = Progress(progress, None, 1,
+                                    output["size"][0]*output["size"][1])
+            field = symmetric_field(output, function, reporter)
+            if field is None:
+                texture = None
+                if (output["display_mode"] == "sphere" and
+                        output.get("sphere_texture", SPHERE_TEXTURE)):
+                    texture = sphere_texture(function,
+                                             output["sphere_texture"],
+                                             self.cache, reporter)
+                field = make_field_single_block(output, function, reporter,
+                                                texture)
+            self.cache.put(key, field)
+            if reporter is not None:
+                reporter.report("done")
+        return field.transpose().copy()
+    # >>>3
+
+    def save(self, progress=None):       # <<<3
+        """compute the image and save it (with its configuration) as
+        ``save_image`` does, and return the filename"""
+        img = self._render(self._output(None, None), False, progress)
+        return save_image(image=img, **self.config)
+    # >>>3
+# >>>2
+# >>>1
+
+
+###
+# render server
+# <<<1
+
+# formats of images returned by the render server: Pillow format and MIME type
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+
+
+class RenderService(object):        # <<<2
+    """compute the images requested from the render server
+
+    Configurations are in the format of ``.ct`` files. Requests for a
+    configuration that is already being computed wait for the result instead
+    of computing it again. All the requests share an in memory cache for
+    images and complex values (in front of ``cache``, a RenderCache, when
+    given), and the colorwheels, recipes, etc. cached by the program stay
+    loaded between requests.
+    At most ``nb_renders`` images are computed simultaneously.
+    """
+
+    def __init__(self,      # <<<3
+                 cache=None,
+                 cache_size=SERVER_CACHE_SIZE,
+                 nb_renders=1):
+        self.cache = MemoryCache(cache_size, parent=cache)
+        self.start = time.perf_counter()
+        self.stats = {"requests": 0, "renders": 0, "coalesced": 0,
+                      "errors": 0}
+        self._slots = threading.Semaphore(max(1, nb_renders))
+        self._lock = threading.Lock()
+        self._pending = {}
+    # >>>3
+
+    def request_key(self, config, fmt):     # <<<3
+        """identify identical requests, or return None when the request
+        cannot be shared (random matrix)"""
+        cfg = merge_config(default_config(), config)
+        if cfg["function"]["matrix"] is None:
+            return None
+        cfg = dict((d, cfg[d]) for d in ["colorwheel", "output", "function"])
+        cfg["format"] = IMAGE_FORMATS[fmt][0]
+        s = json.dumps(cfg, sort_keys=True, default=str)
+        return hashlib.sha256(s.encode("UTF-8")).hexdigest()
+    # >>>3
+
+    def render(self, config, fmt="png"):        # <<<3
+        """return the encoded image for a configuration, and whether the
+        result was shared with another request"""
+        key = self.request_key(config, fmt)
+        with self._lock:
+            self.stats["requests"] += 1
+            job = self._pending.get(key) if key is not None else None
+            if job is None:
+                job = {"done": threading.Event(), "data": None,
+                       "error": None}
+                if key is not None:
+                    self._pending[key] = job
+                owner = True
+            else:
+                self.stats["coalesced"] += 1
+                owner = False
+
+        if owner:
+            try:
+                with self._slots:
+                    job["data"] = self._render(config, fmt)
+            except Exception as e:
+                job["error"] = e
+            finally:
+                with self._lock:
+                    self.stats["renders"] += 1
+                    if job["error"] is not None:
+                        self.stats["errors"] += 1
+                    if key is not None:
+                        del self._pending[key]
+                job["done"].set()
+        else:
+            job["done"].wait()
+
+        if job["error"] is not None:
+            raise job["error"]
+        return job["data"], not owner
+    # >>>3
+
+    def _render(self, config, fmt):     # <<<3
+        renderer = Renderer(config, cache=self.cache, cache_size=0)
+        width, height = renderer.config["output"]["size"]
+        if width * height > SERVER_MAX_PIXELS:
+            raise Error("image too big: {}x{}".format(width, height))
+        img = renderer.render()
+        with profile("encode", width*height):
+            buffer = io.BytesIO()
+            img.save(buffer, format=IMAGE_FORMATS[fmt][0])
+        return buffer.getvalue()
+    # >>>3
+
+    def status(self):       # <<<3
+        with self._lock:
+            status = dict(self.stats)
+            status["pending"] = len(self._pending)
+        status["cache_size"] = self.cache.size
+        status["uptime"] = time.perf_counter() - self.start
+        return status
+    # >>>3
+# >>>2
+
+
+def render_server(service, host=SERVER_HOST, port=SERVER_PORT):      # <<<2
+    """return an HTTP server (started with its ``serve_forever`` method) for
+    a RenderService, answering
+        POST /render?format=png     the body is a JSON configuration, the
+                                    answer is the image (png or jpeg)
+        GET /status                 statistics, as JSON
+    each request is handled in its own thread"""
+
+    class RequestHandler(http_server.BaseHTTPRequestHandler):
+        def send_json(self, code, value):
+            data = json.dumps(value).encode("UTF-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if urllib_parse.urlsplit(self.path).path == "/status":
+                self.send_json(200, service.status())
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urllib_parse.urlsplit(self.path)
+            if url.path != "/render":
+                self.send_json(404, {"error": "not found"})
+                return
+            fmt = urllib_parse.parse_qs(url.query).get("format", ["png"])[0]
+            fmt = fmt.lower()
+            if fmt not in IMAGE_FORMATS:
+                self.send_json(400, {"error": "unknown format '{}'"
+                                              .format(fmt)})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                config = json.loads(self.rfile.read(length))
+                if not isinstance(config, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                self.send_json(400, {"error": "invalid configuration: {}"
+                                              .format(e)})
+                return
+
+            try:
+                data, coalesced = service.render(config, fmt)
+            except (Error, OSError, KeyError, ValueError, TypeError) as e:
+                self.send_json(400, {"error": "{}: {}"
+                                              .format(type(e).__name__, e)})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": "{}: {}"
+                                              .format(type(e).__name__, e)})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", IMAGE_FORMATS[fmt][1])
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("X-Coalesced", "1" if coalesced else "0")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            message("{} - {}".format(self.address_string(), format % args))
+
+    server = http_server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    return server
+# >>>2
+# >>>1
+
+
+###
+# batch jobs
+# <<<1
+def batch_inputs(args):      # <<<2
+    """return the list of (name, config) for the arguments of a batch job
+    each argument can be
+      - a configuration file,
+      - a glob pattern (like "catalogue/*.ct"),
+      - a manifest (".jsonl" file) where each line is either the name of a
+        configuration file or a (partial) configuration
+    configurations that cannot be read are given as (name, Error)"""
+    inputs = []
+
+    def add_file(filename):
+        try:
+            with open(filename) as f:
+                inputs.append((filename, json.load(f)))
+        except Exception as e:
+            inputs.append((filename, Error("cannot read '{}': {}"
+                                           .format(filename, e))))
+
+    for arg in args:
+        if arg.endswith(".jsonl"):
+            directory = os.path.dirname(arg)
+            try:
+                lines = open(arg).readlines()
+            except OSError as e:
+                inputs.append((arg, Error("cannot read manifest '{}': {}"
+                                          .format(arg, e))))
+                continue
+            for i, line in enumerate(lines):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                name = "{}:{}".format(arg, i+1)
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    inputs.append((name, Error("invalid line: {}".format(e))))
+                    continue
+                if isinstance(entry, str):
+                    add_file(os.path.join(directory, entry))
+                else:
+                    inputs.append((entry.get("name", name), entry))
+        elif glob.has_magic(arg):
+            for filename in sorted(glob.glob(arg)):
+                add_file(filename)
+        else:
+            add_file(arg)
+    return inputs
+# >>>2
+
+
+def _batch_init(lock, nb_threads, cache):        # <<<2
+    """initialize a worker process for batch jobs"""
+    global _BATCH_LOCK, RENDER_CACHE
+    _BATCH_LOCK = lock
+    RENDER_CACHE = cache
+    ne.set_num_threads(nb_threads)
+# >>>2
+
+
+_BATCH_LOCK = None
+
+
+def batch_job(job):     # <<<2
+    """compute and save the image for a job of ``run_batch``
+    the workers are long lived, so that cached values (colorwheels, recipes,
+    coordinates, ...) are shared between the jobs of a worker"""
+    name, config, nb_workers = job
+    result = {"name": name, "output": None, "error": None}
+    start = time.perf_counter()
+    try:
+        function = config["function"]
+        if function["matrix"] is None:
+            function["matrix"] = random_matrix(
+                function["random_nb_coeffs"],
+                function["random_min_degre"],
+                function["random_max_degre"],
+                function["random_modulus"],
+            )
+        img = make_image(
+            color=config["colorwheel"],
+            output=config["output"],
+            function=function,
+            nb_workers=nb_workers,
+            as_array=True,
+            cache=RENDER_CACHE
+        )
+        if config["output"]["fade"]:
+            fade_array(img, fade_coefficient(config["output"]), out=img)
+        # choosing the filename and writing the files must not be done
+        # concurrently
+        with _BATCH_LOCK or nullcontext():
+            result["output"] = save_image(image=img, **config)
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["traceback"] = traceback.format_exc()
+    result["time"] = time.perf_counter() - start
+    return result
+# >>>2
+
+
+def run_batch(      # <<<2
+        args,               # configuration files, glob patterns, manifests
+        overrides=None,     # (partial) configuration applied to all the jobs
+        nb_jobs=None,       # number of worker processes (default: all CPUs)
+        report=None):       # JSON file for the summary
+    """compute the images for many configurations with a pool of worker
+    processes, and return the number of failures"""
+    start = time.perf_counter()
+    results = []
+    jobs = []
+    for name, cfg in batch_inputs(args):
+        if isinstance(cfg, Exception):
+            results.append({"name": name, "output": None, "time": 0,
+                            "error": str(cfg)})
+            continue
+        config = default_config()
+        merge_config(config, cfg)
+        if overrides:
+            merge_config(config, overrides)
+        jobs.append((name, normalize_config(config)))
+
+    nb_jobs = max(1, min(nb_jobs or os.cpu_count() or 1, len(jobs) or 1))
+    # biggest images first, for a better balance between the workers
+    jobs.sort(key=lambda j: -j[1]["output"]["size"][0] *
+              j[1]["output"]["size"][1])
+
+    nb = len(jobs) + len(results)
+    for r in results:
+        error("[{}/{}] {}: {}".format(results.index(r)+1, nb,
+                                      r["name"], r["error"]))
+    with multiprocessing.Pool(nb_jobs,
+              initializer=_batch_init,
+              initargs=(multiprocessing.Lock(),
+                        max(1, (os.cpu_count() or 1) // nb_jobs),
+                        RENDER_CACHE)) as pool:
+        for r in pool.imap_unordered(batch_job,
+                                     [(n, c, nb_jobs) for n, c in jobs]):
+            results.append(r)
+            if r["error"] is None:
+                message("[{}/{}] {} -> {} ({:.1f}s)"
+                        .format(len(results), nb, r["name"], r["output"],
+                                r["time"]))
+            else:
+                error("[{}/{}] {}: {}"
+                      .format(len(results), nb, r["name"], r["error"]))
+
+    failures = [r for r in results if r["error"] is not None]
+    total = time.perf_counter() - start
+    message("{} images in {:.1f}s ({} workers), {} failure(s)"
+            .format(len(results) - len(failures), total, nb_jobs,
+                    len(failures)))
+    if report is not None:
+        with open(report, mode="w") as f:
+            json.dump({
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "nb_workers": nb_jobs,
+                "time": total,
+                "nb_images": len(results) - len(failures),
+                "nb_failures": len(failures),
+                "results": results,
+            }, f, indent=2)
+    return len(failures)
+# >>>2
+# >>>1
+
+
+###
+# random search
+# <<<1
+def symmetrize_matrix(M, function):      # <<<2
+    """add the symmetries of the pattern of a function configuration to a
+    matrix"""
+    pattern = function_pattern(function)
+    if pattern == "hyperbolic":
+        return M
+    parity = PATTERN[pattern]["parity"]
+    if function["pattern_type"] == "sphere":
+        parity = parity.replace("N", str(function["sphere_N"]))
+    return add_symmetries(M, PATTERN[pattern]["recipe"], parity)
+# >>>2
+
+
+def image_statistics(array, default_color=DEFAULT_COLOR, mask=None):      # <<<2
+    """cheap statistics to score an image, given as a (height, width, 3)
+    uint8 array:
+      - "entropy": entropy of the colors (with 4 bits per channel), between
+        0 and 1
+      - "edges": fraction of pixels where the luminosity changes a lot
+      - "default": fraction of pixels with the default color (outside of the
+        colorwheel)
+      - "score": entropy * (1 - default), penalized when the density of
+        edges is far from SEARCH_EDGE_DENSITY
+    ``mask`` is a (height, width) boolean array of the pixels to consider"""
+    if isinstance(default_color, str):
+        default_color = ImageColor.getrgb(default_color)
+    pixels = array[mask] if mask is not None else array.reshape(-1, 3)
+    if len(pixels) == 0:
+        return {"entropy": 0, "edges": 0, "default": 1, "score": 0}
+
+    q = (pixels >> 4).astype(np.int32)
+    hist = np.bincount(q[:, 0]*256 + q[:, 1]*16 + q[:, 2], minlength=4096)
+    p = hist[hist > 0] / len(pixels)
+    entropy = float(-(p * np.log2(p)).sum() / 12)
+
+    default = float(np.all(pixels == default_color, axis=1).mean())
+
+    lum = array.astype(np.float32) @ np.array([0.299, 0.587, 0.114],
+                                              dtype=np.float32)
+    edges = np.zeros(lum.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(lum, axis=1)) > 24
+    edges[1:, :] |= np.abs(np.diff(lum, axis=0)) > 24
+    edges = float(edges[mask].mean() if mask is not None else edges.mean())
+
+    t = SEARCH_EDGE_DENSITY
+    score = entropy * (1 - default) * exp(-((edges - t) / t)**2).real
+    return {"entropy": entropy, "edges": edges, "default": default,
+            "score": score}
+# >>>2
+
+
+def thumbnail_output(output, size=SEARCH_SIZE):       # <<<2
+    """output configuration for a thumbnail (largest side ``size``) with the
+    same geometry as ``output``"""
+    output = copy.deepcopy(output)
+    width, height = output["size"]
+    ratio = size / max(width, height)
+    output["size"] = (max(1, round(width*ratio)), max(1, round(height*ratio)))
+    return output
+# >>>2
+
+
+_SEARCH = None
+
+
+def _search_init(color, output, function, nb_threads=None):      # <<<2
+    """compute the coordinates shared by all the candidates of a search"""
+    global _SEARCH
+    if nb_threads is not None:
+        ne.set_num_threads(nb_threads)
+    zs, inside = block_coordinates(output)
+    _SEARCH = (color, output, function, zs, inside)
+# >>>2
+
+
+def search_candidate(job):      # <<<2
+    """compute the thumbnail and statistics for a matrix, using the
+    coordinates computed by ``_search_init``"""
+    n, matrix = job
+    color, output, function, zs, inside = _SEARCH
+    function = dict(function, matrix=matrix)
+    res = make_field(zs.copy(), function)
+    if inside is not None:
+        tmp = np.zeros(inside.shape, dtype="complex128")
+        tmp[inside] = res
+        res = tmp
+    img = np.array(color_field(res, color, output))
+    mask = inside.transpose(1, 0) if inside is not None else None
+    stats = image_statistics(img, color["default_color"], mask)
+    if output["display_mode"] in ["sphere", "inversion"]:
+        make_sphere_background(
+            output["geometry"],
+            output["modulus"],
+            output["angle"],
+            img,
+            background=output["sphere_background"],
+            fade=output["sphere_background_fading"],
+            stars=output["sphere_stars"]
+        )
+    stats["n"] = n
+    stats["matrix"] = matrix
+    stats["thumbnail"] = img
+    return stats
+# >>>2
+
+
+def random_search(      # <<<2
+        config,                         # configuration for the pattern
+        nb_candidates=SEARCH_CANDIDATES,
+        size=SEARCH_SIZE,               # largest side of thumbnails
+        nb_jobs=None,                   # number of processes
+        progress=None):                 # function called with (done, total)
+    """generate random matrices with the symmetries of the pattern, compute
+    small thumbnails and return the candidates (dictionaries with keys
+    "matrix", "thumbnail" and the statistics from ``image_statistics``)
+    sorted from best to worst score
+    the coordinates for the thumbnails are computed only once per process"""
+    function = config["function"]
+    output = thumbnail_output(config["output"], size)
+    matrices = []
+    for n in range(nb_candidates):
+        for _ in range(100):
+            M = symmetrize_matrix(
+                random_matrix(
+                    function["random_nb_coeffs"],
+                    function["random_min_degre"],
+                    function["random_max_degre"],
+                    function["random_modulus"]
+                ),
+                function
+            )
+            if M:
+                break
+        matrices.append((n, M))
+
+    nb_jobs = max(1, min(nb_jobs or os.cpu_count() or 1, nb_candidates))
+    args = (config["colorwheel"], output, function)
+    results = []
+    if nb_jobs == 1:
+        _search_init(*args)
+        for job in matrices:
+            results.append(search_candidate(job))
+            if progress is not None:
+                progress(len(results), nb_candidates)
+    else:
+        nb_threads = max(1, (os.cpu_count() or 1) // nb_jobs)
+        with multiprocessing.Pool(nb_jobs, initializer=_search_init,
+                  initargs=args + (nb_threads,)) as pool:
+            for r in pool.imap_unordered(search_candidate, matrices,
+                                         chunksize=4):
+                results.append(r)
+                if progress is not None:
+                    progress(len(results), nb_candidates)
+    results.sort(key=lambda r: (-r["score"], r["n"]))
+    return results
+# >>>2
+
+
+def contact_sheet(      # <<<2
+        images,                 # list of PIL images or uint8 arrays
+        labels=None,            # list of labels for the images
+        columns=None,           # number of columns (default: square grid)
+        padding=4,
+        background="white",
+        label_color="black"):
+    """assemble images into a grid, with optional labels below them"""
+    images = [PIL.Image.fromarray(img) if isinstance(img, np.ndarray)
+              else img for img in images]
+    if not images:
+        return PIL.Image.new("RGB", (1, 1), color=background)
+    if columns is None:
+        columns = ceil(sqrt(len(images)))
+    rows = ceil(len(images) / columns)
+    width = max(img.size[0] for img in images)
+    height = max(img.size[1] for img in images)
+    label_height = 0
+    if labels is not None:
+        font = label_font()
+        label_height = max(draw_text_size(font, label)[1]
+                           for label in labels) + padding
+    sheet = PIL.Image.new(
+        "RGB",
+        (columns*(width+padding) + padding,
+         rows*(height+label_height+padding) + padding),
+        color=background
+    )
+    draw = ImageDraw.Draw(sheet)
+    for i, img in enumerate(images):
+        x = padding + (i % columns) * (width+padding)
+        y = padding + (i // columns) * (height+label_height+padding)
+        sheet.paste(img, (x + (width-img.size[0])//2,
+                          y + (height-img.size[1])//2))
+        if labels is not None:
+            w, _ = draw_text_size(font, labels[i])
+            draw.text((x + (width-w)//2, y+height+padding//2), labels[i],
+                      fill=label_color, font=font)
+    return sheet
+# >>>2
+
+
+@lru_cache(maxsize=4)
+def label_font(size=12):     # <<<2
+    """font for labels: the symbols used in the names of groups (×, ∞, ₁...)
+    are not in Pillow's default font, so we try to use DejaVu Sans"""
+    for name in ["DejaVuSans.ttf",
+                 "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]:
+        try:
+            return PIL.ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    return PIL.ImageFont.load_default()
+# >>>2
+
+
+def draw_text_size(font, text):     # <<<2
+    """size of a text drawn with a font"""
+    x0, y0, x1, y1 = font.getbbox(text)
+    return x1 - x0, y1
+# >>>2
+
+
+def save_search(results, config, top=SEARCH_TOP, message_queue=None):   # <<<2
+    """save a contact sheet of the best candidates of a random search, and a
+    configuration file for each of them
+    files are saved in the save directory of the output configuration"""
+    results = results[:top]
+    directory = config["output"]["save_directory"]
+    nb = 1
+    while True:
+        basename = os.path.join(directory, "search-{}".format(nb))
+        if not os.path.exists(basename + ".jpg"):
+            break
+        nb += 1
+    labels = ["{}: {:.2f}".format(i+1, r["score"])
+              for i, r in enumerate(results)]
+    contact_sheet([r["thumbnail"] for r in results], labels) \
+        .save(basename + ".jpg")
+    for i, r in enumerate(results):
+        cfg = copy.deepcopy(config)
+        cfg["function"]["matrix"] = r["matrix"]
+        save_config("{}-{}.ct".format(basename, i+1), cfg)
+    if message_queue is not None:
+        message_queue.put("saved search results {}".format(basename + ".jpg"))
+    return basename + ".jpg"
+# >>>2
+# >>>1
+
+
+###
+# gallery
+# <<<1
+GALLERY_KINDS = ["wallpaper", "color-reversing", "sphere"]
+
+
+def gallery_configs(config, kinds=GALLERY_KINDS, size=GALLERY_SIZE):    # <<<2
+    """return the list of (label, config) for an image of each group
+    ``kinds`` is a list of "wallpaper" (W_NAMES), "color-reversing"
+    (C_NAMES for each wallpaper group) and "sphere" (S_NAMES)
+    the matrix from the configuration (or a random matrix, always the same
+    one) is symmetrized for each group"""
+    base = normalize_config(copy.deepcopy(config))
+    function = base["function"]
+    seed(GALLERY_SEED)
+    matrix = function["matrix"] or random_matrix(
+        function["random_nb_coeffs"],
+        function["random_min_degre"],
+        function["random_max_degre"],
+        function["random_modulus"],
+    )
+    wallpaper = [w.split()[0] for w in W_NAMES()]
+
+    groups = []
+    if "wallpaper" in kinds:
+        groups += [("wallpaper", p, "") for p in wallpaper]
+    if "color-reversing" in kinds:
+        groups += [("wallpaper", p, c.split()[0])
+                   for p in wallpaper for c in C_NAMES(p)]
+    if "sphere" in kinds:
+        groups += [("sphere", p.split()[0], "") for p in S_NAMES()]
+
+    configs = []
+    for pattern_type, pattern, color_pattern in groups:
+        cfg = copy.deepcopy(base)
+        cfg["output"] = thumbnail_output(cfg["output"], size)
+        function = cfg["function"]
+        function["pattern_type"] = pattern_type
+        if pattern_type == "wallpaper":
+            function["wallpaper_pattern"] = pattern
+            function["wallpaper_color_pattern"] = color_pattern
+            function["lattice_parameters"] = []
+            cfg["output"]["display_mode"] = "plain"
+            label = color_pattern + "/" + pattern if color_pattern else pattern
+        else:
+            function["sphere_pattern"] = pattern
+            function["sphere_mode"] = "sphere"
+            cfg["output"]["display_mode"] = "sphere"
+            label = pattern.replace("N", str(function["sphere_N"]))
+        M = symmetrize_matrix(matrix, function)
+        # some groups remove all the coefficients of the matrix: we try other
+        # random matrices (always the same ones)
+        for _ in range(100):
+            if M:
+                break
+            M = symmetrize_matrix(random_matrix(
+                function["random_nb_coeffs"],
+                function["random_min_degre"],
+                function["random_max_degre"],
+                function["random_modulus"],
+            ), function)
+        function["matrix"] = M
+        configs.append((label, cfg))
+    seed()
+    return configs
+# >>>2
+
 
-    return img
+def gallery_job(job):       # <<<2
+    """compute an image for ``make_gallery``"""
+    label, config = job
+    try:
+        img = make_image(
+            color=config["colorwheel"],
+            output=config["output"],
+            function=config["function"],
+            as_array=True,
+            cache=RENDER_CACHE
+        )
+        return label, img, None
+    except Exception as e:
+        return label, None, "{}: {}".format(type(e).__name__, e)
 # >>>2
 
 
-def fade_image(image, coeff=100):       # <<<2
-    """return a faded version of the image"""
-    # TODO allow fading to black and use in make_sphere_background
-    mask = PIL.Image.new("L", image.size, coeff)
-    white = PIL.Image.new("RGB", image.size, (255, 255, 255))
-    white.paste(image, mask=mask)
-    return white
+def make_gallery(       # <<<2
+        filename,               # file for the contact sheet
+        config,                 # configuration (colorwheel, matrix...)
+        kinds=GALLERY_KINDS,    # kinds of groups
+        size=GALLERY_SIZE,      # size of the images (largest side)
+        nb_jobs=None,           # number of worker processes
+        columns=None):          # number of columns in the contact sheet
+    """compute an image for each group in parallel, save a labeled contact
+    sheet to ``filename`` and a configuration file for each image (named after
+    ``filename`` and the group)
+    the return value is the number of failures"""
+    configs = gallery_configs(config, kinds, size)
+    nb_jobs = max(1, min(nb_jobs or os.cpu_count() or 1, len(configs)))
+    images = {}
+    failures = 0
+    with multiprocessing.Pool(nb_jobs,
+              initializer=_batch_init,
+              initargs=(None,
+                        max(1, (os.cpu_count() or 1) // nb_jobs),
+                        RENDER_CACHE)) as pool:
+        for label, img, err in pool.imap_unordered(gallery_job, configs):
+            if err is not None:
+                error("{}: {}".format(label, err))
+                failures += 1
+            else:
+                images[label] = img
+
+    base, _ = os.path.splitext(filename)
+    labels = []
+    for i, (label, cfg) in enumerate(configs):
+        if label not in images:
+            continue
+        labels.append(label)
+        save_config("{}-{:02}-{}.ct".format(base, i+1, label.replace("/", "_")),
+                    cfg)
+    contact_sheet([images[label] for label in labels], labels,
+                  columns=columns).save(filename)
+    message("saved {} ({} images, {} failure(s))"
+            .format(filename, len(labels), failures))
+    return failures
+# >>>2
+# >>>1
+
+
+###
+# benchmarks
+# <<<1
+
+# kinds of patterns, with the configuration common to all their groups
+# (function, output) and the group used for all the sizes / block sizes
+BENCHMARK_FAMILIES = {      # <<<2
+    "wallpaper": (
+        {"pattern_type": "wallpaper"},
+        {"display_mode": "plain"},
+        "*632"),
+    "color-reversing": (
+        {"pattern_type": "wallpaper"},
+        {"display_mode": "plain"},
+        ("*442", "4*2")),
+    "sphere": (
+        {"pattern_type": "sphere", "sphere_mode": "sphere"},
+        {"display_mode": "sphere", "geometry": (-1.5, 1.5, -1.5, 1.5)},
+        "*532"),
+    "rosette": (
+        {"pattern_type": "sphere", "sphere_mode": "rosette", "sphere_N": 6},
+        {"display_mode": "plain"},
+        "*∞∞"),
+    "frieze": (
+        {"pattern_type": "sphere", "sphere_mode": "frieze", "sphere_N": 3},
+        {"display_mode": "plain", "geometry": (-2*pi, 2*pi, -pi, pi)},
+        "∞∞"),
+    "hyperbolic": (
+        {"pattern_type": "hyperbolic", "hyper_nb_steps": 10},
+        {"display_mode": "inversion", "sphere_stars": 0},
+        "hyperbolic"),
+}
+BENCHMARK_MATRIX_SIZES = [2, 6]     # number of random entries, before symmetries
+BENCHMARK_SIZES = [(256, 256), (1024, 768)]
+BENCHMARK_BLOCK_SIZES = ["auto", 0]
+# size of the images for the other groups
+BENCHMARK_GROUP_SIZE = (128, 128)
+# >>>2
+
+
+def benchmark_patterns():       # <<<2
+    """list of (family, group, function, output) with a configuration for
+    each group of PATTERN, and one for hyperbolic patterns"""
+    groups = []
+    for p in PATTERN:
+        if isinstance(p, tuple):
+            groups.append(("color-reversing", p))
+        elif p not in NAMES:
+            # **₁ and **₂ are only used as color patterns
+            continue
+        elif PATTERN[p]["type"] == "plane group":
+            groups.append(("wallpaper", p))
+        elif PATTERN[p]["type"] == "sphere group":
+            groups.append(("sphere", p))
+        else:
+            # the frieze groups are used for rosettes and friezes
+            groups += [("rosette", p), ("frieze", p)]
+    groups.append(("hyperbolic", "hyperbolic"))
+
+    patterns = []
+    for family, p in groups:
+        function, output, _ = BENCHMARK_FAMILIES[family]
+        function = copy.deepcopy(function)
+        if family == "color-reversing":
+            color_pattern, pattern = p
+            function["wallpaper_pattern"] = pattern
+            function["wallpaper_color_pattern"] = color_pattern
+            p = color_pattern + "/" + pattern
+        elif family == "wallpaper":
+            function["wallpaper_pattern"] = p
+        elif family != "hyperbolic":
+            function["sphere_pattern"] = p
+        patterns.append((family, p, function, copy.deepcopy(output)))
+    return patterns
+# >>>2
+
+
+def benchmark_colorwheel(filename, size=256):       # <<<2
+    """create a synthetic colorwheel (hue from the angle, brightness from the
+    modulus) so that benchmarks don't depend on external files"""
+    t = np.linspace(-1, 1, size)
+    zs = t[None, :] + 1j*t[:, None]
+    hue = ((np.angle(zs) / (2*pi)) % 1 * 255).astype(np.uint8)
+    value = (255 * np.clip(1.2 - np.abs(zs)/2, 0, 1)).astype(np.uint8)
+    saturation = np.full(hue.shape, 255, dtype=np.uint8)
+    img = PIL.Image.fromarray(np.dstack([hue, saturation, value]), "HSV")
+    img.convert("RGB").save(filename)
+    return filename
+# >>>2
+
+
+def benchmark_configs(colorwheel, patterns=None):       # <<<2
+    """generate the list of (name, config) used for benchmarks: every group
+    is computed with a small image, and one group of each kind of pattern is
+    also computed with all the sizes / block sizes
+    ``patterns`` is a list of names from BENCHMARK_FAMILIES (None for all)"""
+    runs = []
+    for family, group, function, output in benchmark_patterns():
+        if patterns is not None and family not in patterns:
+            continue
+        reference = BENCHMARK_FAMILIES[family][2]
+        if isinstance(reference, tuple):
+            reference = "/".join(reference)
+        if group == reference:
+            runs += [(family, function, output, size, block_size)
+                     for size in BENCHMARK_SIZES
+                     for block_size in BENCHMARK_BLOCK_SIZES]
+        runs.append(("{}/{}".format(family, group), function, output,
+                     BENCHMARK_GROUP_SIZE, "auto"))
+
+    configs = []
+    for name, function, output, size, block_size in runs:
+        for nb_coeffs in BENCHMARK_MATRIX_SIZES:
+            config = default_config()
+            config["colorwheel"]["filename"] = colorwheel
+            config["function"].update(copy.deepcopy(function))
+            config["output"].update(copy.deepcopy(output))
+            config["output"]["size"] = size
+            config["output"]["block_size"] = block_size
+            seed(BENCHMARK_SEED + nb_coeffs)
+            M = random_matrix(nb_coeffs)
+            if config["function"]["pattern_type"] == "sphere" and \
+                    config["function"]["sphere_mode"] != "sphere":
+                # rosettes and friezes only use entries where n-m
+                # is a multiple of N
+                N = config["function"]["sphere_N"]
+                M = dict(((n, n - N*m), z) for (n, m), z in M.items())
+            config["function"]["matrix"] = M
+            if block_size == "auto" and size == BENCHMARK_GROUP_SIZE:
+                label = "{}-m{}".format(name, nb_coeffs)
+            else:
+                label = "{}-m{}-{}x{}-b{}".format(name, nb_coeffs,
+                                                  size[0], size[1], block_size)
+            configs.append((label, config))
+    seed()
+    return configs
+# >>>2
+
+
+def benchmark_config(config, repeat=BENCHMARK_REPEAT):     # <<<2
+    """time the computation of an image for a configuration and return a
+    dictionary with the results
+    the timings of the different stages (see ``Profiler``) are those of the
+    fastest run"""
+    global PROFILER
+    width, height = config["output"]["size"]
+    times = []
+    stages = {}
+    previous_profiler = PROFILER
+    # the first run is only used to measure memory, as tracing allocations
+    # slows down the computation
+    for i in range(repeat+1):
+        if i == 0:
+            tracemalloc.start()
+        else:
+            PROFILER = Profiler()
+        start = time.perf_counter()
+        image = make_image(
+            color=copy.deepcopy(config["colorwheel"]),
+            output=copy.deepcopy(config["output"]),
+            function=copy.deepcopy(config["function"]),
+        )
+        with profile("encode", width*height):
+            image.save(io.BytesIO(), format="JPEG")
+        end = time.perf_counter()
+        if i == 0:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            continue
+
+        if not times or end - start < min(times):
+            stages = PROFILER.report()
+            del stages["total_time"]
+        times.append(end - start)
+    PROFILER = previous_profiler
+
+    best = min(times)
+    return {
+        "time": best,
+        "times": times,
+        "stages": stages,
+        "pixels": width * height,
+        "pixels_per_second": width * height / best,
+        "peak_memory": peak,
+    }
+# >>>2
+
+
+def compare_benchmarks(results, baseline, threshold=BENCHMARK_THRESHOLD):     # <<<2
+    """compare benchmark results with a baseline, and return the list of
+    (name, baseline time, time, ratio) for regressions (time greater than
+    baseline time by more than ``threshold``)"""
+    old = dict((r["name"], r) for r in baseline["results"])
+    regressions = []
+    for r in results["results"]:
+        if r["name"] not in old:
+            continue
+        ratio = r["time"] / old[r["name"]]["time"]
+        r["baseline_time"] = old[r["name"]]["time"]
+        r["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append((r["name"], r["baseline_time"], r["time"], ratio))
+    return regressions
+# >>>2
+
+
+def run_benchmarks(         # <<<2
+        filename,               # file for JSON results
+        baseline=None,          # file with previous results, for comparison
+        threshold=BENCHMARK_THRESHOLD,
+        patterns=None,          # names from BENCHMARK_FAMILIES (None: all)
+        repeat=BENCHMARK_REPEAT):
+    """run all the benchmarks, print a summary and write the results to a
+    JSON file
+    the return value is the number of regressions compared to the baseline"""
+    results = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numexpr": ne.__version__,
+        "pillow": PIL.__version__,
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        colorwheel = benchmark_colorwheel(os.path.join(tmp_dir, "colorwheel.png"))
+        for name, config in benchmark_configs(colorwheel, patterns):
+            r = benchmark_config(config, repeat=repeat)
+            r["name"] = name
+            results["results"].append(r)
+            message("{:40} {:8.3f}s {:8.2f} Mpix/s {:8.1f} MB"
+                    .format(name, r["time"], r["pixels_per_second"]/1e6,
+                            r["peak_memory"]/2**20))
+
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare_benchmarks(results, json.load(f), threshold)
+        for name, t0, t1, ratio in regressions:
+            error("regression for {}: {:.3f}s -> {:.3f}s ({:+.0f}%)"
+                  .format(name, t0, t1, 100*(ratio-1)))
+        if not regressions:
+            message("no regression (threshold: {:.0f}%)".format(100*threshold))
+
+    with open(filename, mode="w") as f:
+        json.dump(results, f, indent=2)
+    return len(regressions)
 # >>>2
 # >>>1
 
@@ -2528,7 +5984,7 @@ class ColorWheel(LabelFrame):   # <<<2
             label="default color",
             value=DEFAULT_COLOR,
             width=10,
-            convert=getrgb
+            convert=ImageColor.getrgb
         )
         self._default_color.pack(padx=5, pady=5)
         self._default_color.bind("<Return>", self.update_default_color)
@@ -3208,6 +6664,9 @@ class Output(LabelFrame):     # <<<2
         LabelFrame.__init__(self, root)
         self.configure(text="Output")
 
+        # no widget: only set from config files / the command line
+        self.sphere_texture = SPHERE_TEXTURE
+
         # the preview image     <<<4
         canvas_frame = Frame(
             self,
@@ -3301,11 +6760,11 @@ class Output(LabelFrame):     # <<<2
         self._draw_mirrors.set(False)
         self._fade.trace("w", self.update)
         self._fade.set(False)
-        self._fade_coeff.set(100)
+        self._fade_coeff.set(FADE_COEFF)
         # >>>4
 
         # geometry of result    <<<4
-        self._geometry_tabs = Notebook(self)
+        self._geometry_tabs = ttk.Notebook(self)
         self._geometry_tabs.grid(row=0, column=1, sticky=tk.E+tk.W, padx=5, pady=5)
         # prevent arrows from changing tab
         self._geometry_tabs.bind_all(
@@ -3710,7 +7169,24 @@ class Output(LabelFrame):     # <<<2
         return zoom_tmp
     # >>>3
 
-    def translate(self, dx, dy):    # <<<3
+    def preview_dimensions(self):     # <<<3
+        """size of the preview image, with the ratio of the output"""
+        ratio = self.width / self.height
+        if (self.width < self.preview_size and
+                self.height < self.preview_size):
+            return self.width, self.height
+        elif ratio > 1:
+            return self.preview_size, round(self.preview_size / ratio)
+        else:
+            return round(self.preview_size * ratio), self.preview_size
+    # >>>3
+
+    def translate(self, dx, dy, step=1):    # <<<3
+        # translate by a multiple of ``step`` preview pixels, so that the
+        # preview can reuse the previous one (see ``pan_image``)
+        width, height = self.preview_dimensions()
+        dx = round(dx * (width-1) / step) * step / max(width-1, 1)
+        dy = round(dy * (height-1) / step) * step / max(height-1, 1)
         x_min, x_max, y_min, y_max = self.geometry
         delta_x = x_max - x_min
         delta_y = y_max - y_min
@@ -3902,7 +7378,8 @@ class Output(LabelFrame):     # <<<2
                   "preview_size",
                   "draw_tile", "draw_orbifold", "draw_color_tile",
                   "draw_mirrors", "fade", "fade_coeff",
-                  "display_mode", "sphere_rotations", "inversion_center",
+                  "display_mode", "sphere_rotations", "sphere_texture",
+                  "inversion_center",
                   "sphere_background", "sphere_background_fading",
                   "sphere_stars",
                   "morph", "morph_start", "morph_end", "morph_stable_coeff"]:
@@ -3918,7 +7395,8 @@ class Output(LabelFrame):     # <<<2
                   "preview_size",
                   "draw_tile", "draw_orbifold", "draw_color_tile",
                   "draw_mirrors", "fade", "fade_coeff",
-                  "display_mode", "sphere_rotations", "inversion_center",
+                  "display_mode", "sphere_rotations", "sphere_texture",
+                  "inversion_center",
                   "sphere_background", "sphere_background_fading",
                   "sphere_stars",
                   "morph", "morph_start", "morph_end", "morph_stable_coeff"]:
@@ -4094,9 +7572,9 @@ class Function(LabelFrame):     # <<<2
     @sphere_pattern.setter
     def sphere_pattern(self, p):    # <<<4
         if self.sphere_mode in ["frieze", "rosette"]:
-            patterns = F_NAMES
+            patterns = F_NAMES()
         else:
-            patterns = S_NAMES
+            patterns = S_NAMES()
         for i in range(len(patterns)):
             tmp = patterns[i]
             tmp = tmp.replace("(", " ").replace(")", " ")
@@ -4148,6 +7626,16 @@ class Function(LabelFrame):     # <<<2
         s = complex_to_str(z)
         self._hyper_s.set(s)
     # >>>4
+
+    @property
+    def hyper_engine(self):       # <<<4
+        return "reduce" if self._hyper_reduce.get() else "direct"
+    # >>>4
+
+    @hyper_engine.setter          # <<<4
+    def hyper_engine(self, engine):
+        self._hyper_reduce.set(engine == "reduce")
+    # >>>4
     # >>>3
 
     def __init__(self, root):      # <<<3
@@ -4155,8 +7643,14 @@ class Function(LabelFrame):     # <<<2
         LabelFrame.__init__(self, root)
         self.configure(text="Pattern")
 
+        # no widget: only set from config files / the command line
+        self.wallpaper_engine = WALLPAPER_ENGINE
+        self.fft_tolerance = FFT_TOLERANCE
+        self.rotation_sectors = ROTATION_SECTORS
+        self.frieze_engine = FRIEZE_ENGINE
+
         # tabs for the different kinds of functions / symmetries  <<<4
-        self._tabs = Notebook(self)
+        self._tabs = ttk.Notebook(self)
         self._tabs.grid(row=0, column=0, rowspan=2, sticky=tk.N+tk.S, padx=5, pady=5)
         # prevent arrows from changing tab
         self._tabs.bind_all(
@@ -4181,11 +7675,11 @@ class Function(LabelFrame):     # <<<2
             text="symmetry group"
         ).pack(padx=5, pady=(20, 0))
         self._wallpaper_pattern = StringVar()
-        self._wallpaper_combo = Combobox(
+        self._wallpaper_combo = ttk.Combobox(
             self._wallpaper_tab, width=24, exportselection=0,
             textvariable=self._wallpaper_pattern,
             state="readonly",
-            values=W_NAMES
+            values=W_NAMES()
         )
         self._wallpaper_combo.pack(padx=5, pady=5)
         self._wallpaper_combo.current(0)
@@ -4204,7 +7698,7 @@ class Function(LabelFrame):     # <<<2
             text="color symmetry group"
         ).pack(padx=5, pady=(5, 0))
         self._wallpaper_color_pattern = StringVar()
-        self._wallpaper_color_combo = Combobox(
+        self._wallpaper_color_combo = ttk.Combobox(
             self._wallpaper_tab, width=20, exportselection=0,
             textvariable=self._wallpaper_color_pattern,
             state="readonly",
@@ -4255,13 +7749,13 @@ class Function(LabelFrame):     # <<<2
             text="symmetry group"
         ).pack(padx=5, pady=(20, 0))
         self._sphere_pattern = StringVar()
-        self._sphere_combo = Combobox(
+        self._sphere_combo = ttk.Combobox(
             self._sphere_tab,
             width=20,
             exportselection=0,
             textvariable=self._sphere_pattern,
             state="readonly",
-            values=S_NAMES
+            values=S_NAMES()
         )
         self._sphere_combo.pack(padx=5, pady=5)
         self._sphere_combo.current(0)
@@ -4330,6 +7824,16 @@ class Function(LabelFrame):     # <<<2
             width=6,
         )
         self._hyper_s.pack(padx=5, pady=5)
+
+        self._hyper_reduce = BooleanVar()
+        self._hyper_reduce.set(HYPER_ENGINE == "reduce")
+        hyper_reduce_button = Checkbutton(
+            self._hyper_tab,
+            variable=self._hyper_reduce,
+            text="reduce"
+        )
+        hyper_reduce_button.pack(padx=5, pady=5)
+        createToolTip(hyper_reduce_button, "move the points into the fundamental domain\n(faster convergence near the border)")
         # >>>4
 
         # display matrix    <<<4
@@ -4571,7 +8075,9 @@ class Function(LabelFrame):     # <<<2
                   "wallpaper_pattern", "lattice_parameters",
                   "wallpaper_color_pattern", "wallpaper_N",
                   "sphere_pattern", "sphere_N", "sphere_mode",
-                  "hyper_nb_steps", "hyper_s"]:
+                  "hyper_nb_steps", "hyper_s", "hyper_engine",
+                  "wallpaper_engine", "fft_tolerance", "rotation_sectors",
+                  "frieze_engine"]:
             cfg[k] = getattr(self, k)
         return cfg
     # >>>3
@@ -4584,7 +8090,9 @@ class Function(LabelFrame):     # <<<2
                   "wallpaper_pattern", "wallpaper_N",  # "lattice_parameters",
                   # "wallpaper_color_pattern",
                   "sphere_pattern", "sphere_N", "sphere_mode",
-                  "hyper_nb_steps", "hyper_s"]:
+                  "hyper_nb_steps", "hyper_s", "hyper_engine",
+                  "wallpaper_engine", "fft_tolerance", "rotation_sectors",
+                  "frieze_engine"]:
             if k in cfg:
                 setattr(self, k, cfg[k])
         self.update()
@@ -4608,14 +8116,14 @@ class Function(LabelFrame):     # <<<2
         # sphere tab  <<<4
         pattern = self.sphere_pattern
         if self.sphere_mode in ["frieze", "rosette"]:
-            self._sphere_combo["values"] = F_NAMES
+            self._sphere_combo["values"] = F_NAMES()
             pattern = pattern.replace("N", "∞")
             self.sphere_pattern = pattern
             self._sphere_N.label_widget.configure(text="period")
             self._sphere_N.enable()
         elif self.sphere_mode == "sphere":
             pattern = pattern.replace("∞", "N")
-            self._sphere_combo["values"] = S_NAMES
+            self._sphere_combo["values"] = S_NAMES()
             self.sphere_pattern = pattern
             self._sphere_N.label_widget.configure(text="N")
             if "N" in self.sphere_pattern:
@@ -4633,7 +8141,7 @@ class Function(LabelFrame):     # <<<2
 
         # color reversing combo
         self._wallpaper_color_combo.configure(
-            values=["--"] + C_NAMES(self.wallpaper_pattern)
+            values=("--",) + C_NAMES(self.wallpaper_pattern)
         )
         self.wallpaper_color_pattern = color_pattern
 
@@ -4745,9 +8253,9 @@ class CreateSymmetry(Tk):      # <<<2
         # self.geometry("1200x600")
         self.title("Create Symmetry")
 
-        s = Style()
+        s = ttk.Style()
         s.configure("*TCombobox*Listbox*Font", "TkFixedFont")
-        fixed_font = tkinter.font.nametofont("TkFixedFont")
+        fixed_font = tk.font.nametofont("TkFixedFont")
         fixed_font.configure(size=8)
 
         # components    <<<4
@@ -4830,6 +8338,7 @@ class CreateSymmetry(Tk):      # <<<2
 
         self.bind("<Control-g>", sequence(self.function.new_random_matrix))
         self.bind("<Control-G>", sequence(self.new_random_preview))
+        self.bind("<Control-e>", sequence(self.random_search))
 
         self.bind(
             "<Control-Key-minus>",
@@ -5045,17 +8554,38 @@ class CreateSymmetry(Tk):      # <<<2
         self.undo_list = []
         self.undo_index = -1
 
+        # identifiers of the last preview / output jobs, for progress reports
+        self._preview_job = 0
+        self._output_job = 0
+
+        # configuration of the running preview job and output of the
+        # displayed preview, (color, output, function, array) for the last
+        # preview, and for the last previews of each size (see ``pan_image``)
+        self._preview_job_config = None
+        self._preview_display = None
+        self._previous_preview = None
+        self._previous_previews = {}
+
+        # previews requested while a key is held down are delayed until the
+        # running one is displayed, and computed with a lower resolution
+        self._preview_scheduler = PreviewScheduler()
+        self._preview_requested = False
+
         # queue containing parameters for pending output jobs
-        self.output_params_queue = Queue()
+        self.output_params_queue = multiprocessing.Queue()
         # are there pending output jobs?
-        self.output_message_queue = Queue()
+        self.output_message_queue = multiprocessing.Queue()
 
         # queue containing the preview image, computed by make_preview_job
         # the function ``update_GUI`` empties the queue
-        self.preview_image_queue = Queue()
-        self.preview_message_queue = Queue()
-
-        self.message_queue = Queue()
+        self.preview_image_queue = multiprocessing.Queue()
+        self.preview_message_queue = multiprocessing.Queue()
+        # queue containing the (key, texture) of sphere textures computed by
+        # the preview jobs, which are kept in the GUI process so that the
+        # next jobs (forked from it) don't compute them again
+        self.preview_texture_queue = multiprocessing.Queue()
+
+        self.message_queue = multiprocessing.Queue()
         self.message_queue.put("""  create_symmetry.py
  Control-h for shortcuts
 -------------------------
@@ -5111,6 +8641,7 @@ Keyboard shortcuts:
 
   Control-g     generate random matrix
   Control-G     generate random matrix and display preview
+  Control-e     random search: display the best of many random matrices
 
   Control--     zoom out the result file and display preview
   Control-+     zoom in the result file and display preview
@@ -5242,15 +8773,17 @@ contact: Pierre.Hyvernat@univ-smb.fr
         self.output._canvas.delete("preview")
         try:
             if self.output.fade:
-                fade = fade_image(
-                    self.output._canvas._image,
-                    255-self.output.fade_coeff
-                )
-                self.output._canvas.tk_img = PIL.ImageTk.PhotoImage(fade)
+                image = self.faded_preview()
             else:
-                self.output._canvas.tk_img = PIL.ImageTk.PhotoImage(
-                    self.output._canvas._image
-                )
+                image = self.output._canvas._image
+
+            # reuse the Tk image when possible
+            tk_img = getattr(self.output._canvas, "tk_img", None)
+            if (tk_img is not None and
+                    (tk_img.width(), tk_img.height()) == image.size):
+                tk_img.paste(image)
+            else:
+                self.output._canvas.tk_img = PIL.ImageTk.PhotoImage(image)
 
             self.output._canvas._image_id = self.output._canvas.create_image(
                 (PREVIEW_SIZE//2, PREVIEW_SIZE//2),
@@ -5263,40 +8796,53 @@ contact: Pierre.Hyvernat@univ-smb.fr
         if self.output.display_mode != "plain" or self.output.morph:
             return
 
-        def put_tile(name):
-            try:
-                if isinstance(getattr(self.output._canvas, name), tuple):
-                    img = make_tile(*getattr(self.output._canvas, name))
-                    tk_img = PIL.ImageTk.PhotoImage(img)
-                    setattr(self.output._canvas, name, img)
-                    setattr(self.output._canvas, "tk" + name, tk_img)
-                img_id = self.output._canvas.create_image(
-                    (PREVIEW_SIZE//2, PREVIEW_SIZE//2),
-                    image=getattr(self.output._canvas, "tk" + name),
-                    tags="preview"
-                )
-                setattr(self.output._canvas, name + "_id", img_id)
-            except AttributeError:
-                pass
-
-        if self.output.draw_tile:
-            if self.output.draw_color_tile:
-                put_tile("_color_tile_img")
-            else:
-                put_tile("_tile_img")
-
-        if self.output.draw_orbifold:
-            if self.output.draw_color_tile:
-                put_tile("_color_orbifold_img")
-            else:
-                put_tile("_orbifold_img")
+        overlay = self.preview_overlay()
+        if overlay is None:
+            return
+        if getattr(self.output._canvas, "_overlay_img", None) is not overlay:
+            self.output._canvas._overlay_img = overlay
+            self.output._canvas._tk_overlay_img = PIL.ImageTk.PhotoImage(
+                overlay
+            )
+        self.output._canvas.create_image(
+            (PREVIEW_SIZE//2, PREVIEW_SIZE//2),
+            image=self.output._canvas._tk_overlay_img,
+            tags="preview"
+        )
+    # >>>3
 
-        if self.output.draw_orbifold and self.output.draw_mirrors:
-            if self.output.draw_color_tile:
-                put_tile("_color_mirrors_img")
-            else:
-                put_tile("_mirrors_img")
+    def faded_preview(self):     # <<<3
+        """return the faded version of the preview image
+        the buffers are reused as long as the size of the preview doesn't
+        change"""
+        array = self.output._canvas._array
+        height, width = array.shape[:2]
+        buffer = getattr(self, "_fade_buffer", None)
+        if buffer is None or buffer.shape != array.shape:
+            self._fade_buffer = np.empty_like(array)
+            self._faded_image = PIL.Image.new("RGB", (width, height))
+        fade_array(array, 255-self.output.fade_coeff, out=self._fade_buffer)
+        self._faded_image.frombytes(self._fade_buffer.data)
+        return self._faded_image
+    # >>>3
 
+    def preview_overlay(self):     # <<<3
+        """return the image with tile / orbifold / mirrors for the current
+        preview (or None)"""
+        try:
+            tile_args = self.output._canvas._tile_args
+        except AttributeError:
+            return None
+        draw_orbifold = self.output.draw_orbifold
+        if tile_args is None or not (self.output.draw_tile or draw_orbifold):
+            return None
+        return make_tile(
+            draw_tile=self.output.draw_tile,
+            draw_orbifold=draw_orbifold,
+            color_tile=self.output.draw_color_tile,
+            draw_mirrors=draw_orbifold and self.output.draw_mirrors,
+            **tile_args
+        )
     # >>>3
 
     def update_GUI(self):        # <<<3
@@ -5311,22 +8857,29 @@ contact: Pierre.Hyvernat@univ-smb.fr
         self._console.yview(tk.END)
         self._console.config(state=tk.DISABLED)
 
+        # only the last progress report is displayed
         m = None
         while True:
             try:
-                m = self.preview_message_queue.get(block=False)
+                event = self.preview_message_queue.get(block=False)
+                if event["job"] == self._preview_job:
+                    m = event
             except queue.Empty:
                 if m is not None:
                     self._preview_console.config(state=tk.NORMAL)
                     self._preview_console.delete(0.0, tk.END)
                     self._preview_console.insert(
                         0.0,
-                        "Preview: {}%".format(int(m*100))
+                        progress_message(m, "Preview")
                     )
                     self._preview_console.config(state=tk.DISABLED)
                 elif not self.pending_preview:
                     self._preview_console.config(state=tk.NORMAL)
                     self._preview_console.delete(0.0, tk.END)
+                    self._preview_console.insert(
+                        0.0,
+                        self._preview_scheduler.summary()
+                    )
                     self._preview_console.config(state=tk.DISABLED)
                 break
 
@@ -5340,9 +8893,11 @@ contact: Pierre.Hyvernat@univ-smb.fr
                     self._output_console.delete(0.0, tk.END)
                     self._output_console.insert(
                         0.0,
-                        "output ({}): {}%"
-                        .format(1+self.output_params_queue.qsize(),
-                                round(m*100, 3))
+                        progress_message(
+                            m,
+                            "output ({})"
+                            .format(1+self.output_params_queue.qsize())
+                        )
                     )
                     self._output_console.config(state=tk.DISABLED)
                 elif not self.pending_outputs:
@@ -5351,6 +8906,14 @@ contact: Pierre.Hyvernat@univ-smb.fr
                     self._output_console.config(state=tk.DISABLED)
                 break
 
+        # sphere textures
+        while True:
+            try:
+                key, texture = self.preview_texture_queue.get(block=False)
+            except queue.Empty:
+                break
+            keep_sphere_texture(key, texture)
+
         # preview image
         image = None
         while True:
@@ -5358,107 +8921,78 @@ contact: Pierre.Hyvernat@univ-smb.fr
                 image = self.preview_image_queue.get(block=False)
             except queue.Empty:
                 if image is not None:
-                    # FIXME: methode change_preview in Output class
-
-                    self.output._canvas._image = image
-                    self.output._canvas.tk_img = PIL.ImageTk.PhotoImage(image)
-
-                    self.output._canvas._image_id = self.output._canvas.create_image(
-                        (PREVIEW_SIZE//2, PREVIEW_SIZE//2),
-                        image=self.output._canvas.tk_img
-                    )
-
-                    if self.function.pattern_type == "wallpaper":
-                        pattern = self.function.full_wallpaper_pattern
-
-                        # name all argument of make tile and use dictionary
-                        self.output._canvas._tile_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            True,
-                            False,
-                            False,
-                            False
-                        )
-
-                        self.output._canvas._orbifold_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            False,
-                            True,
-                            False,
-                            False
-                        )
-
-                        self.output._canvas._mirrors_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            False,
-                            True,
-                            False,
-                            True
-                        )
-
-                        self.output._canvas._color_tile_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            True,
-                            False,
-                            True,
-                            False
-                        )
+                    self._preview_scheduler.done()
+                    cfg = self._preview_job_config
+                    previous = (cfg["colorwheel"], cfg["output"],
+                                cfg["function"], np.asarray(image))
+                    self._previous_preview = previous
+                    # keep the last full resolution preview during a burst
+                    size = tuple(cfg["output"]["size"])
+                    self._previous_previews.pop(size, None)
+                    self._previous_previews[size] = previous
+                    if len(self._previous_previews) > 2:
+                        del self._previous_previews[
+                            next(iter(self._previous_previews))]
+                    if image.size != tuple(self._preview_display["size"]):
+                        image = zoom_placeholder(previous, cfg["colorwheel"],
+                                                 self._preview_display,
+                                                 cfg["function"])
+                    self.show_preview(image)
+                break
 
-                        self.output._canvas._color_orbifold_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            False,
-                            True,
-                            True,
-                            False
-                        )
+        # start the delayed preview when the previous one is done, and
+        # compute a full resolution preview at the end of a burst
+        if not self.pending_preview and self.preview_image_queue.empty():
+            if self._preview_requested:
+                self.start_preview()
+            elif (self._preview_scheduler.scale < 1 and
+                    self._preview_scheduler.idle()):
+                self.start_preview()
 
-                        self.output._canvas._color_mirrors_img = (
-                            self.output.geometry,
-                            (self.output.modulus, self.output.angle),
-                            pattern,
-                            basis(pattern,
-                                  *self.function.lattice_parameters),
-                            image.size,
-                            False,
-                            True,
-                            True,
-                            True
-                        )
+        self.after(100, self.update_GUI)
+    # >>>3
 
-                    self.update_output_preview()
-                break
+    def show_preview(self, image):      # <<<3
+        """display an image in the preview canvas (low resolution previews
+        are scaled to the size of the preview)"""
+        # FIXME: methode change_preview in Output class
+
+        size = self.output.preview_dimensions()
+        if image.size != size:
+            image = image.resize(size, PIL.Image.Resampling.BILINEAR)
+
+        self.output._canvas._image = image
+        self.output._canvas._array = np.asarray(image)
+        self.output._canvas.tk_img = PIL.ImageTk.PhotoImage(image)
+
+        self.output._canvas._image_id = self.output._canvas.create_image(
+            (PREVIEW_SIZE//2, PREVIEW_SIZE//2),
+            image=self.output._canvas.tk_img
+        )
+
+        if self.function.pattern_type == "wallpaper":
+            pattern = self.function.full_wallpaper_pattern
+            # the overlay is computed (and cached) when needed
+            self.output._canvas._tile_args = dict(
+                geometry=self.output.geometry,
+                transformation=(self.output.modulus,
+                                self.output.angle),
+                pattern=pattern,
+                basis=basis(pattern,
+                            *self.function.lattice_parameters),
+                size=image.size
+            )
+        else:
+            self.output._canvas._tile_args = None
 
-        self.after(100, self.update_GUI)
+        self.update_output_preview()
     # >>>3
 
     def make_output(self, *args):      # <<<3
         self.output.adjust_geometry()
         cfg = self.config
+        self._output_job += 1
+        cfg["job"] = self._output_job
 
         self.output_params_queue.put(cfg)
 
@@ -5473,53 +9007,96 @@ contact: Pierre.Hyvernat@univ-smb.fr
                 background_output(**cfg)
 
         if not self.pending_outputs:
-            self.output_process = Process(target=output_process)
+            self.output_process = multiprocessing.Process(target=output_process)
             self.output_process.start()
     # >>>3
 
     def make_preview(self, *args):      # <<<3
+        """compute a new preview
+        during a burst of requests (key repeat), the running preview is
+        finished and displayed first, and only the last request is computed
+        afterwards (see ``PreviewScheduler``)"""
+        burst = self._preview_scheduler.request()
+        if burst and self.pending_preview:
+            self._preview_requested = True
+            return
+        self.start_preview()
+    # >>>3
 
+    def start_preview(self):        # <<<3
+        self._preview_requested = False
         self.output.adjust_geometry()
         if not self.function.matrix:
             return
-        ratio = self.output.width / self.output.height
-        if (self.output.width < self.output.preview_size and
-                self.output.height < self.output.preview_size):
-            width = self.output.width
-            height = self.output.height
-        elif ratio > 1:
-            width = self.output.preview_size
-            height = round(self.output.preview_size / ratio)
-        else:
-            width = round(self.output.preview_size * ratio)
-            height = self.output.preview_size
+        width, height = self.output.preview_dimensions()
+        scale = self._preview_scheduler.preview_scale(width*height)
+
+        self._preview_job += 1
+        job = self._preview_job
+
+        cfg = self.config
+        cfg["output"]["size"] = (width, height)
+        # low resolution previews are computed for every k-th pixel, and
+        # resampled for display
+        self._preview_display = copy.deepcopy(cfg["output"])
+        cfg["output"] = subsampled_output(cfg["output"], round(1/scale))
+        width, height = cfg["output"]["size"]
+        self._preview_scheduler.start(width*height, scale)
+
+        # the previous preview with the same size is reused for translations,
+        # and the last one gives an approximation of the new preview (zoom)
+        # while it is computed
+        previous = self._previous_previews.get((width, height))
+        self._preview_job_config = cfg
+        if self._previous_preview is not None:
+            placeholder = zoom_placeholder(self._previous_preview,
+                                           cfg["colorwheel"],
+                                           self._preview_display,
+                                           cfg["function"])
+            if placeholder is not None:
+                self.show_preview(placeholder)
+
+        texture_key = None
+        if (cfg["output"]["display_mode"] == "sphere" and
+                cfg["output"].get("sphere_texture", SPHERE_TEXTURE)):
+            texture_key = sphere_texture_key(cfg["function"],
+                                             cfg["output"]["sphere_texture"])
+            if (SPHERE_TEXTURES is not None and
+                    SPHERE_TEXTURES.get(texture_key) is not None):
+                texture_key = None
 
         def make_preview_job():
             # print("make_preview PID", os.getpid())
-            cfg = self.config
-            cfg["output"]["size"] = (width, height)
-
             image = make_image(
                 color=cfg["colorwheel"],
                 output=cfg["output"],
                 function=cfg["function"],
-                message_queue=self.preview_message_queue
+                message_queue=self.preview_message_queue,
+                job=job,
+                cache=RENDER_CACHE,
+                previous=previous
             )
+            # a new texture is sent to the GUI process
+            if texture_key is not None and SPHERE_TEXTURES is not None:
+                texture = SPHERE_TEXTURES.get(texture_key)
+                if texture is not None:
+                    self.preview_texture_queue.put((texture_key, texture))
             self.preview_image_queue.put(image)
 
         try:
             self.preview_process.terminate()
             self.preview_process.join()
             # redefine queues to avoid corruption
-            self.preview_message_queue = Queue()
-            self.preview_image_queue = Queue()
+            self.preview_message_queue = multiprocessing.Queue()
+            self.preview_image_queue = multiprocessing.Queue()
+            self.preview_texture_queue = multiprocessing.Queue()
         except AttributeError:
             pass
 
         try:
             self.preview_config = copy.deepcopy(self.config)
 
-            self.preview_process = Process(target=make_preview_job)
+            self.preview_process = multiprocessing.Process(target=make_preview_job)
             self.preview_process.start()
 
             if (len(self.undo_list) == 0 or
@@ -5534,34 +9111,14 @@ contact: Pierre.Hyvernat@univ-smb.fr
 
     def full_preview_image(self):       # <<<3
         """paste the preview, tile, orbifold and mirror images together"""
-        img = self.output._canvas._image
-        width, height = img.size
+        array = np.array(self.output._canvas._array)
         if self.output.fade:
-            img = fade_image(img)
-
-        def paste_tile(name):
-            try:
-                tile = getattr(self.output._canvas, name)
-                img.paste(tile, mask=tile)
-            except:
-                pass
+            fade_array(array, 255-self.output.fade_coeff, out=array)
 
-        if self.output.draw_tile:
-            if self.output.draw_color_tile:
-                paste_tile("_color_tile_img")
-            else:
-                paste_tile("_tile_img")
-        if self.output.draw_orbifold:
-            if self.output.draw_color_tile:
-                paste_tile("_color_orbifold_img")
-            else:
-                paste_tile("_orbifold_img")
-        if self.output.draw_mirrors:
-            if self.output.draw_color_tile:
-                paste_tile("_color_mirrors_img")
-            else:
-                paste_tile("_mirrors_img")
-        return img
+        overlay = self.preview_overlay()
+        if overlay is not None:
+            blend_overlay(array, overlay)
+        return PIL.Image.fromarray(array, "RGB")
     # >>>3
 
     def show_bigger_preview(self, *args, alpha=2):       # <<<3
@@ -5617,9 +9174,11 @@ contact: Pierre.Hyvernat@univ-smb.fr
                     self.output.inversion_center = complex(x, y)
             else:
                 if dx != 0 or dy != 0:
+                    width, height = self.output.preview_dimensions()
                     self.output.translate(
                         dx*TRANSLATION_DELTA,
-                        dy*TRANSLATION_DELTA
+                        dy*TRANSLATION_DELTA,
+                        self._preview_scheduler.pixel_step(width*height)
                     )
                 elif dz != 0:
                     self.output.angle -= dz * ROTATION_DELTA
@@ -5634,6 +9193,79 @@ contact: Pierre.Hyvernat@univ-smb.fr
         self.make_preview()
     # >>>3
 
+    def random_search(self, *args):       # <<<3
+        """compute thumbnails for many random matrices in the background and
+        display the best ones"""
+        try:
+            if self._search_process.is_alive():
+                return
+        except AttributeError:
+            pass
+        config = self.config
+        results_queue = multiprocessing.Queue()
+
+        def search_job():
+            results = random_search(config)
+            results_queue.put(results[:SEARCH_TOP])
+
+        def wait_results():
+            try:
+                results = results_queue.get(block=False)
+            except queue.Empty:
+                self.after(200, wait_results)
+                return
+            self._search_process.join()
+            self.show_search_results(config, results)
+
+        self.message_queue.put("random search: {} candidates"
+                               .format(SEARCH_CANDIDATES))
+        self._search_process = multiprocessing.Process(target=search_job)
+        self._search_process.start()
+        self.after(200, wait_results)
+    # >>>3
+
+    def show_search_results(self, config, results, columns=4, padding=4):   # <<<3
+        """display the thumbnails of a random search: clicking on a thumbnail
+        selects its matrix"""
+        dialog = Toplevel(self)
+        dialog.title("random search")
+        dialog.resizable(width=False, height=False)
+
+        sheet = contact_sheet(
+            [r["thumbnail"] for r in results],
+            ["{}: {:.2f}".format(i+1, r["score"])
+             for i, r in enumerate(results)],
+            columns=columns,
+            padding=padding
+        )
+        dialog.tk_img = PIL.ImageTk.PhotoImage(sheet)
+        canvas = Canvas(dialog, width=sheet.size[0], height=sheet.size[1])
+        canvas.pack()
+        canvas.create_image((0, 0), anchor=tk.NW, image=dialog.tk_img)
+
+        rows = ceil(len(results) / columns)
+        cell_width = (sheet.size[0] - padding) / columns
+        cell_height = (sheet.size[1] - padding) / rows
+
+        def select(event):
+            i = (int((event.y - padding) // cell_height) * columns +
+                 int((event.x - padding) // cell_width))
+            if 0 <= i < len(results):
+                self.function.change_matrix(results[i]["matrix"])
+                self.make_preview()
+
+        def save():
+            save_search(results, config, message_queue=self.message_queue)
+
+        canvas.bind("<Button-1>", select)
+        Button(dialog, text="save", command=save).pack(side=tk.LEFT,
+                                                       padx=5, pady=5)
+        Button(dialog, text="close", command=dialog.destroy).pack(
+            side=tk.RIGHT, padx=5, pady=5
+        )
+        dialog.bind("<Escape>", lambda _: dialog.destroy())
+    # >>>3
+
     def load_config_file(self, filename):       # <<<3
         try:
             f = open(filename, mode="r")
@@ -5766,14 +9398,91 @@ def main(argv):     # <<<1
 
     --config=...                config file
 
+    --svg                       also save tile / orbifold as an SVG file
+
+    --block-size=...            size of blocks used for computing the image:
+                                "auto" (default), 0 (single block), a number
+                                of pixels or W,H
+
+    --engine=...                engine for wallpaper patterns: "direct"
+                                (default), "fft" (interpolation of values
+                                computed with an FFT, faster for matrices with
+                                many coefficients), "nufft" (non uniform FFT,
+                                for small tolerances) or "auto"
+    --tolerance=...             maximal error of the FFT engines ({tolerance})
+    --hyper-engine=...          engine for hyperbolic patterns: "direct"
+                                (default) or "reduce" (move the points into
+                                the fundamental domain of the modular group
+                                first)
+    --sectors                   for patterns with a rotational symmetry around
+                                the origin (wallpaper N, rosettes), only
+                                compute one sector and interpolate the others
+    --frieze-engine=...         engine for frieze patterns: "direct"
+                                (default) or "period" (compute a single period
+                                and replicate it)
+    --sphere-texture=W          compute the pattern once on the whole sphere
+                                (equirectangular texture of width W) and
+                                interpolate sphere images from it, so that
+                                rotations of the sphere are cheap
+
     --preview                   compute the initial preview image
 
     --batch                     do not run GUI
+                                when several configuration files, glob
+                                patterns or manifests (.jsonl files with one
+                                configuration file or configuration per line)
+                                are given, the images are computed by a pool
+                                of processes; command line options apply to
+                                all the configurations
+    --search=N                  compute thumbnails for N random matrices with
+                                the symmetries of the pattern and save a
+                                contact sheet and configuration files for the
+                                best ones
+    --search-top=K              number of results to save (default: {search_top})
+    --search-size=S             size of the thumbnails (default: {search_size})
+
+    --gallery=FILE              save a contact sheet with an image for each
+                                group (using the colorwheel, matrix or random
+                                matrix parameters from the configuration) and
+                                the corresponding configuration files
+    --gallery-groups=...        comma separated kinds of groups for the
+                                gallery (wallpaper, color-reversing, sphere)
+    --gallery-size=S            size of the images (default: {gallery_size})
+
+    --jobs=N                    number of processes for batch jobs
+    --report=FILE               write a summary of batch jobs to FILE
+
+    --serve=[HOST:]PORT         run a render server (without GUI): POST a JSON
+                                configuration to /render?format=png (or jpeg)
+                                to get the image, GET /status for statistics
+                                (default host: {server_host}, --jobs gives the
+                                number of images computed simultaneously)
 
     --devel                     run in developper mode
 
+    --cache                     use an on disk cache for computed images
+    --cache-dir=DIR             directory for the cache
+                                (default: {cache_dir})
+    --cache-size=MB             maximal size of the cache (default: {cache_size})
+    --cache-fields              also cache the complex values, so that changing
+                                the colorwheel doesn't recompute the pattern
+
+    --profile                   time the different stages of the computation
+                                (batch mode) and save the timings in the
+                                config file
+
+    --benchmark=FILE            run the benchmarks and write results to FILE
+    --benchmark-baseline=FILE   compare benchmark results with FILE
+    --benchmark-threshold=T     slowdown considered as a regression (0.2)
+    --benchmark-patterns=...    comma separated kinds of patterns to
+                                benchmark (wallpaper, color-reversing,
+                                sphere, rosette, frieze, hyperbolic)
+
     -h  /  --help               this message
-""".format(argv[0]))
+""".format(argv[0], cache_dir=CACHE_DIRECTORY, cache_size=CACHE_SIZE//2**20,
+           search_top=SEARCH_TOP, search_size=SEARCH_SIZE,
+           gallery_size=GALLERY_SIZE, server_host=SERVER_HOST,
+           tolerance=FFT_TOLERANCE))
 
     # parsing the command line arguments
     short_options = "hc:o:s:g:v"
@@ -5782,10 +9491,16 @@ def main(argv):     # <<<1
         "color=", "color-geometry=", "color-modulus=", "color-angle=",
         "output=", "size=", "geometry=", "modulus=", "angle=",
         "matrix=", "rotation-symmetry=",
-        "preview",
+        "block-size=", "engine=", "tolerance=", "hyper-engine=",
+        "sectors", "frieze-engine=", "sphere-texture=", "svg", "preview",
         "pattern=", "params=",
-        "config=", "batch",
-        "devel"]
+        "config=", "batch", "jobs=", "report=",
+        "search=", "search-top=", "search-size=",
+        "gallery=", "gallery-groups=", "gallery-size=",
+        "devel", "profile", "serve=",
+        "cache", "cache-dir=", "cache-size=", "cache-fields",
+        "benchmark=", "benchmark-baseline=", "benchmark-threshold=",
+        "benchmark-patterns="]
 
     try:
         opts, args = getopt.getopt(argv[1:], short_options, long_options)
@@ -5793,61 +9508,23 @@ def main(argv):     # <<<1
         print(str(err))
         sys.exit(-1)
 
-    config = {
-        "colorwheel": {
-            # "filename": None,
-            "default_color": DEFAULT_COLOR,
-            "geometry": COLOR_GEOMETRY,
-            "modulus": 1,
-            "angle": 0,
-            "stretch": False,
-        },
-        "output": {
-            "size": OUTPUT_SIZE,
-            "geometry": OUTPUT_GEOMETRY,
-            "modulus": 1,
-            "angle": 0,
-            "filename_template": FILENAME_TEMPLATE,
-            "save_directory": "./",
-            "draw_tile": False,
-            "draw_orbifold": False,
-            "draw_color_tile": False,
-            "draw_mirrors": False,
-            "fade": False,
-            "fade_coeff": FADE_COEFF,
-            "display_mode": "plain",
-            "sphere_rotations": SPHERE_ROTATIONS,
-            "inversion_center": INVERSION_CENTER,
-            "sphere_background": DEFAULT_BACKGROUND,
-            "sphere_background_fading": 100,
-            "sphere_stars": NB_STARS,
-            "morph": False,
-            "morph_start": 0,
-            "morph_end": 180,
-            "morph_stable_coeff": 20,
-        },
-        "function": {
-            "matrix": None,
-            "pattern_type": "wallpaper",
-            "wallpaper_pattern": "o",
-            "wallpaper_color_pattern": "",
-            "lattice_parameters": [],
-            "sphere_pattern": "332",
-            "random_nb_coeffs": 3,
-            "random_min_degre": -3,
-            "random_max_degre": 3,
-            "random_modulus": 1,
-            "random_noise": 25,
-            "wallpaper_N": 1,
-            "sphere_N": 5,
-            "sphere_mode": "sphere",
-            "hyper_nb_steps": 25,
-            "hyper_s": 3,
-        },
-        "preview": False,
-        "working_directory": "./"}
+    config = default_config()
     batch = False
     config_files = []
+    benchmark = {}
+    cache = None
+    nb_jobs = None
+    report = None
+    search = {}
+    gallery = {}
+    serve = None
+    # (section, key) of the configuration given on the command line, which
+    # apply to all the configurations in batch mode
+    options = set([])
+
+    def set_option(d, k, v):
+        config[d][k] = v
+        options.add((d, k))
 
     def get_config(file):
         nonlocal config, config_files
@@ -5857,7 +9534,7 @@ def main(argv):     # <<<1
             cfg = json.load(f)
             for d in ["colorwheel", "output", "function"]:
                 for k in cfg[d]:
-                    config[d][k] = cfg[d][k]
+                    set_option(d, k, cfg[d][k])
             if cfg.get("preview", False):
                 config["preview"] = True
         except:
@@ -5869,57 +9546,58 @@ def main(argv):     # <<<1
             display_help()
             sys.exit(0)
         elif o in ["-c", "--color"]:
-            config["colorwheel"]["filename"] = a
+            set_option("colorwheel", "filename", a)
         elif o in ["-o", "--output"]:
-            config["output"]["filename_template"] = a
+            set_option("output", "filename_template", a)
         elif o in ["-s", "--size"]:
             try:
                 tmp = map(int, re.split(r"[,x]", a))
                 width, height = tmp
-                config["output"]["size"] = (width, height)
+                set_option("output", "size", (width, height))
             except:
                 error("problem with size '{}'".format(a))
                 sys.exit(1)
         elif o in ["-g", "--geometry"]:
             try:
                 x_min, x_max, y_min, y_max = str_to_floats(a)
-                config["output"]["geometry"] = x_min, x_max, y_min, y_max
+                set_option("output", "geometry", (x_min, x_max, y_min, y_max))
             except:
                 error("problem with geometry '{}' for output".format(a))
                 sys.exit(1)
         elif o in ["--rotation-symmetry"]:
             try:
-                config["function"]["wallpaper_N"] = int(a)
+                set_option("function", "wallpaper_N", int(a))
             except:
                 error("problem with rotational symmetry '{}'".format(a))
         elif o in ["--modulus"]:
             try:
-                config["output"]["modulu"] = float(a)
+                set_option("output", "modulus", float(a))
             except:
                 error("problem with modulus '{}'".format(a))
                 sys.exit(1)
         elif o in ["--angle"]:
             try:
-                config["output"]["angle"] = float(a)
+                set_option("output", "angle", float(a))
             except:
                 error("problem with angle '{}'".format(a))
                 sys.exit(1)
         elif o in ["--color-geometry"]:
             try:
                 x_min, x_max, y_min, y_max = str_to_floats(a)
-                config["colorwheel"]["geometry"] = x_min, x_max, y_min, y_max
+                set_option("colorwheel", "geometry",
+                           (x_min, x_max, y_min, y_max))
             except:
                 error("problem with geometry '{}' for color image".format(a))
                 sys.exit(1)
         elif o in ["--color-modulus"]:
             try:
-                config["colorwheel"]["modulus"] = float(a)
+                set_option("colorwheel", "modulus", float(a))
             except:
                 error("problem with modulus '{}'".format(a))
                 sys.exit(1)
         elif o in ["--color-angle"]:
             try:
-                config["colorwheel"]["angle"] = float(a)
+                set_option("colorwheel", "angle", float(a))
             except:
                 error("problem with angle '{}'".format(a))
                 sys.exit(1)
@@ -5928,53 +9606,229 @@ def main(argv):     # <<<1
             # print("pattern:", pattern)
             if "/" in pattern:
                 color_pattern, pattern = pattern.split("/")
-                config["function"]["pattern_type"] = "wallpaper"
-                config["function"]["wallpaper_pattern"] = pattern
-                config["function"]["wallpaper_color_pattern"] = color_pattern
-                config["output"]["display_mode"] = "plain"
-            elif pattern in W_NAMES:
-                config["function"]["pattern_type"] = "wallpaper"
-                config["function"]["wallpaper_pattern"] = pattern
-                config["output"]["display_mode"] = "plain"
-            elif pattern in S_NAMES:
-                config["function"]["pattern_type"] = "sphere"
-                config["function"]["sphere_pattern"] = pattern
-                config["output"]["display_mode"] = "sphere"
-                config["output"]["sphere_stars"] = NB_STARS
+                set_option("function", "pattern_type", "wallpaper")
+                set_option("function", "wallpaper_pattern", pattern)
+                set_option("function", "wallpaper_color_pattern",
+                           color_pattern)
+                set_option("output", "display_mode", "plain")
+            elif pattern in [p.split()[0] for p in W_NAMES()]:
+                set_option("function", "pattern_type", "wallpaper")
+                set_option("function", "wallpaper_pattern", pattern)
+                set_option("output", "display_mode", "plain")
+            elif pattern in [p.split()[0] for p in S_NAMES()]:
+                set_option("function", "pattern_type", "sphere")
+                set_option("function", "sphere_pattern", pattern)
+                set_option("output", "display_mode", "sphere")
+                set_option("output", "sphere_stars", NB_STARS)
             elif pattern == "hyperbolic":
-                config["function"]["pattern_type"] = "hyperbolic"
-                config["output"]["display_mode"] = "inversion"
-                config["output"]["sphere_stars"] = 0
+                set_option("function", "pattern_type", "hyperbolic")
+                set_option("output", "display_mode", "inversion")
+                set_option("output", "sphere_stars", 0)
 
         elif o in ["--params"]:
-            config["function"]["lattice_parameters"] = str_to_floats(a)
+            set_option("function", "lattice_parameters", str_to_floats(a))
         elif o in ["--N"]:
-            config["function"]["sphere_N"] = int(a)
+            set_option("function", "sphere_N", int(a))
+        elif o == "--block-size":
+            try:
+                if a == "auto":
+                    set_option("output", "block_size", a)
+                elif re.search(r"[,x]", a):
+                    width, height = map(int, re.split(r"[,x]", a))
+                    set_option("output", "block_size", (width, height))
+                else:
+                    set_option("output", "block_size", int(a))
+            except:
+                error("problem with block size '{}'".format(a))
+                sys.exit(1)
+        elif o == "--engine":
+            if a not in ["direct", "fft", "nufft", "auto"]:
+                error("unknown engine '{}'".format(a))
+                sys.exit(1)
+            set_option("function", "wallpaper_engine", a)
+        elif o == "--hyper-engine":
+            if a not in ["direct", "reduce"]:
+                error("unknown engine '{}'".format(a))
+                sys.exit(1)
+            set_option("function", "hyper_engine", a)
+        elif o == "--tolerance":
+            try:
+                set_option("function", "fft_tolerance", float(a))
+                assert config["function"]["fft_tolerance"] > 0
+            except (ValueError, AssertionError):
+                error("problem with tolerance '{}'".format(a))
+                sys.exit(1)
+        elif o == "--sectors":
+            set_option("function", "rotation_sectors", True)
+        elif o == "--sphere-texture":
+            try:
+                set_option("output", "sphere_texture", int(a))
+                assert config["output"]["sphere_texture"] >= 0
+            except (ValueError, AssertionError):
+                error("problem with texture width '{}'".format(a))
+                sys.exit(1)
+        elif o == "--frieze-engine":
+            if a not in ["direct", "period"]:
+                error("unknown engine '{}'".format(a))
+                sys.exit(1)
+            set_option("function", "frieze_engine", a)
+        elif o == "--svg":
+            set_option("output", "svg_overlay", True)
         elif o == "--preview":
             config["preview"] = True
         elif o in ["--matrix"]:
-            config["function"]["matrix"] = parse_matrix(a)
+            set_option("function", "matrix", parse_matrix(a))
         elif o == "--config":
             get_config(a)
         elif o == "--batch":
             batch = True
         elif o == "--gui":
             batch = False
+        elif o == "--jobs":
+            try:
+                nb_jobs = int(a)
+            except ValueError:
+                error("problem with number of jobs '{}'".format(a))
+                sys.exit(1)
+        elif o == "--report":
+            report = a
+        elif o == "--gallery":
+            gallery["filename"] = a
+        elif o == "--gallery-groups":
+            gallery["kinds"] = [k.strip() for k in a.split(",")]
+        elif o == "--gallery-size":
+            try:
+                gallery["size"] = int(a)
+            except ValueError:
+                error("problem with gallery size '{}'".format(a))
+                sys.exit(1)
+        elif o in ["--search", "--search-top", "--search-size"]:
+            try:
+                search[o[2:]] = int(a)
+            except ValueError:
+                error("problem with {} '{}'".format(o, a))
+                sys.exit(1)
+        elif o == "--serve":
+            host, _, port = a.rpartition(":")
+            try:
+                serve = (host or SERVER_HOST, int(port))
+            except ValueError:
+                error("problem with server address '{}'".format(a))
+                sys.exit(1)
         elif o == "--devel":
             global DEVEL
             DEVEL = True
+        elif o == "--cache":
+            cache = cache or {}
+        elif o == "--cache-dir":
+            cache = cache or {}
+            cache["directory"] = a
+        elif o == "--cache-size":
+            cache = cache or {}
+            try:
+                cache["max_size"] = int(float(a) * 2**20)
+            except ValueError:
+                error("problem with cache size '{}'".format(a))
+                sys.exit(1)
+        elif o == "--cache-fields":
+            cache = cache or {}
+            cache["fields"] = True
+        elif o == "--profile":
+            global PROFILER
+            PROFILER = Profiler()
+        elif o == "--benchmark":
+            benchmark["filename"] = a
+        elif o == "--benchmark-baseline":
+            benchmark["baseline"] = a
+        elif o == "--benchmark-threshold":
+            try:
+                benchmark["threshold"] = float(a)
+            except ValueError:
+                error("problem with threshold '{}'".format(a))
+                sys.exit(1)
+        elif o == "--benchmark-patterns":
+            benchmark["patterns"] = [p.strip() for p in a.split(",")]
         else:
             assert False
 
-    if len(args) == 1:
+    # several configurations (or a glob pattern / manifest) in batch mode are
+    # computed by ``run_batch``
+    many = batch and (len(args) > 1 or
+                      nb_jobs is not None or
+                      report is not None or
+                      any(glob.has_magic(a) or a.endswith(".jsonl")
+                          for a in args))
+    if len(args) == 1 and not many:
         get_config(args[0])
-    elif len(args) > 1:
+    elif len(args) > 1 and not batch:
         error("cannot give more than one argument on the command line: '{}'"
               .format(args))
         sys.exit(1)
 
+    if "filename" in benchmark:
+        sys.exit(1 if run_benchmarks(**benchmark) else 0)
+
+    if cache is not None:
+        global RENDER_CACHE
+        try:
+            RENDER_CACHE = RenderCache(**cache)
+        except OSError as e:
+            error("cannot use cache directory: {}".format(e))
+
+    if serve is not None:
+        try:
+            server = render_server(
+                RenderService(cache=RENDER_CACHE, nb_renders=nb_jobs or 1),
+                *serve)
+        except OSError as e:
+            error("cannot start server: {}".format(e))
+            sys.exit(1)
+        message("serving on http://{}:{}/".format(*server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        sys.exit(0)
+
+    if "filename" in gallery:
+        sys.exit(1 if make_gallery(config=config, nb_jobs=nb_jobs, **gallery)
+                 else 0)
+
+    if "search" in search:
+        def search_progress(n, total):
+            if sys.stderr.isatty():
+                sys.stderr.write("\rrandom search: {}/{}".format(n, total))
+                if n == total:
+                    sys.stderr.write("\n")
+
+        config = normalize_config(config)
+        results = random_search(config,
+                                nb_candidates=search["search"],
+                                size=search.get("search-size", SEARCH_SIZE),
+                                nb_jobs=nb_jobs,
+                                progress=search_progress)
+        message("saved {}".format(save_search(
+            results, config, top=search.get("search-top", SEARCH_TOP))))
+        sys.exit(0)
+
+    if many:
+        # options given on the command line apply to all the configurations
+        overrides = {"colorwheel": {}, "output": {}, "function": {}}
+        for d, k in options:
+            overrides[d][k] = config[d][k]
+        sys.exit(1 if run_batch(args, overrides, nb_jobs, report) else 0)
+
     # print("main PID", os.getpid())
     if batch:
+        # the GUI (and Tk) is not needed to compute a single image
+        if config_files == [] and os.path.isfile(".create_symmetry.ct"):
+            try:
+                with open(".create_symmetry.ct", mode="r") as f:
+                    merge_config(config, json.load(f))
+            except (OSError, ValueError, KeyError, TypeError):
+                error("could read config file '.create_symmetry.ct'")
+        config = normalize_config(config)
         if config["function"]["matrix"] is None:
             config["function"]["matrix"] = random_matrix(
                 config["function"]["random_nb_coeffs"],
@@ -5982,6 +9836,21 @@ def main(argv):     # <<<1
                 config["function"]["random_max_degre"],
                 config["function"]["random_modulus"],
             )
+        img = make_image(
+            color=config["colorwheel"],
+            output=config["output"],
+            function=config["function"],
+            as_array=True,
+            progress=progress_bar if sys.stderr.isatty() else None,
+            cache=RENDER_CACHE
+        )
+        if config["output"]["fade"]:
+            with profile("fade", img.shape[0]*img.shape[1]):
+                fade_array(img, fade_coefficient(config["output"]), out=img)
+        save_image(image=img, **config)
+        if PROFILER is not None:
+            message(PROFILER.summary())
+        return
 
     gui = CreateSymmetry()
     gui.config = config
@@ -5990,17 +9859,6 @@ def main(argv):     # <<<1
         gui.load_config_file(".create_symmetry.ct")
         # gui.function.change_matrix(fourrier_identity(20))
 
-    if batch:
-        img = make_image(
-            color=config["colorwheel"],
-            output=config["output"],
-            function=config["function"]
-        )
-        if gui.output.config["fade"]:
-            img = fade_image(img)
-        save_image(image=img, **gui.config)
-        return
-
     if config["preview"]:
         gui.make_preview()
 